@@ -0,0 +1,85 @@
+"""Benchmark: loading a large catalog, & looking tracks up in it.
+
+Fills a Catalog with synthetic tracks (bypassing the XML parsers), then times
+assorted ad-hoc lookups: by words in the artist & title (through the trigram
+index), by exact artist, by duration, & by location.
+
+Run from the top of the source tree:
+
+    python bench/catalog.py [TRACKS...]
+
+"""
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import rubepl.catalog
+
+DEFAULT_SIZES = [100000, 500000]
+
+# Each lookup is repeated this many times; the median is reported
+REPEAT = 21
+
+WORDS = ['love', 'night', 'blue', 'heart', 'river', 'morning', 'fire',
+         'ghost', 'summer', 'dancing', 'rain', 'shadow', 'train', 'window',
+         'golden', 'highway', 'stranger', 'silver', 'whisper', 'thunder']
+
+def generate(ntracks, seed=0):
+    rng = random.Random(seed)
+    for i in range(ntracks):
+        artist = 'Artist {0:05d}'.format(i % 20011)
+        title = ' '.join(rng.choice(WORDS) for j in range(3)) + \
+            ' {0}'.format(i)
+        location = '/music/{0}/{1}.mp3'.format(artist, title)
+        yield location, artist, title, 120 + i % 400
+
+def median(f):
+    times = []
+    for i in range(REPEAT):
+        start = time.perf_counter()
+        result = f()
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return times[len(times) // 2], result
+
+def main(sizes):
+    tmp = tempfile.mkdtemp()
+    try:
+        print('{0:>10} {1:>10} {2:<32} {3:>8} {4:>10}'.
+              format('tracks', 'load secs', 'lookup', 'found', 'ms'))
+        for n in sizes:
+            path = os.path.join(tmp, 'catalog.db')
+            with rubepl.catalog.Catalog(path) as catalog:
+                start = time.perf_counter()
+                catalog.replace('itunes', generate(n))
+                load = time.perf_counter() - start
+                probe = '/music/Artist {0:05d}/'.format(7)
+                target = [loc for loc, artist, title, duration in generate(n)
+                          if loc.startswith(probe)][0]
+                lookups = [
+                    ('words "ghost thunder 4242"',
+                     lambda: catalog.find('ghost thunder 4242')),
+                    ('words "golden" (first 50)',
+                     lambda: catalog.find('golden')),
+                    ('artist "artist 00007"',
+                     lambda: catalog.find(artist='artist 00007', limit=None)),
+                    ('duration 300s +/- 0',
+                     lambda: catalog.find(duration=300, tolerance=0,
+                                          limit=None)),
+                    ('location', lambda: catalog.by_location([target]))]
+                for name, f in lookups:
+                    secs, result = median(f)
+                    print('{0:>10} {1:>10.2f} {2:<32} {3:>8} {4:>10.3f}'.
+                          format(n, load, name, len(result), secs * 1000.0))
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.unlink(path + suffix)
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,129 @@
+"""Benchmark: decoding a corpus of mixed-encoding playlists.
+
+Generates playlists in each of the encodings we meet in the wild (pure ASCII,
+UTF-8, CP1252, and UTF-8 polluted with stray CP1252 bytes, as Winamp used to
+write them, both lightly & heavily), under both '.m3u' & '.m3u8' names, then
+decodes every one twice:
+
+    - 'legacy': the codec is chosen by extension alone & bad bytes are handed
+      to the 'fb_cp1252' error handler one at a time
+    - 'sniff': rubepl.decode.decode_file (encoding detection & bulk repair)
+
+For each, we report the time taken & the number of playlists that either
+failed to decode or decoded to something other than the text they were
+generated from.
+
+Run from the top of the source tree:
+
+    python bench/decode.py [TRACKS]
+
+"""
+
+import codecs
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import rubepl.decode
+
+DEFAULT_TRACKS = 50000
+
+NAMES = ['Björk', 'Sigur Rós', 'Mötley Crüe', 'Café Tacvba', 'Beyoncé',
+         'Hüsker Dü', 'Blue Öyster Cult', 'Motörhead', 'Queensrÿche']
+
+def generate_text(rng, ntracks, accented):
+    lines = ['#EXTM3U']
+    for i in range(ntracks):
+        if rng.random() < accented:
+            artist = rng.choice(NAMES)
+        else:
+            artist = 'Artist {0}'.format(i)
+        lines.append('#EXTINF:{0},{1} - Title {2}'.format(i % 600, artist, i))
+        lines.append('M:\\{0}\\{1} - Title {2}.mp3'.format(i % 26, artist, i))
+    return '\n'.join(lines) + '\n'
+
+def polluted(text, rng, frac):
+    """Encode 'text' as UTF-8, except for a fraction 'frac' of its lines, which
+    get CP1252"""
+    out = []
+    for line in text.splitlines(True):
+        out.append(line.encode('cp1252' if rng.random() < frac else 'utf_8'))
+    return b''.join(out)
+
+def generate(tmp, ntracks):
+    rng = random.Random(0)
+    text = generate_text(rng, ntracks, 0.3)
+    dense = generate_text(rng, ntracks, 1.0)
+    ascii_text = text.encode('ascii', 'replace').decode('ascii')
+    corpus = {
+        'ascii': (ascii_text.encode('ascii'), ascii_text),
+        'utf8': (text.encode('utf_8'), text),
+        'utf8-bom': (codecs.BOM_UTF8 + text.encode('utf_8'), text),
+        'cp1252': (text.encode('cp1252'), text),
+        'polluted': (polluted(text, rng, 0.2), text),
+        'polluted-dense': (polluted(dense, rng, 0.6), dense),
+    }
+    files = []
+    for name, (data, expected) in sorted(corpus.items()):
+        for ext in ('.m3u', '.m3u8'):
+            path = os.path.join(tmp, name + ext)
+            with open(path, 'wb') as fh:
+                fh.write(data)
+            files.append((path, expected))
+    return files
+
+def legacy(path):
+    codecs.register_error('fb_cp1252',
+                          rubepl.decode.handle_decode_err_by_fb_cp1252)
+    if '.m3u8' == os.path.splitext(path)[1]:
+        incp, errs = 'utf_8', 'fb_cp1252'
+    else:
+        incp, errs = 'cp1252', 'strict'
+    with open(path, 'r', -1, incp, errs) as fh:
+        return [rubepl.decode.maybe_remove_bom(line) for line in fh]
+
+def run(label, decode, files):
+    bad = 0
+    start = time.perf_counter()
+    for path, expected in files:
+        try:
+            if ''.join(decode(path)) != expected:
+                bad += 1
+        except UnicodeDecodeError:
+            bad += 1
+    elapsed = time.perf_counter() - start
+    print('{0:>8} {1:>10.3f} {2:>6}/{3}'.format(label, elapsed, bad, len(files)))
+
+def main(ntracks):
+    tmp = tempfile.mkdtemp()
+    try:
+        files = generate(tmp, ntracks)
+        mb = sum(os.path.getsize(path) for path, _ in files) / 1e6
+        print('{0} playlists, {1} tracks each, {2:.1f}MB in all'.
+              format(len(files), ntracks, mb))
+        print('{0:>8} {1:>10} {2:>8}'.format('method', 'secs', 'wrong'))
+        run('legacy', legacy, files)
+        run('sniff', rubepl.decode.decode_file, files)
+        print()
+        print('{0:>20} {1:>10} {2:>10} {3:>16}'.format('playlist', 'legacy',
+                                                       'sniff', 'detected'))
+        for path, expected in files:
+            times = []
+            for decode in (legacy, rubepl.decode.decode_file):
+                start = time.perf_counter()
+                try:
+                    decode(path)
+                except UnicodeDecodeError:
+                    pass
+                times.append(time.perf_counter() - start)
+            print('{0:>20} {1:>10.3f} {2:>10.3f} {3:>16}'.format(
+                os.path.basename(path), times[0], times[1],
+                '/'.join(rubepl.decode.choose_codec(path))))
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_TRACKS)
@@ -0,0 +1,89 @@
+"""Benchmark: peak memory of get-tracks, in memory & within a memory budget.
+
+Generates a collection of playlists whose tracks are mostly distinct, then
+runs get-tracks over it in a fresh interpreter, both with '--sort' (one
+in-memory set) & with '--memory-budget' (sorted runs spilled to disk & merged),
+reporting the peak RSS of that interpreter & checking that the two agree.
+
+Run from the top of the source tree:
+
+    python bench/dedupe.py [TRACKS...]
+
+"""
+
+import hashlib
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+DEFAULT_SIZES = [100000, 1000000, 3000000]
+
+PLAYLISTS = 100
+
+BUDGET = '32M'
+
+def generate(tmp, ntracks):
+    files = []
+    per = ntracks // PLAYLISTS
+    for i in range(PLAYLISTS):
+        path = os.path.join(tmp, 'pls{0:03d}.m3u8'.format(i))
+        with open(path, 'w', encoding='utf-8') as fh:
+            fh.write('#EXTM3U\n')
+            # A tenth of each playlist repeats tracks from the one before
+            for j in range(i * per - per // 10, (i + 1) * per):
+                fh.write('#EXTINF:1,Artist {0} - Title {0}\n'.format(j))
+                fh.write('/srv/music/{0}/Artist {1} - Title {1}.mp3\n'.
+                         format(j % 26, j))
+        files.append(path)
+    return files
+
+def child(out, *args):
+    import rubepl
+    with open(out, 'w') as fh:
+        sys.stdout = fh
+        rubepl.main(['get-tracks', '--processes', '1'] + list(args))
+    sys.stdout = sys.__stdout__
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+def main(sizes):
+    tmp = tempfile.mkdtemp()
+    try:
+        print('{0:>10} {1:>20} {2:>14} {3:>10}'.
+              format('tracks', 'mode', 'peak RSS (KB)', 'secs'))
+        for n in sizes:
+            files = generate(tmp, n)
+            outputs = []
+            for mode in (['--sort'], ['--memory-budget', BUDGET,
+                                      '--temp-dir', tmp]):
+                out = os.path.join(tmp, 'out{0}'.format(len(outputs)))
+                start = time.perf_counter()
+                rss = subprocess.check_output(
+                    [sys.executable, __file__, '--child', out] + mode + files,
+                    env=dict(os.environ, PYTHONPATH=os.getcwd()))
+                elapsed = time.perf_counter() - start
+                print('{0:>10} {1:>20} {2:>14} {3:>10.2f}'.
+                      format(n, ' '.join(mode[:2]), int(rss.strip()), elapsed))
+                # Keep only a digest: ru_maxrss survives fork & exec, so
+                # anything we hold would count against the next child
+                digest = hashlib.sha256()
+                with open(out, 'rb') as fh:
+                    for block in iter(lambda: fh.read(1 << 20), b''):
+                        digest.update(block)
+                outputs.append(digest.digest())
+                os.unlink(out)
+            if outputs[0] != outputs[1]:
+                print('outputs differ!')
+            for path in files:
+                os.unlink(path)
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and '--child' == sys.argv[1]:
+        child(*sys.argv[2:])
+    else:
+        main([int(x) for x in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,84 @@
+"""Benchmark: the 'report' command over thousands of playlists.
+
+Generates playlists drawn from a shared library of tracks, a few of them
+near-copies of one another, then times 'report' over them & checks that the
+near-copies are among the pairs reported.
+
+Run from the top of the source tree:
+
+    python bench/report.py [PLAYLISTS...]
+
+"""
+
+import io
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import rubepl
+
+DEFAULT_SIZES = [1000, 5000]
+
+LIBRARY = 200000
+
+TRACKS = 100
+
+COPIES = 20
+
+def generate(tmp, nplaylists):
+    rng = random.Random(nplaylists)
+    files = []
+    playlists = []
+    for i in range(nplaylists):
+        if i < COPIES:
+            # A near-copy (nine tenths the same) of playlist i + COPIES
+            tracks = None
+        else:
+            tracks = rng.sample(range(LIBRARY), TRACKS)
+        playlists.append(tracks)
+    for i in range(COPIES):
+        tracks = list(playlists[i + COPIES])
+        tracks[:TRACKS // 20] = rng.sample(range(LIBRARY), TRACKS // 20)
+        playlists[i] = tracks
+    for i, tracks in enumerate(playlists):
+        path = os.path.join(tmp, 'pls{0:05d}.m3u8'.format(i))
+        with open(path, 'w', encoding='utf-8') as fh:
+            fh.write('#EXTM3U\n')
+            for j in tracks:
+                fh.write('#EXTINF:1,Artist {0} - Title {0}\n'.format(j))
+                fh.write('/srv/music/{0}/Artist {1} - Title {1}.mp3\n'.
+                         format(j % 26, j))
+        files.append(path)
+    return files
+
+def main(sizes):
+    tmp = tempfile.mkdtemp()
+    try:
+        print('{0:>10} {1:>10} {2:>10}'.format('playlists', 'secs', 'found'))
+        for n in sizes:
+            files = generate(tmp, n)
+            out = io.StringIO()
+            start = time.perf_counter()
+            sys.stdout = out
+            try:
+                rubepl.main(['report', '-n', str(COPIES)] + files)
+            finally:
+                sys.stdout = sys.__stdout__
+            elapsed = time.perf_counter() - start
+            pairs = set(tuple(line.split('\t')[1:])
+                        for line in out.getvalue().split('\n')
+                        if line.startswith(('0.', '1.')))
+            found = sum((files[i], files[i + COPIES]) in pairs
+                        for i in range(COPIES))
+            print('{0:>10} {1:>10.2f} {2:>7}/{3}'.
+                  format(n, elapsed, found, COPIES))
+            for path in files:
+                os.unlink(path)
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or DEFAULT_SIZES)
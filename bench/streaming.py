@@ -0,0 +1,68 @@
+"""Benchmark: peak memory of normalize-m3u & get-tracks vs. playlist size.
+
+Generates EXTM3U playlists of increasing size, then normalizes each (and lists
+its tracks) in a fresh interpreter, reporting the peak RSS of that
+interpreter. With the streaming pipeline, peak RSS should be roughly flat as
+the input grows.
+
+Run from the top of the source tree:
+
+    python bench/streaming.py [TRACKS...]
+
+"""
+
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+DEFAULT_SIZES = [10000, 100000, 1000000]
+
+def generate(path, ntracks):
+    with open(path, 'w', encoding='utf-8') as fh:
+        fh.write('#EXTM3U\n')
+        for i in range(ntracks):
+            fh.write('#EXTINF:{0},Artist {1} - Title {1}\n'.format(i % 600, i))
+            fh.write('M:\\{0}\\Artist {1} - Title {1}.mp3\n'.format(i % 26, i))
+
+def child(which, path, outdir):
+    import rubepl.m3u
+    if 'normalize' == which:
+        replacements = rubepl.m3u.Replacements(['\\\\\\\\=>/', 'M:/=>/pub/mp3/'])
+        rubepl.m3u.normalize_m3u_playlist('out', path, None, replacements,
+                                          utf8=True, output=outdir)
+    else:
+        n = 0
+        for track in rubepl.m3u.iter_track_locations(path):
+            n += 1
+    print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+
+def main(sizes):
+    tmp = tempfile.mkdtemp()
+    try:
+        print('{0:>10} {1:>10} {2:>10} {3:>14} {4:>10}'.
+              format('tracks', 'MB', 'command', 'peak RSS (KB)', 'secs'))
+        for n in sizes:
+            path = os.path.join(tmp, 'in-{0}.m3u8'.format(n))
+            generate(path, n)
+            mb = os.path.getsize(path) / 1e6
+            for which in ('normalize', 'tracks'):
+                start = time.perf_counter()
+                out = subprocess.check_output(
+                    [sys.executable, __file__, '--child', which, path, tmp],
+                    env=dict(os.environ, PYTHONPATH=os.getcwd()))
+                elapsed = time.perf_counter() - start
+                print('{0:>10} {1:>10.1f} {2:>10} {3:>14} {4:>10.2f}'.
+                      format(n, mb, which, int(out.strip()), elapsed))
+            os.unlink(path)
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and '--child' == sys.argv[1]:
+        child(*sys.argv[2:5])
+    else:
+        main([int(x) for x in sys.argv[1:]] or DEFAULT_SIZES)
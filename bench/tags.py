@@ -0,0 +1,72 @@
+"""Benchmark: reading artist & title from many audio files' tags.
+
+Generates files with ID3v2.3 tags (each carrying a sizeable cover image ahead
+of the text frames) & ID3v1 tags, then times a TagCache reading them all,
+first cold (every file read) & then warm (every file found in the cache).
+
+Run from the top of the source tree:
+
+    python bench/tags.py [FILES...]
+
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import rubepl.tags
+
+DEFAULT_SIZES = [1000, 10000]
+
+# Bytes of cover art, & of (pretend) audio, in each file
+PICTURE = 256 * 1024
+
+AUDIO = 64 * 1024
+
+def _frame(fid, data):
+    return fid + len(data).to_bytes(4, 'big') + b'\0\0' + data
+
+def generate(tmp, nfiles):
+    picture = _frame(b'APIC', b'\0image/jpeg\0\x03\0' + b'\x89' * PICTURE)
+    audio = b'\xff\xfb' * (AUDIO // 2)
+    files = []
+    for i in range(nfiles):
+        artist = 'Artist {0}'.format(i % 97).encode('latin-1')
+        title = 'Title {0}'.format(i).encode('latin-1')
+        body = picture + _frame(b'TPE1', b'\0' + artist) + \
+            _frame(b'TIT2', b'\0' + title)
+        size = len(body)
+        syncsafe = bytes([(size >> 21) & 0x7f, (size >> 14) & 0x7f,
+                          (size >> 7) & 0x7f, size & 0x7f])
+        path = os.path.join(tmp, '{0:05d}.mp3'.format(i))
+        with open(path, 'wb') as fh:
+            fh.write(b'ID3\x03\x00\x00' + syncsafe + body + audio)
+            fh.write(b'TAG' + b'\0' * 125)
+        files.append(path)
+    return files
+
+def main(sizes):
+    tmp = tempfile.mkdtemp()
+    try:
+        print('{0:>10} {1:>8} {2:>10} {3:>12}'.
+              format('files', 'cache', 'secs', 'files/sec'))
+        for n in sizes:
+            files = generate(tmp, n)
+            db = os.path.join(tmp, 'tags.db')
+            for mode in ('cold', 'warm'):
+                with rubepl.tags.TagCache(db) as cache:
+                    start = time.perf_counter()
+                    tags = cache.read(files)
+                    elapsed = time.perf_counter() - start
+                assert all(tag.title for path, tag in tags)
+                print('{0:>10} {1:>8} {2:>10.2f} {3:>12.0f}'.
+                      format(n, mode, elapsed, n / elapsed))
+            for path in files + [db]:
+                os.unlink(path)
+    finally:
+        shutil.rmtree(tmp)
+
+if __name__ == '__main__':
+    main([int(x) for x in sys.argv[1:]] or DEFAULT_SIZES)
@@ -9,7 +9,10 @@ __version__    = "$Revision: $"
 __maintainer__ = "Michael Herstine <sp1ff@pobox.com>"
 __email__      = "sp1ff@pobox.com"
 __status__     = "Prototype"
-__all__        = ['decode', 'encode', 'm3u', 'winamp']
+__all__        = ['batch', 'catalog', 'content', 'decode', 'diff', 'encode',
+                  'extsort', 'fsindex', 'm3u', 'manifest', 'mapped', 'pipeline',
+                  'prefix', 'profile', 'relocate', 'repair', 'report', 'shared',
+                  'sync', 'tags', 'transcode', 'usage', 'winamp', 'writer']
 
 
 import argparse
@@ -21,7 +24,20 @@ from rubepl.winamp import build_subparser as build_winamp_subparser
 from rubepl.m3u import build_normalize_subparser as build_normalize_subparser
 from rubepl.m3u import build_get_tracks_subparser as build_get_tracks_subparser
 from rubepl.rhythmbox import build_subparser as build_rhythmbox_subparser
+from rubepl.rhythmbox import build_put_subparser as build_put_playlists_subparser
 from rubepl.itunes import build_subparser as build_itunes_subparser
+from rubepl.itunes import build_playlists_subparser as build_itunes_playlists_subparser
+from rubepl.diff import build_subparser as build_diff_subparser
+from rubepl.relocate import build_subparser as build_relocate_subparser
+from rubepl.report import build_subparser as build_report_subparser
+from rubepl.usage import build_index_subparser as build_index_subparser
+from rubepl.usage import build_where_used_subparser as build_where_used_subparser
+from rubepl.content import build_subparser as build_content_index_subparser
+from rubepl.sync import build_subparser as build_sync_subparser
+from rubepl.catalog import build_catalog_subparser as build_catalog_subparser
+from rubepl.catalog import build_find_subparser as build_find_subparser
+from rubepl.pipeline import build_subparser as build_convert_subparser
+from rubepl.batch import build_subparser as build_batch_subparser
 
 def process_playlist_name(title, rename):
     """Compute the new name of a playlist.
@@ -79,7 +95,20 @@ def build_parser():
     build_normalize_subparser(subparsers)
     build_get_tracks_subparser(subparsers)
     build_rhythmbox_subparser(subparsers)
+    build_put_playlists_subparser(subparsers)
     build_itunes_subparser(subparsers)
+    build_itunes_playlists_subparser(subparsers)
+    build_relocate_subparser(subparsers)
+    build_diff_subparser(subparsers)
+    build_index_subparser(subparsers)
+    build_where_used_subparser(subparsers)
+    build_report_subparser(subparsers)
+    build_content_index_subparser(subparsers)
+    build_sync_subparser(subparsers)
+    build_catalog_subparser(subparsers)
+    build_find_subparser(subparsers)
+    build_convert_subparser(subparsers)
+    build_batch_subparser(subparsers)
 
     return parser
 
@@ -112,11 +141,12 @@ def configure_logging(debug=None, logfile=None):
         logger.addHandler(filehand)
 
 def main(args=None):
-    """rubepl entry point"""
+    """rubepl entry point; return the exit status of the command (if it gives
+    one)"""
     try:
         args = build_parser().parse_args(args)
         configure_logging(args.debug)
-        args.func(args)
+        return args.func(args)
     except SystemExit:
         pass
 
@@ -0,0 +1,415 @@
+"""batch.py -- Run many rubepl commands in one process.
+
+A nightly job may run rubepl dozens of times, & each run re-parses the same
+Rhythmbox database, iTunes library or Winamp Music Library. The 'batch'
+command instead reads a job file listing the commands to be run, & runs them
+all in one process, so that
+
+    - inputs loaded by one job are re-used by the rest (cf. shared.py):
+      Rhythmbox databases & playlists, iTunes track maps, Winamp Music
+      Libraries & library snapshots are each loaded once (& regular
+      expressions compiled once)
+
+    - identical jobs are run once
+
+    - jobs are run in parallel, each as soon as those it depends upon have
+      succeeded: a job depends on those named in its 'after' list, & on any
+      earlier job that writes a file it reads or writes, or reads a file it
+      writes (so that jobs sharing files run in the order given)
+
+The job file is JSON, or TOML if its name ends in '.toml'; either way, it
+holds a list of jobs (at the top level, or under the key 'jobs'), e.g.
+
+    [[jobs]]
+    name = "m3u"
+    args = ["get-playlists-xml", "-o", "m3u", "rhythmdb.xml", "playlists.xml"]
+
+    [[jobs]]
+    name = "phone"
+    args = "get-playlists-xml -u -o phone rhythmdb.xml playlists.xml"
+
+    [[jobs]]
+    args = ["sync", "-u", "/mnt/phone", "m3u/Fall 2013.m3u"]
+
+Each job gives the command line of a rubepl sub-command ('args': a list, or
+a string split as by the shell), & optionally a 'name' (by default, 'job N')
+& a list of the names of jobs it must follow ('after'). Relative paths are
+taken relative to the present working directory. When all jobs are done,
+each one's status & run time is printed.
+
+A job's inputs are taken to be its (non-option) arguments & the databases it
+uses; its outputs are its output file or directory (-o, or those of its
+--profiles), the playlists.xml that put-playlists-xml rewrites in place, the
+destination (& playlist directory) of a sync, the database written by
+'index', 'catalog' or 'content-index', & any library snapshot. Anything else
+(e.g. playlists written to the working directory for want of -o) must be
+ordered with 'after'.
+"""
+
+__author__     = "Michael Herstine <sp1ff@pobox.com>"
+__copyright__  = "Copyright (C) 2015, 2016 Michael Herstine"
+__credits__    = ["Michael Herstine"]
+__license__    = "GPL"
+__version__    = "$Revision: $"
+__maintainer__ = "Michael Herstine <sp1ff@pobox.com>"
+__email__      = "sp1ff@pobox.com"
+__status__     = "Prototype"
+
+import collections
+import concurrent.futures
+import json
+import logging
+import os
+import shlex
+import threading
+import time
+
+import rubepl
+
+from rubepl.profile import load_profiles
+from rubepl.shared import SharedInputs
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+log = logging.getLogger(__name__)
+
+# Run at most this many jobs at once, by default
+DEFAULT_WORKERS = os.cpu_count() or 1
+
+# The options naming databases (usage index, catalog & content index), & the
+# command that writes each (the rest only read them)
+_DATABASES = {'database': 'index', 'catalog': 'catalog',
+              'content_index': 'content-index'}
+
+class Job(object):
+    """One job in a batch.
+
+    'name' & 'argv' are as given in the job file; 'args' is the parsed command
+    line; 'deps' is the set of names of the jobs this one depends upon, &
+    'duplicate_of' the name of an earlier, identical job (or None).
+    """
+
+    def __init__(self, name, argv, args, after=()):
+        self.name = name
+        self.argv = argv
+        self.args = args
+        self.deps = set(after)
+        self.duplicate_of = None
+
+    def outputs(self):
+        """Return the set of absolute paths (files or directories) to which
+        this job writes."""
+
+        args = self.args
+        command = self.argv[0]
+        paths = []
+        if getattr(args, 'output', None):
+            paths.append(args.output)
+        elif 'put-playlists-xml' == command:
+            paths.append(args.playlists)
+        if getattr(args, 'profiles', None):
+            paths.extend(profile['output'] for profile in
+                         load_profiles(args.profiles) if 'output' in profile)
+        if 'sync' == command:
+            paths.append(args.dest)
+            if args.playlist_dir:
+                paths.append(args.playlist_dir)
+        for option, writer in _DATABASES.items():
+            if writer == command:
+                paths.append(getattr(args, option))
+        if getattr(args, 'snapshot', None):
+            paths.append(args.snapshot)
+        return set(os.path.abspath(path) for path in paths)
+
+    def inputs(self):
+        """Return the set of absolute paths that this job may read: its
+        arguments that may name files, & the databases it uses."""
+
+        paths = [arg for arg in self.argv[1:] if not arg.startswith('-')]
+        paths.extend(getattr(self.args, option) for option in _DATABASES
+                     if getattr(self.args, option, None))
+        return set(os.path.abspath(path) for path in paths)
+
+def _conflict(these, those):
+    """Return True if any path in 'these' is, contains, or lies under any path
+    in 'those'."""
+
+    for this in these:
+        for that in those:
+            if this == that or this.startswith(that + os.sep) or \
+               that.startswith(this + os.sep):
+                return True
+    return False
+
+# The outcome of one job: 'status' is one of 'ok', 'failed', 'skipped' (a job
+# upon which it depends didn't succeed) or 'duplicate' (of another job, named
+# in 'error')
+Result = collections.namedtuple('Result', ['name', 'status', 'seconds',
+                                           'error'])
+
+def load_jobs(filename):
+    """Read a job file (JSON, or TOML if 'filename' ends in '.toml'); return a
+    list of dictionaries, each with the keys 'name', 'args' (a list) &
+    'after' (a list). Raise ValueError if the file isn't a list of jobs."""
+
+    if filename.endswith('.toml'):
+        if tomllib is None:
+            raise ValueError('{0}: reading TOML requires Python 3.11 or '
+                             'later'.format(filename))
+        with open(filename, 'rb') as fh:
+            doc = tomllib.load(fh)
+    else:
+        with open(filename, 'r', encoding='utf-8') as fh:
+            doc = json.load(fh)
+
+    if isinstance(doc, dict):
+        doc = doc.get('jobs')
+    if not isinstance(doc, list) or not doc:
+        raise ValueError('{0}: expected a non-empty list of jobs'.
+                         format(filename))
+
+    jobs = []
+    for i, job in enumerate(doc, 1):
+        if not isinstance(job, dict) or 'args' not in job:
+            raise ValueError('{0}: job {1} has no "args"'.format(filename, i))
+        argv = job['args']
+        if isinstance(argv, str):
+            argv = shlex.split(argv)
+        after = job.get('after', [])
+        if isinstance(after, str):
+            after = [after]
+        jobs.append({'name': str(job.get('name', 'job {0}'.format(i))),
+                     'args': [str(arg) for arg in argv],
+                     'after': list(after)})
+    return jobs
+
+def plan(jobs):
+    """Parse each of 'jobs' (dictionaries as returned by load_jobs) & work out
+    the dependencies between them; return a list of Jobs. Raise ValueError if
+    a job's command line is invalid, or the dependencies can't be
+    satisfied."""
+
+    parser = rubepl.build_parser()
+    planned = []
+    by_name = {}
+    by_argv = {}
+    for job in jobs:
+        name, argv = job['name'], job['args']
+        if name in by_name:
+            raise ValueError('there is more than one job named "{0}"'.
+                             format(name))
+        if not argv or 'batch' == argv[0]:
+            raise ValueError('job "{0}" names no command (or runs a batch)'.
+                             format(name))
+        try:
+            args = parser.parse_args(argv)
+        except SystemExit:
+            raise ValueError('job "{0}" has an invalid command line: {1}'.
+                             format(name, ' '.join(argv)))
+        if not hasattr(args, 'func'):
+            raise ValueError('job "{0}" names no command'.format(name))
+        job = Job(name, argv, args, job['after'])
+        key = tuple(argv)
+        if key in by_argv:
+            job.duplicate_of = by_argv[key].name
+        else:
+            by_argv[key] = job
+        by_name[name] = job
+        planned.append(job)
+
+    # Dependents of a duplicate depend upon the job it duplicates
+    def resolve(name):
+        if name not in by_name:
+            raise ValueError('no such job: "{0}"'.format(name))
+        job = by_name[name]
+        return job.duplicate_of or name
+
+    # Jobs sharing files run in the order given: each follows any earlier job
+    # writing what it reads or writes, or reading what it writes
+    runnable = [job for job in planned if job.duplicate_of is None]
+    touched = []
+    for job in runnable:
+        job.deps = set(map(resolve, job.deps))
+        writes = job.outputs()
+        reads = job.inputs() - writes
+        for other, theirs in zip(runnable, touched):
+            if _conflict(reads | writes, theirs[1]) or \
+               _conflict(writes, theirs[0]):
+                job.deps.add(other.name)
+        job.deps.discard(job.name)
+        touched.append((reads, writes))
+
+    # Check for cycles (Kahn's algorithm)
+    remaining = dict((job.name, set(job.deps)) for job in runnable)
+    while remaining:
+        ready = [name for name, deps in remaining.items() if not deps]
+        if not ready:
+            raise ValueError('jobs {0} depend upon one another'.format(
+                ', '.join('"{0}"'.format(name) for name in sorted(remaining))))
+        for name in ready:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+
+    return planned
+
+class _ErrorRecorder(logging.Handler):
+    """A logging handler noting the first error logged by each thread being
+    watched.
+
+    Commands report bad inputs by logging an error & returning, rather than
+    by raising, so a job that logged an error has failed.
+    """
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        # {thread ident=>first error message, or None}
+        self._errors = {}
+
+    def watch(self):
+        """Start recording errors logged by the calling thread."""
+
+        with self.lock:
+            self._errors[threading.get_ident()] = None
+
+    def unwatch(self):
+        """Stop recording errors logged by the calling thread; return the
+        first one it logged (or None)."""
+
+        with self.lock:
+            return self._errors.pop(threading.get_ident(), None)
+
+    def emit(self, record):
+        ident = record.thread
+        if ident in self._errors and self._errors[ident] is None:
+            self._errors[ident] = record.getMessage()
+
+def _run_job(job, errors):
+    """Run one job, recording the errors it logs with 'errors' (an
+    _ErrorRecorder); return its Result (run in a worker thread by run)."""
+
+    log.info('{0}: {1}'.format(job.name, ' '.join(job.argv)))
+    start = time.perf_counter()
+    errors.watch()
+    try:
+        job.args.func(job.args)
+    except SystemExit as ex:
+        if ex.code:
+            errors.unwatch()
+            return Result(job.name, 'failed', time.perf_counter() - start,
+                          'exited with status {0}'.format(ex.code))
+    except Exception as ex:
+        errors.unwatch()
+        log.error('{0} failed: {1}'.format(job.name, ex))
+        return Result(job.name, 'failed', time.perf_counter() - start,
+                      str(ex))
+    error = errors.unwatch()
+    if error is not None:
+        return Result(job.name, 'failed', time.perf_counter() - start, error)
+    return Result(job.name, 'ok', time.perf_counter() - start, None)
+
+def run(jobs, workers=DEFAULT_WORKERS, inputs=None):
+    """Run 'jobs' (as returned by plan), up to 'workers' at once, each as soon
+    as the jobs it depends upon have succeeded; return a list of Results, in
+    the order of 'jobs'.
+
+    :param list jobs: the Jobs to be run
+    :param int workers: the maximum number of jobs to run at once
+    :param shared.SharedInputs inputs: the inputs the jobs shall share (a new
+    SharedInputs if None)
+    """
+
+    if inputs is None:
+        inputs = SharedInputs()
+    results = {}
+    pending = collections.OrderedDict((job.name, job) for job in jobs
+                                      if job.duplicate_of is None)
+    running = {}
+    errors = _ErrorRecorder()
+    root = logging.getLogger()
+    root.addHandler(errors)
+    try:
+        with inputs, concurrent.futures.ThreadPoolExecutor(max(workers, 1)) \
+             as pool:
+            while pending or running:
+                progress = True
+                while progress:
+                    progress = False
+                    for job in list(pending.values()):
+                        if not all(dep in results for dep in job.deps):
+                            continue
+                        del pending[job.name]
+                        progress = True
+                        failed = sorted(dep for dep in job.deps
+                                        if 'ok' != results[dep].status)
+                        if failed:
+                            results[job.name] = Result(
+                                job.name, 'skipped', 0.0, 'after {0}'.format(
+                                    ', '.join(failed)))
+                        else:
+                            running[pool.submit(_run_job, job, errors)] = job
+                if not running:
+                    break
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    results[job.name] = future.result()
+    finally:
+        root.removeHandler(errors)
+
+    for job in jobs:
+        if job.duplicate_of is not None:
+            results[job.name] = Result(job.name, 'duplicate', 0.0,
+                                       job.duplicate_of)
+    return [results[job.name] for job in jobs]
+
+def report(results, inputs, elapsed):
+    """Return a list of lines reporting on a batch: a table of each job's
+    status & run time, followed by a summary."""
+
+    width = max([len(result.name) for result in results] + [3])
+    lines = ['{0:<{1}} {2:<9} {3:>8}  {4}'.format('job', width, 'status',
+                                                  'secs', '')]
+    for result in results:
+        lines.append('{0:<{1}} {2:<9} {3:>8.3f}  {4}'.format(
+            result.name, width, result.status, result.seconds,
+            result.error or '').rstrip())
+    counts = collections.Counter(result.status for result in results)
+    lines.append('{0} jobs in {1:.2f}s: {2}; shared inputs: {3} loaded '
+                 '({4:.2f}s), {5} re-used.'.format(
+                     len(results), elapsed, ', '.join(
+                         '{0} {1}'.format(counts[status], status)
+                         for status in ('ok', 'failed', 'skipped', 'duplicate')
+                         if counts[status]),
+                     inputs.loads, inputs.seconds, inputs.hits))
+    return lines
+
+def _batch(args):
+    """Handler for the 'batch' command; return 1 if any job failed or was
+    skipped (so that rubepl exits with that status), else 0."""
+
+    jobs = plan(load_jobs(args.file))
+    inputs = SharedInputs()
+    start = time.perf_counter()
+    results = run(jobs, args.jobs, inputs)
+    print('\n'.join(report(results, inputs, time.perf_counter() - start)))
+    if any(result.status in ('failed', 'skipped') for result in results):
+        return 1
+    return 0
+
+def build_subparser(subparsers, name='batch'):
+    """Build the sub-parser for the 'batch' command."""
+
+    bp = subparsers.add_parser(name=name, help='Run the rubepl commands listed'
+                               + ' in a job file (JSON, or TOML) in one'
+                               + ' process, in parallel where they are'
+                               + ' independent, loading shared inputs once.')
+    bp.add_argument('-j', '--jobs', help='Run at most this many jobs at once'
+                    + ' (default {0})'.format(DEFAULT_WORKERS), type=int,
+                    default=DEFAULT_WORKERS)
+    bp.add_argument('file', help='The job file')
+    bp.set_defaults(func=_batch)
@@ -0,0 +1,375 @@
+"""catalog.py -- One searchable index of the tracks in every library we know.
+
+The iTunes & Rhythmbox matchers each parse their library's XML afresh on every
+run, into dictionaries of different shapes (cf. itunes.build_track_map &
+rhythmbox.build_db). A Catalog instead loads both, once, into an SQLite
+database:
+
+    - a single 'tracks' table (source, location, artist, title, duration in
+      seconds), indexed on location, artist & duration
+    - an FTS5 table over artist & title, using the trigram tokenizer, so that
+      any substring of three or more characters can be looked up through an
+      index rather than by scanning every track
+
+Each source remembers the size & mtime of the file it was loaded from, & is
+only re-loaded once that file changes; so a matcher can ask for a source to
+be loaded on every run, & pay for parsing the XML only when it's needed.
+"""
+
+__author__     = "Michael Herstine <sp1ff@pobox.com>"
+__copyright__  = "Copyright (C) 2015, 2016 Michael Herstine"
+__credits__    = ["Michael Herstine"]
+__license__    = "GPL"
+__version__    = "$Revision: $"
+__maintainer__ = "Michael Herstine <sp1ff@pobox.com>"
+__email__      = "sp1ff@pobox.com"
+__status__     = "Prototype"
+
+import collections
+import logging
+import os
+import sqlite3
+import time
+
+import rubepl.itunes
+import rubepl.rhythmbox
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CATALOG = os.path.expanduser('~/.local/share/rubepl/catalog.db')
+
+# Bump this whenever the schema changes; a catalog of any other version is
+# re-built from scratch
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE sources (name TEXT PRIMARY KEY,
+                      path TEXT NOT NULL,
+                      size INTEGER NOT NULL,
+                      mtime_ns INTEGER NOT NULL);
+CREATE TABLE tracks (id INTEGER PRIMARY KEY,
+                     source TEXT NOT NULL,
+                     location TEXT NOT NULL,
+                     artist TEXT,
+                     title TEXT,
+                     duration INTEGER);
+CREATE INDEX tracks_source ON tracks (source);
+CREATE INDEX tracks_location ON tracks (location);
+CREATE INDEX tracks_artist ON tracks (artist COLLATE NOCASE);
+CREATE INDEX tracks_duration ON tracks (duration);
+CREATE VIRTUAL TABLE tracks_text USING fts5(artist, title, content='tracks',
+                                            content_rowid='id',
+                                            tokenize='trigram');
+"""
+
+# One track in the catalog; duration is in seconds (or None)
+Track = collections.namedtuple('Track', ['source', 'location', 'artist',
+                                         'title', 'duration'])
+
+def _iter_itunes(path):
+    for location, artist, title, duration in \
+            rubepl.itunes.iter_library_tracks(path):
+        yield location, artist, title, duration
+
+def _iter_rhythmbox(path):
+    for location, duration, artist, title in rubepl.rhythmbox.iter_db(path):
+        yield location, artist, title, duration
+
+# Each source the catalog can load, mapped to a function yielding four-tuples
+# (location, artist, title, duration) from the file at a given path
+SOURCES = {'itunes': _iter_itunes, 'rhythmbox': _iter_rhythmbox}
+
+# Substrings shorter than this can't be looked up in a trigram index
+_MIN_INDEXED = 3
+
+# find returns at most this many tracks, by default
+DEFAULT_LIMIT = 50
+
+class Catalog(object):
+    """An on-disk catalog of the tracks in one or more music libraries.
+
+    Use as a context manager:
+
+        with Catalog(path) as catalog:
+            catalog.load('itunes', itunes_xml)
+            for track in catalog.find('pogues novena'):
+                ...
+    """
+
+    def __init__(self, path=DEFAULT_CATALOG, rebuild=False):
+        """Open (or create) the catalog at 'path'; if 'rebuild' is True, or
+        the catalog was written by an incompatible version of this module,
+        discard its contents."""
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA synchronous = NORMAL')
+        version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+        if rebuild or version != SCHEMA_VERSION:
+            with self._conn:
+                for table in ('tracks_text', 'tracks', 'sources'):
+                    self._conn.execute('DROP TABLE IF EXISTS {0}'.
+                                       format(table))
+                self._conn.executescript(_SCHEMA)
+                self._conn.execute('PRAGMA user_version = {0}'.
+                                   format(SCHEMA_VERSION))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        self._conn.close()
+
+    def __len__(self):
+        """Return the number of tracks in the catalog."""
+
+        return self._conn.execute('SELECT COUNT(*) FROM tracks').fetchone()[0]
+
+    def sources(self):
+        """Return a dictionary mapping the name of each source loaded to the
+        path from which it was loaded."""
+
+        return dict(self._conn.execute('SELECT name, path FROM sources'))
+
+    def replace(self, source, tracks, path='', size=0, mtime_ns=0):
+        """Replace the tracks from 'source' with 'tracks', an iterable of
+        four-tuples (location, artist, title, duration); return the number of
+        tracks added.
+
+        'path', 'size' & 'mtime_ns' describe the file from which they were
+        read (cf. load)."""
+
+        conn = self._conn
+        with conn:
+            conn.execute("INSERT INTO tracks_text(tracks_text, rowid, artist, "
+                         "title) SELECT 'delete', id, artist, title FROM "
+                         "tracks WHERE source = ?", (source,))
+            conn.execute('DELETE FROM tracks WHERE source = ?', (source,))
+            first = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM '
+                                 'tracks').fetchone()[0]
+            cur = conn.executemany(
+                'INSERT INTO tracks (source, location, artist, title, '
+                'duration) VALUES (?, ?, ?, ?, ?)',
+                ((source,) + tuple(track) for track in tracks))
+            count = cur.rowcount
+            conn.execute('INSERT INTO tracks_text(rowid, artist, title) '
+                         'SELECT id, artist, title FROM tracks WHERE id >= ?',
+                         (first,))
+            conn.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?)',
+                         (source, path, size, mtime_ns))
+        return count
+
+    def load(self, source, path, force=False):
+        """Load the tracks in the library at 'path' as 'source' (a key in
+        SOURCES), replacing any previously loaded from that source.
+
+        Return the number of tracks loaded, or None if the source was last
+        loaded from the same file, unchanged since (unless 'force' is True).
+        """
+
+        if source not in SOURCES:
+            raise ValueError('unknown source {0} (expected one of {1})'.
+                             format(source, ', '.join(sorted(SOURCES))))
+        path = os.path.abspath(path)
+        st = os.stat(path)
+        row = self._conn.execute('SELECT path, size, mtime_ns FROM sources '
+                                 'WHERE name = ?', (source,)).fetchone()
+        if not force and row == (path, st.st_size, st.st_mtime_ns):
+            log.debug('{0} ({1}) is up-to-date.'.format(source, path))
+            return None
+        start = time.perf_counter()
+        count = self.replace(source, SOURCES[source](path), path, st.st_size,
+                             st.st_mtime_ns)
+        log.debug('loaded {0} tracks from {1} ({2}) in {3:.2f}s.'.format(
+            count, source, path, time.perf_counter() - start))
+        return count
+
+    def find(self, text=None, artist=None, duration=None, source=None,
+             tolerance=2, limit=DEFAULT_LIMIT):
+        """Search the catalog; return a list of Tracks.
+
+        :param str text: whitespace-separated words, each of which must
+        appear (case-insensitively) somewhere in the artist or title
+        :param str artist: the artist, exactly (but case-insensitively)
+        :param int duration: the duration, in seconds
+        :param str source: only search tracks from this source
+        :param int tolerance: match durations within this many seconds
+        :param int limit: return at most this many tracks (None for all)
+
+        Words of three or more characters are looked up in the trigram index;
+        shorter ones just filter the tracks that it (or the other criteria)
+        produce. Tracks are returned in the order in which they were loaded,
+        rather than ranked: ranking means scoring every match before the
+        first can be returned, which for a common word in a large catalog
+        costs hundreds of milliseconds, where taking the first 'limit'
+        matches costs one or two.
+        """
+
+        words = text.split() if text else []
+        indexed = [word for word in words if len(word) >= _MIN_INDEXED]
+        query = 'SELECT t.source, t.location, t.artist, t.title, ' + \
+            't.duration FROM tracks t'
+        where = []
+        params = []
+        if indexed:
+            query += ' JOIN tracks_text ON tracks_text.rowid = t.id'
+            where.append('tracks_text MATCH ?')
+            params.append(' '.join('"{0}"'.format(word.replace('"', '""'))
+                                   for word in indexed))
+        for word in words:
+            if len(word) < _MIN_INDEXED:
+                where.append("(instr(lower(t.artist), ?) OR "
+                             "instr(lower(t.title), ?))")
+                params.extend([word.lower()] * 2)
+        if artist is not None:
+            where.append('t.artist = ? COLLATE NOCASE')
+            params.append(artist)
+        if duration is not None:
+            where.append('t.duration BETWEEN ? AND ?')
+            params.extend([duration - tolerance, duration + tolerance])
+        if source is not None:
+            where.append('t.source = ?')
+            params.append(source)
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += ' ORDER BY ' + ('tracks_text.rowid' if indexed else 't.id')
+        if limit is not None:
+            query += ' LIMIT ?'
+            params.append(limit)
+        return [Track(*row) for row in self._conn.execute(query, params)]
+
+    def by_location(self, locations, source=None):
+        """Return a dictionary mapping each of 'locations' in the catalog to
+        its Track (the last loaded, should a location appear more than
+        once)."""
+
+        out = {}
+        locations = list(locations)
+        clause = '' if source is None else ' AND source = ?'
+        for i in range(0, len(locations), 500):
+            batch = locations[i:i+500]
+            params = batch + ([] if source is None else [source])
+            for row in self._conn.execute(
+                    'SELECT source, location, artist, title, duration FROM '
+                    'tracks WHERE location IN ({0}){1} ORDER BY id'.format(
+                        ', '.join('?' * len(batch)), clause), params):
+                out[row[1]] = Track(*row)
+        return out
+
+    def track_map(self, source='itunes'):
+        """Return a dictionary mapping (artist, title) to (location, duration)
+        for the tracks from 'source', as itunes.build_track_map would."""
+
+        return dict(((artist, title), (location, duration))
+                    for location, artist, title, duration in
+                    self._conn.execute(
+                        'SELECT location, artist, title, duration FROM tracks '
+                        'WHERE source = ? ORDER BY id', (source,)))
+
+def add_arguments(parser):
+    """Add the option naming the catalog to an argparse parser."""
+
+    parser.add_argument('-K', '--catalog', help='Location of the catalog '
+                        + '(default {0})'.format(DEFAULT_CATALOG),
+                        default=DEFAULT_CATALOG, metavar='FILE')
+
+def add_matcher_arguments(parser):
+    """Add the option asking a matcher (e.g. itunify-m3u) to use a catalog
+    to an argparse parser."""
+
+    parser.add_argument('-K', '--catalog', help='Look tracks up in the '
+                        + 'catalog at FILE (loading the library into it first,'
+                        + ' if changed since last loaded; cf. the catalog '
+                        + 'command), rather than parsing the library',
+                        metavar='FILE')
+
+def from_args(args):
+    """Open the Catalog named by parsed arguments (cf. add_matcher_arguments);
+    return None if none was named."""
+
+    if not args.catalog:
+        return None
+    return Catalog(args.catalog)
+
+def _catalog(args):
+    """Handler for the 'catalog' command."""
+
+    start = time.perf_counter()
+    with Catalog(args.catalog, args.rebuild) as catalog:
+        for source, path in (('itunes', args.itunes_db),
+                             ('rhythmbox', args.rhythmbox_db)):
+            if not path:
+                continue
+            count = catalog.load(source, path, args.force)
+            if count is None:
+                log.info('{0}: {1} is unchanged.'.format(source, path))
+            else:
+                log.info('{0}: loaded {1} tracks from {2}.'.
+                         format(source, count, path))
+        log.info('{0} tracks catalogued, in {1:.2f}s.'.format(
+            len(catalog), time.perf_counter() - start))
+
+def _find(args):
+    """Handler for the 'find' command: print each match on one line (source,
+    location, artist, title & duration, separated by tabs)."""
+
+    start = time.perf_counter()
+    with Catalog(args.catalog) as catalog:
+        tracks = catalog.find(' '.join(args.words), args.artist,
+                              args.duration, args.source, args.tolerance,
+                              args.limit or None)
+    for track in tracks:
+        print('\t'.join('' if field is None else str(field)
+                        for field in track))
+    log.debug('{0} tracks found in {1:.3f}ms.'.format(
+        len(tracks), (time.perf_counter() - start) * 1000.0))
+
+def build_catalog_subparser(subparsers, name='catalog'):
+    """Build the sub-parser for the 'catalog' command."""
+
+    ca = subparsers.add_parser(name=name, help='Load the tracks in an iTunes '
+                               + 'library and/or a Rhythmbox database into a '
+                               + 'catalog, for quick searching (cf. find) & '
+                               + 'matching; libraries unchanged since they '
+                               + 'were last loaded are skipped.')
+    ca.add_argument('-i', '--itunes-db', help='path to the iTunes XML file'
+                    + ' containing the music library', metavar='FILE')
+    ca.add_argument('-y', '--rhythmbox-db', help='path to the Rhythmbox '
+                    + 'database (typically ' + rubepl.rhythmbox.DEFAULT_DB
+                    + ')', metavar='FILE')
+    ca.add_argument('-f', '--force', help='Re-load libraries even if they '
+                    + 'appear to be unchanged', action='store_true')
+    ca.add_argument('--rebuild', help='Discard the existing catalog & start '
+                    + 'over', action='store_true')
+    add_arguments(ca)
+    ca.set_defaults(func=_catalog)
+
+def build_find_subparser(subparsers, name='find'):
+    """Build the sub-parser for the 'find' command."""
+
+    fi = subparsers.add_parser(name=name, help='Search the catalog (cf. '
+                               + 'catalog) for tracks whose artist or title '
+                               + 'contain each of the given words.')
+    fi.add_argument('words', help='Words to be found in the artist or title',
+                    nargs='*')
+    fi.add_argument('-a', '--artist', help='Only tracks by exactly this artist'
+                    + ' (case-insensitively)')
+    fi.add_argument('-d', '--duration', help='Only tracks of this duration, '
+                    + 'in seconds (give or take --tolerance)', type=int)
+    fi.add_argument('-t', '--tolerance', help='Tolerance for --duration, in '
+                    + 'seconds (default %(default)s)', type=int, default=2)
+    fi.add_argument('-s', '--source', help='Only tracks from this library',
+                    choices=sorted(SOURCES))
+    fi.add_argument('-n', '--limit', help='Print at most N tracks; 0 for all '
+                    + '(default %(default)s)', type=int, default=DEFAULT_LIMIT,
+                    metavar='N')
+    add_arguments(fi)
+    fi.set_defaults(func=_find)
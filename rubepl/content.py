@@ -0,0 +1,387 @@
+"""content.py -- Which audio files are the same recording?
+
+A library that has grown by accretion holds the same recording under several
+paths: a track ripped twice, an album copied into a compilation's folder.
+Playlists then name one copy or another more or less at random, which defeats
+anything that matches tracks by location. A ContentIndex finds such copies by
+their content, & keeps what it learns in an SQLite database so that a rescan
+only reads files that have changed:
+
+    1. walk the library (cf. fsindex.walk) & stat each audio file; files whose
+       size & mtime are as recorded are not read at all
+    2. for the rest, find where the audio itself lies: past any ID3v2 tags or
+       FLAC metadata blocks at the start of the file, & before any APEv2 or
+       ID3v1 tag at its end. Tags change when a file is re-tagged; the audio
+       doesn't, so identity is a matter of the audio alone
+    3. group files by the size of their audio; only files in a group of two
+       or more can have duplicates, & only they are hashed (via mmap, in a pool
+       of threads: hashlib releases the GIL while hashing large buffers)
+
+Each group of files with the same audio has a 'canonical' member, the path
+that sorts first; canonical_map maps each of the others to it, & is suitable
+for relocating playlist entries (cf. relocate.MoveMap).
+
+Other tag formats (MP4 atoms, Ogg comment packets) are interleaved with the
+audio; such files are identified by their entire content.
+"""
+
+__author__     = "Michael Herstine <sp1ff@pobox.com>"
+__copyright__  = "Copyright (C) 2015, 2016 Michael Herstine"
+__credits__    = ["Michael Herstine"]
+__license__    = "GPL"
+__version__    = "$Revision: $"
+__maintainer__ = "Michael Herstine <sp1ff@pobox.com>"
+__email__      = "sp1ff@pobox.com"
+__status__     = "Prototype"
+
+import concurrent.futures
+import hashlib
+import logging
+import mmap
+import os
+import sqlite3
+import time
+
+from rubepl.fsindex import DEFAULT_WORKERS, walk
+
+log = logging.getLogger(__name__)
+
+DEFAULT_INDEX = os.path.expanduser('~/.local/share/rubepl/content.db')
+
+# Files with these extensions (compared case-insensitively) are indexed
+AUDIO_EXTENSIONS = ('.aac', '.aif', '.aiff', '.ape', '.flac', '.m4a', '.mp2',
+                    '.mp3', '.mpc', '.ogg', '.opus', '.wav', '.wma', '.wv')
+
+# Bump this whenever the schema changes; an index of any other version is
+# re-built from scratch
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE files (path BLOB PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime_ns INTEGER NOT NULL,
+                    audio_offset INTEGER NOT NULL,
+                    audio_size INTEGER NOT NULL,
+                    digest BLOB) WITHOUT ROWID;
+CREATE INDEX files_by_audio_size ON files(audio_size);
+CREATE INDEX files_by_digest ON files(digest);
+"""
+
+# Hash the audio this many bytes at a time
+_CHUNK_SIZE = 1 << 20
+
+def _blob(text):
+    """Encode a path for storage."""
+
+    return text.encode('utf-8', 'surrogateescape')
+
+def _text(blob):
+    """Decode a path read back from the index."""
+
+    return bytes(blob).decode('utf-8', 'surrogateescape')
+
+def _syncsafe(data):
+    """Decode an ID3v2 'syncsafe' integer (seven bits per byte)."""
+
+    n = 0
+    for byte in data:
+        n = (n << 7) | (byte & 0x7f)
+    return n
+
+def audio_range(buf):
+    """Return a two-tuple (offset, length) locating the audio in 'buf' (the
+    contents of an audio file, as bytes or an mmap): everything but any
+    leading ID3v2 tags or FLAC metadata blocks, & any trailing APEv2 or ID3v1
+    tag."""
+
+    start, end = 0, len(buf)
+    # ID3v2 (perhaps more than one), then FLAC's metadata blocks
+    while end - start >= 10 and b'ID3' == buf[start:start+3]:
+        header = buf[start:start+10]
+        start += 10 + _syncsafe(header[6:10]) + (10 if header[5] & 0x10 else 0)
+    if b'fLaC' == buf[start:start+4]:
+        pos = start + 4
+        while pos + 4 <= end:
+            header = buf[pos:pos+4]
+            pos += 4 + int.from_bytes(header[1:4], 'big')
+            if header[0] & 0x80:
+                break
+        start = pos
+    # ID3v1, &/or APEv2 (which may precede it)
+    if end - start >= 128 and b'TAG' == buf[end-128:end-125]:
+        end -= 128
+    if end - start >= 32 and b'APETAGEX' == buf[end-32:end-24]:
+        footer = buf[end-32:end]
+        size = int.from_bytes(footer[12:16], 'little')
+        flags = int.from_bytes(footer[20:24], 'little')
+        end -= size + (32 if flags & 0x80000000 else 0)
+    start = min(start, len(buf))
+    return start, max(end - start, 0)
+
+def _map(fh):
+    """Map the file open on 'fh' into memory (or return b'', if it's empty)."""
+
+    if not os.fstat(fh.fileno()).st_size:
+        return b''
+    return mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _examine(path, known):
+    """Stat 'path' &, if it's changed since it was last examined, find its
+    audio (run in a worker thread by ContentIndex.update).
+
+    :param str path: the file of interest
+    :param tuple known: the row recorded for 'path' (size, mtime_ns,
+    audio_offset, audio_size, digest), or None
+    :return: a two-tuple (path, row), where 'row' is 'known' if 'path' is
+    unchanged; None if 'path' can't be read
+    """
+
+    try:
+        with open(path, 'rb') as fh:
+            st = os.fstat(fh.fileno())
+            if known and (st.st_size, st.st_mtime_ns) == known[:2]:
+                return path, known
+            buf = _map(fh)
+            try:
+                offset, length = audio_range(buf)
+            finally:
+                if buf:
+                    buf.close()
+    except OSError as ex:
+        log.warning('failed to read {0}: {1}'.format(path, ex))
+        return path, None
+    return path, (st.st_size, st.st_mtime_ns, offset, length, None)
+
+def _digest(path, offset, length):
+    """Hash 'length' bytes of 'path' starting at 'offset' (run in a worker
+    thread by ContentIndex.update); return the digest, or None if 'path'
+    can't be read."""
+
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        with open(path, 'rb') as fh:
+            buf = _map(fh)
+            if not buf:
+                return digest.digest()
+            if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                buf.madvise(mmap.MADV_SEQUENTIAL)
+            try:
+                with memoryview(buf) as view:
+                    for i in range(offset, offset + length, _CHUNK_SIZE):
+                        digest.update(view[i:min(i + _CHUNK_SIZE,
+                                                 offset + length)])
+            finally:
+                buf.close()
+    except (OSError, ValueError) as ex:
+        log.warning('failed to hash {0}: {1}'.format(path, ex))
+        return None
+    return digest.digest()
+
+class ContentIndex(object):
+    """A persistent index of audio files by content.
+
+    Use as a context manager:
+
+        with ContentIndex(path) as index:
+            index.update(roots)
+            for paths in index.duplicates():
+                ...
+
+    After update, the attributes 'examined', 'skipped' & 'hashed' count the
+    files read for their tags, those found unchanged, & those hashed.
+    """
+
+    def __init__(self, path=DEFAULT_INDEX, rebuild=False):
+        """Open (or create) the index at 'path'; if 'rebuild' is True, or the
+        index was written by an incompatible version of this module, discard
+        its contents."""
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA synchronous = NORMAL')
+        version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+        if rebuild or version != SCHEMA_VERSION:
+            with self._conn:
+                self._conn.execute('DROP TABLE IF EXISTS files')
+                self._conn.executescript(_SCHEMA)
+                self._conn.execute('PRAGMA user_version = {0}'.
+                                   format(SCHEMA_VERSION))
+        self.examined = 0
+        self.skipped = 0
+        self.hashed = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        self._conn.close()
+
+    def __len__(self):
+        """Return the number of files in the index."""
+
+        return self._conn.execute('SELECT COUNT(*) FROM files').fetchone()[0]
+
+    def update(self, roots, workers=DEFAULT_WORKERS,
+               extensions=AUDIO_EXTENSIONS):
+        """Bring the index up-to-date with respect to the audio files under
+        'roots'.
+
+        :param list roots: the directories to be indexed
+        :param int workers: the number of threads with which to walk, read &
+        hash files
+        :param tuple extensions: index only files with these extensions
+
+        Files previously indexed under 'roots' that are no longer there are
+        dropped; files indexed under other roots are left alone (but are
+        compared with those under 'roots').
+        """
+
+        start = time.perf_counter()
+        conn = self._conn
+        roots = [os.path.abspath(root) for root in roots]
+        known = {}
+        for row in conn.execute('SELECT * FROM files'):
+            known[_text(row[0])] = tuple(row[1:])
+
+        found = {}
+        with concurrent.futures.ThreadPoolExecutor(max(workers, 1)) as pool:
+            futures = []
+            for directory, files, subdirs in walk(roots, workers):
+                for path in files:
+                    if path.lower().endswith(extensions):
+                        futures.append(pool.submit(_examine, path,
+                                                   known.get(path)))
+            for future in futures:
+                path, row = future.result()
+                if row is None:
+                    continue
+                if row is known.get(path):
+                    self.skipped += 1
+                else:
+                    self.examined += 1
+                found[path] = row
+
+        gone = [path for path in known if path not in found and
+                any(path.startswith(os.path.join(root, '')) for root in roots)]
+        with conn:
+            conn.executemany('DELETE FROM files WHERE path = ?',
+                             ((_blob(path),) for path in gone))
+            conn.executemany('INSERT OR REPLACE INTO files VALUES '
+                             '(?, ?, ?, ?, ?, ?)',
+                             ((_blob(path),) + row
+                              for path, row in found.items()
+                              if row is not known.get(path)))
+        log.debug('walked {0} in {1:.2f}s: {2} files examined, {3} unchanged, '
+                  '{4} gone.'.format(', '.join(roots),
+                                     time.perf_counter() - start,
+                                     self.examined, self.skipped, len(gone)))
+
+        # Hash every file sharing its audio size with another, unless it's
+        # been hashed already (files with no audio at all, e.g. nothing but
+        # tags, would all hash alike, so they're never duplicates)
+        todo = [(_text(path), offset, length) for path, offset, length in
+                conn.execute('SELECT path, audio_offset, audio_size '
+                             'FROM files WHERE digest IS NULL AND '
+                             'audio_size > 0 AND audio_size '
+                             'IN (SELECT audio_size FROM files '
+                             'GROUP BY audio_size HAVING COUNT(*) > 1)')]
+        with concurrent.futures.ThreadPoolExecutor(max(workers, 1)) as pool:
+            digests = list(pool.map(lambda args: _digest(*args), todo))
+        with conn:
+            conn.executemany('UPDATE files SET digest = ? WHERE path = ?',
+                             ((digest, _blob(path)) for (path, offset, length),
+                              digest in zip(todo, digests)
+                              if digest is not None))
+        self.hashed += len(todo)
+        log.debug('hashed {0} files; {1:.2f}s in all.'.
+                  format(len(todo), time.perf_counter() - start))
+
+    def duplicates(self):
+        """Yield a sorted list of paths for each group of files with the same
+        audio (the first being the canonical path)."""
+
+        group, last = [], None
+        for digest, path in self._conn.execute(
+                'SELECT digest, path FROM files WHERE audio_size > 0 AND '
+                'digest IN (SELECT digest FROM files WHERE digest IS NOT NULL '
+                'AND audio_size > 0 GROUP BY digest HAVING COUNT(*) > 1) '
+                'ORDER BY digest'):
+            if digest != last and group:
+                yield sorted(group)
+                group = []
+            group.append(_text(path))
+            last = digest
+        if group:
+            yield sorted(group)
+
+    def canonical_map(self):
+        """Return a dictionary mapping the path of each file with duplicates
+        to the canonical path for its audio (omitting canonical paths
+        themselves)."""
+
+        moves = {}
+        for paths in self.duplicates():
+            for path in paths[1:]:
+                moves[path] = paths[0]
+        return moves
+
+    def canonical(self, path):
+        """Return the canonical path for the audio in 'path' ('path' itself
+        if it has no duplicates, or isn't in the index)."""
+
+        rows = self._conn.execute(
+            'SELECT MIN(other.path) FROM files AS this JOIN files AS other '
+            'USING (digest) WHERE this.path = ? AND this.audio_size > 0',
+            (_blob(path),)).fetchone()
+        return _text(rows[0]) if rows[0] is not None else path
+
+def add_arguments(parser):
+    """Add the options common to the content index commands to an argparse
+    parser."""
+
+    parser.add_argument('-C', '--content-index', help='Location of the '
+                        + 'content index (default {0})'.format(DEFAULT_INDEX),
+                        default=DEFAULT_INDEX, metavar='FILE')
+
+def _content_index(args):
+    """Handler for the 'content-index' command.
+
+    With --duplicates, print each group of files with the same audio on one
+    line, canonical path first, separated by tabs.
+    """
+
+    with ContentIndex(args.content_index, args.rebuild) as index:
+        index.update(args.roots, args.jobs)
+        log.info('{0} files examined, {1} unchanged, {2} hashed.'.format(
+            index.examined, index.skipped, index.hashed))
+        if args.duplicates:
+            for paths in index.duplicates():
+                print('\t'.join(paths))
+
+def build_subparser(subparsers, name='content-index'):
+    """Build the sub-parser for the 'content-index' command."""
+
+    ci = subparsers.add_parser(name=name, help='Index the audio files under '
+                               + 'one or more directories by content, to find '
+                               + 'the same recording under different paths '
+                               + '(cf. relocate --canonical); files unchanged '
+                               + 'since they were last indexed are not read.')
+    ci.add_argument('roots', help='Directories to be indexed', nargs='+')
+    ci.add_argument('--duplicates', help='Print each group of files '
+                    + 'with the same audio, one group per line',
+                    action='store_true')
+    ci.add_argument('-j', '--jobs', help='Number of threads with which to '
+                    + 'read & hash files (default {0})'.format(DEFAULT_WORKERS),
+                    type=int, default=DEFAULT_WORKERS)
+    ci.add_argument('--rebuild', help='Discard the existing index & start '
+                    + 'over', action='store_true')
+    add_arguments(ci)
+    ci.set_defaults(func=_content_index)
@@ -13,10 +13,39 @@ __status__     = "Prototype"
 
 import codecs
 import html.parser
+import io
 import logging
 import os
+import re
 import urllib.parse
 
+# Read at most this many bytes of a playlist when guessing its encoding
+SNIFF_SIZE = 1 << 20
+
+# If at least one byte in this many is a stray CP1252 byte in an otherwise
+# UTF-8 playlist, repair them in bulk, rather than one at a time
+BULK_REPAIR_DENSITY = 48
+
+# When repairing CP1252 characters in bulk, work on blocks of this many
+# characters at a time
+REPAIR_BLOCK_SIZE = 1 << 20
+
+# The ASCII bytes (deleting these from a buffer leaves only the high bytes)
+_ASCII_BYTES = bytes(range(0x80))
+
+# The 'surrogateescape' error handler decodes each undecodable byte b to the
+# lone surrogate U+DC00+b; this table maps each such surrogate to the CP1252
+# character for b (where there is one).
+_CP1252_REPAIRS = {}
+for _b in range(0x80, 0x100):
+    try:
+        _CP1252_REPAIRS[chr(0xdc00 + _b)] = bytes([_b]).decode('cp1252')
+    except UnicodeDecodeError:
+        pass
+del _b
+
+_ESCAPED_BYTE = re.compile('[\udc80-\udcff]')
+
 
 def decode_track_location(name):
     """iTunes & Rhythmbox encode the locations of audio files as XML-encoded
@@ -74,15 +103,210 @@ def handle_decode_err_by_fb_cp1252(ex):
         return (text, ex.end)
     raise ex
 
+def _repair_byte(match):
+    """re.sub callback for repair_cp1252"""
+
+    try:
+        return _CP1252_REPAIRS[match.group()]
+    except KeyError:
+        text = match.string
+        raw = text.encode('utf_8', 'surrogateescape')
+        start = len(text[:match.start()].encode('utf_8', 'surrogateescape'))
+        raise UnicodeDecodeError('utf-8', raw, start, start + 1,
+                                 'byte is valid in neither UTF-8 nor CP1252')
+
+def repair_cp1252(text):
+    """Repair text decoded as UTF-8 with the 'surrogateescape' error handler
+    by replacing each escaped byte with its CP1252 character.
+
+    This has the same effect as decoding with handle_decode_err_by_fb_cp1252,
+    but in one pass over the text, rather than one trip through the codec
+    error machinery (which restarts the decoder) per bad byte. It is a little
+    more lenient: a truncated multi-byte sequence (e.g. 0xe2 0x80 followed by
+    ASCII) is repaired byte by byte, where the error handler would reject it.
+
+    Raises UnicodeDecodeError if the text contains an escaped byte that is
+    undefined in CP1252 (e.g. 0x81).
+    """
+
+    if text.isascii():
+        return text
+    return _ESCAPED_BYTE.sub(_repair_byte, text)
+
+def decode_bytes(data, encoding, errors='strict'):
+    """Decode the bytes-like object 'data', as str(data, encoding, errors)
+    would, repairing in bulk if 'errors' is 'repair_cp1252'."""
+
+    if 'repair_cp1252' == errors and 'utf-8' == codecs.lookup(encoding).name:
+        return repair_cp1252(str(data, encoding, 'surrogateescape'))
+    return str(data, encoding, errors)
+
+def detect_encoding(data, default=('cp1252', 'strict')):
+    """Guess the encoding of a playlist from its raw bytes.
+
+    :param bytes data: the playlist contents (or the first part thereof)
+    :param tuple default: the (encoding, errors) pair to be returned if 'data'
+    gives us nothing to go on (i.e. it's pure ASCII)
+    :return: a two-tuple (encoding, errors) suitable for passing to open()
+
+    We look, in order, for:
+
+        1. a UTF-8 BOM: UTF-8, falling back to CP1252 for bad bytes
+        2. a UTF-16 BOM: UTF-16
+        3. no bytes >= 0x80 at all: 'default'
+        4. valid UTF-8: UTF-8, falling back to CP1252 (in case 'data' is only
+           the start of the file)
+        5. otherwise, we compare the number of high bytes that form
+           well-formed UTF-8 sequences to the number that don't. If the former
+           win, this is UTF-8 with stray CP1252 characters (Winamp produced a
+           lot of these); else, it's CP1252.
+
+    In the second case of step 5, if at least one byte in BULK_REPAIR_DENSITY
+    is a stray, the error handler returned is 'repair_cp1252' rather than
+    'fb_cp1252'. Both produce the same text, but readers in this module will
+    repair the former in bulk (cf. repair_cp1252), which is cheaper when
+    there are many bad bytes, but has a fixed cost per buffer that isn't
+    worth paying when there are only a few.
+
+    Each step is a single pass over 'data' in C: the high bytes are counted
+    with bytes.translate, and the stray ones by decoding with
+    'surrogateescape' & re-encoding with 'ignore' (which drops exactly the
+    escaped bytes). Both codecs handle those error modes inline, so this is
+    cheap even for large playlists.
+    """
+
+    if data.startswith(codecs.BOM_UTF8):
+        return ('utf_8', 'fb_cp1252')
+    if data.startswith(codecs.BOM_UTF16_LE) or \
+       data.startswith(codecs.BOM_UTF16_BE):
+        return ('utf_16', 'strict')
+
+    high = len(data.translate(None, _ASCII_BYTES))
+    if 0 == high:
+        return default
+
+    text = str(data, 'utf_8', 'surrogateescape')
+    stray = len(data) - len(text.encode('utf_8', 'ignore'))
+    if high - stray < stray:
+        return ('cp1252', 'strict')
+    if stray * BULK_REPAIR_DENSITY >= len(data):
+        return ('utf_8', 'repair_cp1252')
+    return ('utf_8', 'fb_cp1252')
+
 def maybe_remove_bom(line):
     """Check 'line' for a UTF-8 BOM & remove it if it's there. Return the result."""
 
-    binary = line.encode('utf-8')
-    if len(binary) > 2 and 239 == binary[0] and \
-       187 == binary[1] and 191 == binary[2]:
-        binary = binary[3:]
+    if line.startswith('\ufeff'):
+        return line[1:]
+    return line
 
-    return binary.decode('utf-8')
+def choose_codec(filename, codepage=None, head=None):
+    """Decide how 'filename' shall be decoded.
+
+    :param str filename: the file to be read
+    :param str codepage: the caller-specified encoding, if any
+    :param bytes head: the first SNIFF_SIZE bytes of 'filename', if the caller
+    already has them (else we'll read them)
+    :return: a two-tuple (encoding, errors) suitable for passing to open()
+
+    If the caller doesn't specify an encoding, we guess from the first
+    SNIFF_SIZE bytes of the file (cf. detect_encoding). If those are pure
+    ASCII, we go by the extension: UTF-8 for files ending in '.m3u8' (falling
+    back to CP1252 for single bytes that aren't valid UTF-8) and CP1252 for
+    everything else.
+    """
+
+    codecs.register_error('fb_cp1252', handle_decode_err_by_fb_cp1252)
+    codecs.register_error('repair_cp1252', handle_decode_err_by_fb_cp1252)
+
+    if codepage:
+        return (codepage, 'strict')
+
+    ext = (os.path.splitext(filename))[1];
+    if '.m3u8' == ext:
+        default = ('utf_8', 'fb_cp1252')
+    else:
+        default = ('cp1252', 'strict')
+    if head is None:
+        with open(filename, 'rb') as fh:
+            head = fh.read(SNIFF_SIZE)
+    return detect_encoding(head, default)
+
+def _iter_repaired_lines(fh):
+    """Yield the lines of text file 'fh' (opened with the 'surrogateescape'
+    error handler), repairing stray CP1252 bytes a block at a time."""
+
+    carry = ''
+    while True:
+        block = fh.read(REPAIR_BLOCK_SIZE)
+        if not block:
+            break
+        lines = (carry + repair_cp1252(block)).split('\n')
+        carry = lines.pop()
+        yield from [line + '\n' for line in lines]
+    if carry:
+        yield carry
+
+class _PrefixedReader(io.RawIOBase):
+    """A raw binary stream yielding 'head' & then the rest of 'fh'; this puts
+    back the bytes sniffed from a stream that can't be rewound."""
+
+    def __init__(self, head, fh):
+        self._head = memoryview(head)
+        self._fh = fh
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        if self._head:
+            count = min(len(buf), len(self._head))
+            buf[:count] = self._head[:count]
+            self._head = self._head[count:]
+            return count
+        return self._fh.readinto(buf)
+
+    def close(self):
+        self._fh.close()
+        super().close()
+
+def iter_decoded_lines(filename, codepage=None):
+    """Read 'filename' a line at a time, stripping the BOM if present; yield
+    each line as a Python string.
+
+    This is the streaming equivalent of decode_file: only one line need be in
+    memory at a time, no matter how large the file. The encoding is chosen as
+    for decode_file.
+    """
+
+    raw = open(filename, 'rb')
+    try:
+        # Sniff from the handle we'll decode, so that pipes & FIFOs are read
+        # only once
+        head = None
+        if not codepage:
+            head = raw.read(SNIFF_SIZE)
+            if raw.seekable():
+                raw.seek(0)
+            else:
+                raw = io.BufferedReader(_PrefixedReader(head, raw))
+        incp, errs = choose_codec(filename, codepage, head)
+    except:
+        raw.close()
+        raise
+
+    # Rather than invoke the error handler once per bad byte, escape bad bytes
+    # as we read & repair them a block at a time
+    repair = 'repair_cp1252' == errs and 'utf-8' == codecs.lookup(incp).name
+    if repair:
+        errs = 'surrogateescape'
+
+    with io.TextIOWrapper(raw, incp, errs) as fh:
+        lines = _iter_repaired_lines(fh) if repair else fh
+        for line in lines:
+            yield maybe_remove_bom(line)
+            break
+        yield from lines
 
 def decode_file(filename, codepage=None):
     """Read 'filename', strip the BOM if present, strip any leading or trailing
@@ -97,21 +321,4 @@ def decode_file(filename, codepage=None):
     does readlines return when the file is opened with an 'encoding' parameter?
     """
 
-    codecs.register_error('fb_cp1252', handle_decode_err_by_fb_cp1252)
-
-    ext = (os.path.splitext(filename))[1];
-    if codepage:
-        incp = codepage
-        errs = 'strict'
-    elif '.m3u8' == ext:
-        incp = 'utf_8'
-        errs = 'fb_cp1252'
-    else:
-        incp = 'cp1252'
-        errs = 'strict'
-
-    with open(filename, 'r', -1, incp, errs) as fh:
-        lines = fh.readlines();
-    lines[0] = maybe_remove_bom(lines[0])
-
-    return lines
+    return list(iter_decoded_lines(filename, codepage))
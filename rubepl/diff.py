@@ -0,0 +1,378 @@
+"""diff.py -- Compare two versions of an M3U playlist, track by track.
+
+A line-oriented diff of two exports of the same playlist is both slow (on
+playlists of tens of thousands of lines) and noisy (a re-formatted #EXTINF
+line counts as a change, and a track moved from the top to the bottom shows
+up as two unrelated hunks). Here, we compare the playlists as sequences of
+tracks instead:
+
+    1. each track is reduced to a small integer identity (tracks with equal
+       locations get equal integers; #EXTINF information is ignored, or
+       compared only once tracks have been matched up), so that comparing
+       two tracks is comparing two ints
+    2. tracks appearing exactly once in each playlist are matched up first,
+       by finding the longest increasing subsequence of their positions
+       (as in 'patience' diff), & the runs between them compared in turn; in
+       playlists without duplicates, that's all there is to it
+    3. runs with no such tracks are compared with Myers' O(ND) algorithm, in
+       its linear-space form (find the 'middle snake' & recurse on either
+       side of it)
+    4. a track both deleted from one place & inserted at another is reported
+       as moved
+
+Step 2 matters because Myers' algorithm does work proportional to the square
+of the number of differences: a few thousand scattered changes in a 100k
+track playlist would take it seconds. Anchoring on unique tracks confines it
+to the (short) runs between anchors.
+
+Cf. Eugene W. Myers, "An O(ND) Difference Algorithm and Its Variations",
+Algorithmica 1 (1986).
+"""
+
+__author__     = "Michael Herstine <sp1ff@pobox.com>"
+__copyright__  = "Copyright (C) 2015, 2016 Michael Herstine"
+__credits__    = ["Michael Herstine"]
+__license__    = "GPL"
+__version__    = "$Revision: $"
+__maintainer__ = "Michael Herstine <sp1ff@pobox.com>"
+__email__      = "sp1ff@pobox.com"
+__status__     = "Prototype"
+
+import bisect
+import collections
+import logging
+import math
+
+from rubepl.m3u import get_tracks_from_m3u, iter_track_locations
+
+log = logging.getLogger(__name__)
+
+# One difference between two playlists: 'op' is one of '-' (deleted), '+'
+# (inserted), '>' (moved) or '~' (#EXTINF changed, & perhaps moved, too);
+# 'old' & 'new' are one-based positions in the respective playlists (None
+# where not applicable)
+Change = collections.namedtuple('Change', ['op', 'old', 'new', 'location'])
+
+# Myers' algorithm gives up on finding an optimal split of a range once it's
+# seen more than this many differences (or the square root of the total
+# length of the playlists, if greater) cf. _middle_snake
+MIN_COST_LIMIT = 256
+
+def _middle_snake(a, alo, ahi, b, blo, bhi, limit=None):
+    """Find the middle snake of an optimal path through the edit graph of
+    a[alo:ahi] & b[blo:bhi].
+
+    Return a four-tuple (x0, y0, x1, y1): the snake runs from a[x0], b[y0]
+    to a[x1], b[y1] (absolute indices), & a[x0:x1] == b[y0:y1].
+
+    Should the middle snake lie more than 'limit' differences out, give up &
+    return instead the point furthest along any forward path found so far (as
+    an empty snake); the result is a common subsequence that may not be
+    longest, but the work done is bounded (as in GNU diff).
+    """
+
+    n = ahi - alo
+    m = bhi - blo
+    delta = n - m
+    odd = delta & 1
+    maxd = (n + m + 1) // 2
+    off = maxd + 1
+    # vf[off+k]: the furthest x reached on diagonal k by a forward path; vb,
+    # likewise, for a path run backward from (n, m) (x counted from the end)
+    vf = [0] * (2 * off + 1)
+    vb = [0] * (2 * off + 1)
+    for d in range(maxd + 1):
+        if limit is not None and d > limit:
+            # Too expensive: split at the furthest-reaching forward path
+            best = max((vf[off+k] + vf[off+k] - k, vf[off+k], k)
+                       for k in range(1 - d, d, 2)
+                       if vf[off+k] <= n and 0 <= vf[off+k] - k <= m)
+            x, y = best[1], best[1] - best[2]
+            return alo + x, blo + y, alo + x, blo + y
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and vf[off+k-1] < vf[off+k+1]):
+                x = vf[off+k+1]
+            else:
+                x = vf[off+k-1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[alo+x] == b[blo+y]:
+                x += 1
+                y += 1
+            vf[off+k] = x
+            if odd and -(d - 1) <= delta - k <= d - 1 and \
+               x + vb[off+delta-k] >= n:
+                return alo + x0, blo + y0, alo + x, blo + y
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and vb[off+k-1] < vb[off+k+1]):
+                x = vb[off+k+1]
+            else:
+                x = vb[off+k-1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[ahi-1-x] == b[bhi-1-y]:
+                x += 1
+                y += 1
+            vb[off+k] = x
+            if not odd and -d <= delta - k <= d and x + vf[off+delta-k] >= n:
+                return ahi - x, bhi - y, ahi - x0, bhi - y0
+    raise AssertionError('no middle snake')
+
+def _unique_anchors(a, alo, ahi, b, blo, bhi):
+    """Return a list of pairs (i, j), increasing in both, such that a[i] ==
+    b[j] & that element occurs exactly once in each of a[alo:ahi] &
+    b[blo:bhi].
+
+    Among such elements, the longest common subsequence is just the longest
+    increasing subsequence of their positions in 'b' (taken in order of
+    their positions in 'a'), which patience sorting finds in O(N log N).
+    """
+
+    counts = collections.Counter(a[alo:ahi])
+    where = {}
+    for j in range(blo, bhi):
+        x = b[j]
+        if 1 == counts.get(x):
+            where[x] = None if x in where else j
+    pairs = [(i, where[a[i]]) for i in range(alo, ahi)
+             if where.get(a[i]) is not None]
+
+    # tails[k]: the index in 'pairs' of the smallest 'j' ending an increasing
+    # subsequence of length k+1; prev: each pair's predecessor in the longest
+    # subsequence ending with it
+    tails = []
+    tail_js = []
+    prev = [None] * len(pairs)
+    for p, (i, j) in enumerate(pairs):
+        if not tail_js or j > tail_js[-1]:
+            # By far the commonest case: this pair extends the longest
+            k = len(tails)
+        else:
+            k = bisect.bisect_left(tail_js, j)
+        if k:
+            prev[p] = tails[k-1]
+        if k == len(tails):
+            tails.append(p)
+            tail_js.append(j)
+        else:
+            tails[k] = p
+            tail_js[k] = j
+
+    anchors = []
+    p = tails[-1] if tails else None
+    while p is not None:
+        anchors.append(pairs[p])
+        p = prev[p]
+    anchors.reverse()
+    return anchors
+
+def matching_blocks(a, b):
+    """Return a list of three-tuples (i, j, n), sorted, such that a[i:i+n] ==
+    b[j:j+n], describing a common subsequence of 'a' & 'b' (any sequences of
+    hashable elements; small ints are fastest).
+
+    Each range to be compared is first trimmed of any common prefix &
+    suffix. The elements occurring once on each side of what remains are
+    then matched (cf. _unique_anchors), & the runs between them compared in
+    turn; only a range with no such elements is compared with Myers'
+    algorithm. If every element is unique, or none are, the result is a
+    longest common subsequence; otherwise it's very nearly one. Either way,
+    Myers' algorithm, which does work quadratic in the number of differences,
+    only ever sees short runs of them.
+
+    Adjacent blocks are merged, & no block is empty.
+    """
+
+    # Bound the work Myers' algorithm may do on any one range
+    limit = max(MIN_COST_LIMIT, math.isqrt(len(a) + len(b)))
+    blocks = []
+    # (alo, ahi, blo, bhi) ranges yet to be compared, last first
+    todo = [(0, len(a), 0, len(b))]
+    while todo:
+        alo, ahi, blo, bhi = todo.pop()
+        # Common prefix...
+        i = 0
+        while alo + i < ahi and blo + i < bhi and a[alo+i] == b[blo+i]:
+            i += 1
+        if i:
+            blocks.append((alo, blo, i))
+            alo += i
+            blo += i
+        # ...& suffix
+        j = 0
+        while alo < ahi - j and blo < bhi - j and a[ahi-1-j] == b[bhi-1-j]:
+            j += 1
+        if j:
+            blocks.append((ahi - j, bhi - j, j))
+            ahi -= j
+            bhi -= j
+        if alo == ahi or blo == bhi:
+            continue
+
+        anchors = _unique_anchors(a, alo, ahi, b, blo, bhi)
+        if anchors:
+            run = None
+            for ai, bj in anchors:
+                if ai > alo or bj > blo:
+                    todo.append((alo, ai, blo, bj))
+                    run = [ai, bj, 1]
+                    blocks.append(run)
+                elif run:
+                    run[2] += 1
+                else:
+                    run = [ai, bj, 1]
+                    blocks.append(run)
+                alo, blo = ai + 1, bj + 1
+            todo.append((alo, ahi, blo, bhi))
+            continue
+
+        if set(a[alo:ahi]).isdisjoint(b[blo:bhi]):
+            # Nothing in common; Myers would take time quadratic in the size
+            # of the range to establish that
+            continue
+        x0, y0, x1, y1 = _middle_snake(a, alo, ahi, b, blo, bhi, limit)
+        if x1 > x0:
+            blocks.append((x0, y0, x1 - x0))
+        todo.append((x1, ahi, y1, bhi))
+        todo.append((alo, x0, blo, y0))
+
+    blocks.sort(key=lambda block: block[0])
+    merged = []
+    for i, j, n in blocks:
+        if merged and merged[-1][0] + merged[-1][2] == i and \
+           merged[-1][1] + merged[-1][2] == j:
+            merged[-1] = (merged[-1][0], merged[-1][1], merged[-1][2] + n)
+        else:
+            merged.append((i, j, n))
+    return merged
+
+def diff_tracks(old, new, extinf=False):
+    """Compare two lists of tracks, as returned by m3u.get_tracks_from_m3u.
+
+    :param list old: the tracks of the old version of the playlist
+    :param list new: the tracks of the new version
+    :param bool extinf: if True, also report tracks whose #EXTINF information
+    has changed; if False, it's ignored
+    :return: a list of Change instances, in playlist order
+
+    Tracks are matched by location alone; #EXTINF information is only
+    compared between tracks so matched.
+    """
+
+    # Reduce each location to an int
+    ids = {}
+    a = [ids.setdefault(track[0], len(ids)) for track in old]
+    b = [ids.setdefault(track[0], len(ids)) for track in new]
+
+    # Walk the edit script, noting the runs of deletions & insertions
+    # between matching blocks (& the blocks themselves)
+    steps = []
+    i = j = 0
+    for bi, bj, n in matching_blocks(a, b) + [(len(a), len(b), 0)]:
+        if bi > i or bj > j:
+            steps.append((range(i, bi), range(j, bj), None))
+        if n:
+            steps.append((None, None, (bi, bj, n)))
+        i, j = bi + n, bj + n
+
+    # Pair each deletion with an insertion of the same location, if any, in
+    # order: those are moves
+    by_location = collections.defaultdict(collections.deque)
+    for deleted, inserted, block in steps:
+        for i in deleted or ():
+            by_location[a[i]].append(i)
+    moved = {}
+    for deleted, inserted, block in steps:
+        for j in inserted or ():
+            candidates = by_location.get(b[j])
+            if candidates:
+                moved[j] = candidates.popleft()
+    moved_from = set(moved.values())
+
+    # Report deletions where they were, & insertions & moves where they are
+    changes = []
+    for deleted, inserted, block in steps:
+        if block:
+            if extinf:
+                bi, bj, n = block
+                for k in range(n):
+                    if old[bi+k][1] != new[bj+k][1]:
+                        changes.append(Change('~', bi + k + 1, bj + k + 1,
+                                              new[bj+k][0]))
+            continue
+        for i in deleted:
+            if i not in moved_from:
+                changes.append(Change('-', i + 1, None, old[i][0]))
+        for j in inserted:
+            if j in moved:
+                i = moved[j]
+                op = '~' if extinf and old[i][1] != new[j][1] else '>'
+                changes.append(Change(op, i + 1, j + 1, new[j][0]))
+            else:
+                changes.append(Change('+', None, j + 1, new[j][0]))
+    return changes
+
+def diff_playlists(old, new, codepage=None, extinf=False):
+    """Compare two M3U playlists; return a list of Change instances.
+
+    :param str old: path to the old version of the playlist
+    :param str new: path to the new version of the playlist
+    :param str codepage: the encoding of both (None means guess)
+    :param bool extinf: if True, report changes to #EXTINF information, too
+    """
+
+    if extinf:
+        read = get_tracks_from_m3u
+    else:
+        # Then there's no need to decode the #EXTINF lines at all
+        def read(filename, codepage):
+            return [(location, None) for location in
+                    iter_track_locations(filename, codepage)]
+
+    return diff_tracks(read(old, codepage), read(new, codepage), extinf)
+
+def _diff(args):
+    """Handler for the 'diff' command.
+
+    Print one line per change: its op, its position(s) & the track location:
+
+        -12 /music/deleted.mp3
+        +15 /music/inserted.mp3
+        >3:40 /music/moved.mp3
+        ~7:7 /music/retitled.mp3
+
+    With --summary, just print the number of each.
+    """
+
+    changes = diff_playlists(args.old, args.new, args.codepage, args.extinf)
+    if args.summary:
+        counts = collections.Counter(change.op for change in changes)
+        print('{0} inserted, {1} deleted, {2} moved, {3} changed.'.format(
+            counts['+'], counts['-'], counts['>'], counts['~']))
+        return
+    for change in changes:
+        if '-' == change.op:
+            where = change.old
+        elif '+' == change.op:
+            where = change.new
+        else:
+            where = '{0}:{1}'.format(change.old, change.new)
+        print('{0}{1} {2}'.format(change.op, where, change.location))
+
+def build_subparser(subparsers, name='diff'):
+    """Build the sub-parser for the 'diff' command."""
+
+    df = subparsers.add_parser(name=name, help='Compare two M3U playlists '
+                               + 'track by track, reporting insertions ("+"), '
+                               + 'deletions ("-") & moves (">").')
+    df.add_argument('old', help='The old version of the playlist')
+    df.add_argument('new', help='The new version of the playlist')
+    df.add_argument('-c', '--codepage', help='specify the input codepage; if '
+                    + 'not specified, it will be deduced')
+    df.add_argument('-e', '--extinf', help='Also report tracks whose #EXTINF '
+                    + 'information has changed ("~"); by default, it is '
+                    + 'ignored', action='store_true')
+    df.add_argument('-s', '--summary', help='Just print the number of tracks '
+                    + 'inserted, deleted, moved & changed',
+                    action='store_true')
+    df.set_defaults(func=_diff)
@@ -10,30 +10,37 @@ __maintainer__ = "Michael Herstine <sp1ff@pobox.com>"
 __email__      = "sp1ff@pobox.com"
 __status__     = "Prototype"
 
+import os
+import urllib.parse
+
+# The characters GLib leaves unescaped in the path of a 'file://' URI
+# (RFC 3986 sub-delimiters, ':', '@' & '/')
+_URI_PATH_SAFE = "/!$&'()*+,;=:@"
 
 def encode_line(line):
-    """Encode a line of arbitrary text to UTF-8. Remove any trailing whitespace."""
+    """Encode a line of arbitrary text to UTF-8. Remove any trailing whitespace.
 
-    binary = line.encode('utf-8')
-    while 0 < len(binary) and (32 == binary[-1] or # ' '
-                                9 == binary[-1] or # tab
-                               13 == binary[-1] or # CR
-                               10 == binary[-1]):  # NL
-        binary = binary[:-1]
+    Python strings are already Unicode, & space, tab, CR & NL are each a
+    single byte in UTF-8, so this amounts to stripping those characters from
+    the end of 'line'; there's no need to round-trip through 'bytes'.
+    """
 
-    return binary.decode()
+    return line.rstrip(' \t\r\n')
 
 def maybe_add_utf8_bom(line):
     """Add a UTF-8 BOM to 'line' if it's not already there."""
 
-    binary = line.encode('utf-8')
-    if len(binary) > 2 and 239 == binary[0] and \
-       187 == binary[1] and 191 == binary[2]:
+    if line.startswith('\ufeff'):
         return line
+    return '\ufeff' + line
+
+def encode_track_location(path):
+    """Encode a file path as a 'file://' URI, as iTunes & Rhythmbox record
+    track locations: the inverse of decode.decode_track_location, less the
+    XML escaping (which is the business of whoever writes the XML).
 
-    binary = bytearray(binary)
-    binary.insert(0, 191)
-    binary.insert(0, 187)
-    binary.insert(0, 239)
+    The path is %-encoded byte by byte, in UTF-8 (or, for names that aren't
+    valid UTF-8, in the bytes the filesystem actually holds).
+    """
 
-    return binary.decode()
+    return 'file://' + urllib.parse.quote(os.fsencode(path), safe=_URI_PATH_SAFE)
@@ -0,0 +1,154 @@
+"""extsort.py -- Sort & de-duplicate more strings than will fit in memory.
+
+'get-tracks' over a large archive of playlists must remember every track it's
+seen in order not to print it twice; with enough playlists, that set alone
+exceeds the memory available. iter_distinct_sorted trades the set for a
+classic external merge sort: strings are collected (& de-duplicated) in
+memory until a budget is reached, then written out, sorted, to a temporary
+file (a 'run'). Once the input is exhausted, the runs are merged with
+heapq.merge, dropping duplicates as they meet. Memory use is bounded by the
+budget, plus a read buffer per run being merged.
+"""
+
+__author__     = "Michael Herstine <sp1ff@pobox.com>"
+__copyright__  = "Copyright (C) 2015, 2016 Michael Herstine"
+__credits__    = ["Michael Herstine"]
+__license__    = "GPL"
+__version__    = "$Revision: $"
+__maintainer__ = "Michael Herstine <sp1ff@pobox.com>"
+__email__      = "sp1ff@pobox.com"
+__status__     = "Prototype"
+
+import contextlib
+import heapq
+import logging
+import os
+import re
+import sys
+import tempfile
+
+log = logging.getLogger(__name__)
+
+# Merge at most this many runs at once (each holds a file descriptor & a
+# read buffer open)
+DEFAULT_FAN_IN = 64
+
+# Our estimate of the cost of keeping one string in a set, over & above the
+# string itself: a hash table entry (hash & pointer), at two-thirds load
+_SET_ENTRY_OVERHEAD = 24
+
+_SIZE_REGEX = re.compile(r'^\s*([0-9]+)\s*([kmg]?)i?b?\s*$', re.IGNORECASE)
+
+_SIZE_SUFFIXES = {'': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
+
+def parse_size(text):
+    """Parse a size in bytes, with an optional suffix: '512K', '64M', '1G'
+    (or '64MB', '64MiB'); raise ValueError if 'text' isn't one."""
+
+    match = _SIZE_REGEX.match(text)
+    if not match:
+        raise ValueError('{0} is not a size'.format(text))
+    return int(match.group(1)) * _SIZE_SUFFIXES[match.group(2).lower()]
+
+def _write_run(directory, items):
+    """Write 'items' (sorted strings) to a new file in 'directory', one per
+    line; return its path."""
+
+    fd, path = tempfile.mkstemp(suffix='.run', dir=directory)
+    with open(fd, 'w', encoding='utf-8', errors='surrogateescape',
+              newline='\n') as fh:
+        for item in items:
+            fh.write(item)
+            fh.write('\n')
+    return path
+
+def _read_run(path):
+    """Yield each string in the run at 'path'."""
+
+    with open(path, 'r', encoding='utf-8', errors='surrogateescape',
+              newline='\n') as fh:
+        for line in fh:
+            yield line[:-1]
+
+def _distinct(items):
+    """Yield each of 'items' (sorted) but once."""
+
+    last = None
+    for item in items:
+        if item != last:
+            yield item
+            last = item
+
+def _merge(paths):
+    """Yield the distinct strings in the runs at 'paths', sorted."""
+
+    return _distinct(heapq.merge(*map(_read_run, paths)))
+
+def iter_distinct_sorted(items, budget, directory=None,
+                         fan_in=DEFAULT_FAN_IN):
+    """Yield the distinct elements of 'items' in sorted order, using about
+    'budget' bytes of memory.
+
+    :param items: an iterable of strings, none of which contain a newline
+    :param int budget: the (approximate) number of bytes of memory to be used
+    for strings held in memory; once exceeded, they're spilled to disk
+    :param str directory: the directory in which to create temporary files
+    (default: the platform's temporary directory)
+    :param int fan_in: the maximum number of runs to be merged at once; if
+    there are more, they're merged in passes
+
+    The result is exactly sorted(set(items)). If everything fits within the
+    budget, nothing is written to disk at all.
+    """
+
+    with contextlib.ExitStack() as stack:
+        tmp = None
+        runs = []
+        pending = set()
+        used = 0
+        for item in items:
+            if item not in pending:
+                pending.add(item)
+                used += sys.getsizeof(item) + _SET_ENTRY_OVERHEAD
+                if used >= budget:
+                    if tmp is None:
+                        tmp = stack.enter_context(
+                            tempfile.TemporaryDirectory(prefix='rubepl-',
+                                                        dir=directory))
+                    runs.append(_write_run(tmp, sorted(pending)))
+                    log.debug('spilled run {0} ({1} strings).'.
+                              format(len(runs), len(pending)))
+                    pending = set()
+                    used = 0
+
+        if not runs:
+            yield from sorted(pending)
+            return
+        if pending:
+            runs.append(_write_run(tmp, sorted(pending)))
+            pending = None
+
+        # Too many runs to merge at once: merge them in groups until there
+        # aren't
+        while len(runs) > fan_in:
+            merged = []
+            for i in range(0, len(runs), fan_in):
+                group = runs[i:i+fan_in]
+                merged.append(_write_run(tmp, _merge(group)))
+                for path in group:
+                    os.unlink(path)
+            log.debug('merged {0} runs into {1}.'.format(len(runs), len(merged)))
+            runs = merged
+
+        yield from _merge(runs)
+
+def add_arguments(parser):
+    """Add the options controlling external sorting to an argparse parser."""
+
+    parser.add_argument('--memory-budget', help='Bound the memory used to '
+                        + 'de-duplicate tracks by spilling them, sorted, to '
+                        + 'temporary files once SIZE bytes (e.g. 256M) are in '
+                        + 'use; output is then in sorted order (cf. --sort)',
+                        type=parse_size, metavar='SIZE')
+    parser.add_argument('--temp-dir', help='Create temporary files in DIR '
+                        + '(cf. --memory-budget)', metavar='DIR')
@@ -0,0 +1,288 @@
+"""fsindex.py -- Answer "does this file exist?" for many files, quickly.
+
+'get-tracks --check-missing' needs to know, for every distinct track in a set
+of playlists, whether the file is there. Asking the filesystem once per track
+is fine on a local disk, but on a network mount each question is a round trip.
+This module offers two ways around that:
+
+    1. a Snapshot: walk the library roots once, in parallel, with os.scandir,
+       recording a (hashed) set of every path found. Checking a track is then
+       a set lookup. Snapshots may be saved & re-used until they reach a
+       configurable age.
+
+    2. iter_exists: ask the filesystem about many paths at once, from a pool
+       of threads, so that round trips overlap.
+
+The two combine: paths found in a snapshot are taken to exist, and the rest
+are checked against the filesystem (so that files added since the snapshot
+was taken, or reached through a symlinked directory, aren't reported
+missing). Since missing tracks are (hopefully) rare, that's few round trips.
+"""
+
+__author__     = "Michael Herstine <sp1ff@pobox.com>"
+__copyright__  = "Copyright (C) 2015, 2016 Michael Herstine"
+__credits__    = ["Michael Herstine"]
+__license__    = "GPL"
+__version__    = "$Revision: $"
+__maintainer__ = "Michael Herstine <sp1ff@pobox.com>"
+__email__      = "sp1ff@pobox.com"
+__status__     = "Prototype"
+
+import array
+import collections
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import time
+
+from rubepl.shared import shared
+from rubepl.writer import atomic_write
+
+log = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+# Threads used to walk the library, or to stat tracks
+DEFAULT_WORKERS = 16
+
+# Re-use a saved snapshot for at most this many seconds
+DEFAULT_MAX_AGE = 3600
+
+def path_key(path):
+    """Reduce 'path' to the 64-bit integer by which Snapshots know it.
+
+    The path is made absolute & normalized (so 'a/../b' & 'b' are the same
+    path); on case-insensitive platforms, case is folded, too.
+    """
+
+    path = os.path.normcase(os.path.abspath(path))
+    digest = hashlib.blake2b(path.encode('utf-8', 'surrogateescape'),
+                             digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+def _scan(directory):
+    """Scan one directory; return a three-tuple: the directory, a list of the
+    paths of everything in it that isn't a directory, and a list of its
+    sub-directories (not including symlinks to directories, which we don't
+    follow)."""
+
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.is_symlink() and not os.path.exists(entry.path):
+                        # Dangling symlink: os.path.exists would say no
+                        continue
+                    else:
+                        files.append(entry.path)
+                except OSError:
+                    continue
+    except OSError as ex:
+        log.warning('failed to scan {0}: {1}'.format(directory, ex))
+    return directory, files, subdirs
+
+def walk(roots, workers=DEFAULT_WORKERS):
+    """Walk the trees under 'roots' with a pool of 'workers' threads.
+
+    Like os.walk, yield a three-tuple (directory, files, subdirs) for each
+    directory found (where 'files' & 'subdirs' are full paths), but in no
+    particular order: each directory is scanned by a single task, which
+    submits further tasks for its sub-directories, so the walk proceeds across
+    as many directories at once as there are workers.
+    """
+
+    with concurrent.futures.ThreadPoolExecutor(max(workers, 1)) as pool:
+        pending = set(pool.submit(_scan, root) for root in roots)
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                directory, files, subdirs = future.result()
+                for subdir in subdirs:
+                    pending.add(pool.submit(_scan, subdir))
+                yield directory, files, subdirs
+
+class Snapshot(object):
+    """The set of paths under one or more root directories, as of a given
+    time.
+
+    Paths are stored as 64-bit hashes (cf. path_key): a snapshot of a 400k
+    track library is about 3MB on disk, and the chance of a spurious match is
+    negligible.
+    """
+
+    def __init__(self, roots, keys=(), created=None):
+        """Construct from a list of root directories & the keys of the paths
+        found under them."""
+
+        self.roots = sorted(os.path.abspath(root) for root in roots)
+        self.created = time.time() if created is None else created
+        self._keys = set(keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __contains__(self, path):
+        return path_key(path) in self._keys
+
+    def age(self):
+        """Return the age of this snapshot, in seconds."""
+
+        return time.time() - self.created
+
+    @classmethod
+    def build(cls, roots, workers=DEFAULT_WORKERS):
+        """Walk 'roots' with a pool of 'workers' threads (cf. walk) & return
+        a new Snapshot of everything found."""
+
+        start = time.perf_counter()
+        snapshot = cls(roots)
+        keys = snapshot._keys
+        keys.update(map(path_key, snapshot.roots))
+        for directory, files, subdirs in walk(snapshot.roots, workers):
+            keys.update(map(path_key, files))
+            keys.update(map(path_key, subdirs))
+        log.debug('snapshot of {0}: {1} paths in {2:.2f}s.'.format(
+            ', '.join(snapshot.roots), len(keys), time.perf_counter() - start))
+        return snapshot
+
+    @classmethod
+    def load(cls, filename):
+        """Load a Snapshot saved to 'filename'; return None if there's no such
+        file, or it can't be read."""
+
+        try:
+            with open(filename, 'rb') as fh:
+                header = json.loads(fh.readline().decode('utf-8'))
+                if SNAPSHOT_VERSION != header.get('version'):
+                    log.warning('{0}: unknown snapshot version.'.
+                                format(filename))
+                    return None
+                keys = array.array('Q')
+                keys.frombytes(fh.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as ex:
+            log.warning('{0}: unreadable snapshot ({1}).'.format(filename, ex))
+            return None
+        if len(keys) != header['count']:
+            log.warning('{0}: truncated snapshot.'.format(filename))
+            return None
+        return cls(header['roots'], keys, header['created'])
+
+    def save(self, filename):
+        """Atomically write this snapshot to 'filename'."""
+
+        keys = array.array('Q', self._keys)
+        header = {'version': SNAPSHOT_VERSION, 'roots': self.roots,
+                  'created': self.created, 'count': len(keys)}
+        atomic_write(filename, [json.dumps(header).encode('utf-8') + b'\n',
+                                keys.tobytes()])
+
+@shared()
+def get_snapshot(roots, cache=None, max_age=DEFAULT_MAX_AGE,
+                 workers=DEFAULT_WORKERS):
+    """Return a Snapshot of 'roots'.
+
+    :param list roots: the directories of interest
+    :param str cache: if given, a file from which to load the snapshot if it
+    was taken of the same roots less than 'max_age' seconds ago (if not, a new
+    snapshot will be taken & saved there)
+    :param int max_age: maximum age, in seconds, of a re-usable snapshot
+    :param int workers: number of threads with which to walk 'roots'
+    """
+
+    if cache:
+        snapshot = Snapshot.load(cache)
+        if snapshot is not None:
+            if snapshot.roots != sorted(os.path.abspath(root) for root in roots):
+                log.debug('{0} is of different roots; re-building.'.format(cache))
+            elif snapshot.age() > max_age:
+                log.debug('{0} is {1:.0f}s old; re-building.'.
+                         format(cache, snapshot.age()))
+            else:
+                log.debug('re-using {0} ({1:.0f}s old).'.
+                         format(cache, snapshot.age()))
+                return snapshot
+
+    snapshot = Snapshot.build(roots, workers)
+    if cache:
+        snapshot.save(cache)
+    return snapshot
+
+def iter_exists(paths, snapshot=None, workers=DEFAULT_WORKERS, window=None):
+    """Yield a two-tuple (path, exists) for each of 'paths', in order.
+
+    :param paths: an iterable of paths
+    :param Snapshot snapshot: if given, paths in this snapshot are taken to
+    exist without consulting the filesystem
+    :param int workers: number of threads with which to check the remaining
+    paths (if one, they'll be checked in turn, as os.path.exists would)
+    :param int window: the maximum number of paths to have in flight at once
+    (default: sixteen per worker)
+
+    Paths are consumed lazily, & results are yielded as soon as they (and
+    those of all the paths before them) are known.
+    """
+
+    if workers <= 1:
+        for path in paths:
+            yield (path, (snapshot is not None and path in snapshot) or
+                   os.path.exists(path))
+        return
+
+    if window is None:
+        window = 16 * workers
+
+    def ready(result):
+        return isinstance(result, bool) or result.done()
+
+    pending = collections.deque()
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        for path in paths:
+            if snapshot is not None and path in snapshot:
+                pending.append((path, True))
+            else:
+                pending.append((path, pool.submit(os.path.exists, path)))
+            while pending and (len(pending) > window or ready(pending[0][1])):
+                path, result = pending.popleft()
+                yield (path, result if isinstance(result, bool) else result.result())
+        while pending:
+            path, result = pending.popleft()
+            yield (path, result if isinstance(result, bool) else result.result())
+
+def add_arguments(parser):
+    """Add the options controlling existence checks to an argparse parser."""
+
+    parser.add_argument('--library-root', help='Check for missing tracks '
+                        + 'against a snapshot of this directory tree, taken '
+                        + 'once, rather than asking the filesystem about each '
+                        + 'track (may be given more than once)',
+                        action='append', metavar='DIR')
+    parser.add_argument('--snapshot', help='Save the library snapshot to FILE '
+                        + 'and re-use it on subsequent runs (cf. '
+                        + '--snapshot-max-age)', metavar='FILE')
+    parser.add_argument('--snapshot-max-age', help='Re-use a saved snapshot '
+                        + 'for at most this many seconds (default '
+                        + '{0})'.format(DEFAULT_MAX_AGE), type=int,
+                        default=DEFAULT_MAX_AGE, metavar='SECS')
+    parser.add_argument('-j', '--jobs', help='Number of threads with which to '
+                        + 'walk the library or check tracks (default '
+                        + '{0}; 1 checks each track in turn)'.
+                        format(DEFAULT_WORKERS), type=int,
+                        default=DEFAULT_WORKERS)
+
+def from_args(args):
+    """Build a Snapshot from parsed arguments (cf. add_arguments); return None
+    if no library roots were given."""
+
+    if not args.library_root:
+        return None
+    return get_snapshot(args.library_root, args.snapshot,
+                        args.snapshot_max_age, args.jobs)
@@ -12,13 +12,100 @@ import os.path
 import re
 import xml.etree.ElementTree as ET
 
+import rubepl.catalog
+import rubepl.prefix
+import rubepl.tags
+
 from rubepl.encode import encode_line
-from rubepl.decode import decode_file, decode_track_location
+from rubepl.decode import decode_track_location
+from rubepl.manifest import Manifest, fingerprint
+from rubepl.shared import shared
+from rubepl.m3u import Replacements, convert_tracks_to_m3u, \
+    iter_tracks_from_m3u
+from rubepl.writer import PlaylistWriter
 
 ITUNES_XML = os.path.expanduser('~/Music/iTunes/iTunes Music Library.xml')
 
 log = logging.getLogger(__name__)
 
+def _plist_dict(elt):
+    """Convert a plist <dict> element to a dictionary, whose values are the
+    text of each (scalar) value, True or False for booleans, & lists of
+    dictionaries for arrays of dictionaries."""
+
+    children = list(elt)
+    D = dict()
+    for i in range(0, int(len(children)/2)):
+        key, value = children[2*i].text, children[2*i+1]
+        if 'array' == value.tag:
+            D[key] = [_plist_dict(item) for item in value if 'dict' == item.tag]
+        elif value.tag in ('true', 'false'):
+            D[key] = 'true' == value.tag
+        else:
+            D[key] = value.text
+    return D
+
+def iter_library(itunes_xml=ITUNES_XML):
+    """Walk an iTunes library, yielding a two-tuple (section, attributes) for
+    each track (section 'Tracks') & then each playlist (section 'Playlists');
+    cf. _plist_dict.
+
+    The library is read incrementally (cf. xml.etree.ElementTree.iterparse),
+    & each track or playlist discarded (& detached from the tree) once it's
+    been read, so memory use doesn't grow with the size of the library.
+    """
+
+    # The plist is a dictionary (at depth one) two of whose keys are 'Tracks'
+    # & 'Playlists'; the corresponding values are a dictionary mapping track
+    # IDs to tracks, & an array of playlists, all dictionaries at depth three.
+    # 'stack' holds the elements we're inside, so that each can be emptied of
+    # the children we're done with.
+    stack = []
+    section = None
+    for event, elt in ET.iterparse(itunes_xml, events=('start', 'end')):
+        if 'start' == event:
+            stack.append(elt)
+            continue
+        stack.pop()
+        depth = len(stack)
+        if 2 == depth and 'key' == elt.tag:
+            section = elt.text
+        elif 3 == depth and 'dict' == elt.tag and \
+             section in ('Tracks', 'Playlists'):
+            D = _plist_dict(elt)
+            # Detach this dictionary (& the keys before it) from its section
+            stack[-1].clear()
+            yield section, D
+        elif depth <= 3:
+            elt.clear()
+
+def _track_info(D):
+    """Return a four-tuple (location, artist, title, duration) for the track
+    whose attributes are 'D' (duration in seconds, or None), or None if it has
+    no location."""
+
+    if not 'Location' in D:
+        log.warning("'{0}' contains no Location attribute".format(D));
+        return None
+    time = None
+    if 'Total Time' in D:
+        time = int(round(float(D['Total Time']) / 1000.0))
+    return (decode_track_location(D['Location']), D.get('Artist'),
+            D.get('Name'), time)
+
+def iter_library_tracks(itunes_xml=ITUNES_XML):
+    """Walk the tracks in an iTunes library, yielding a four-tuple (location,
+    artist, title, duration) for each (duration in seconds, or None; either of
+    artist & title, but not both, may be None); cf. iter_library."""
+
+    for section, D in iter_library(itunes_xml):
+        if 'Tracks' != section:
+            continue
+        info = _track_info(D)
+        if info and (None != info[1] or None != info[2]):
+            yield info
+
+@shared('itunes_xml')
 def build_track_map(itunes_xml=ITUNES_XML):
     """Build a map of iTunes tracks mapping (artist,title) pairs to
     (location,duration) pairs.
@@ -38,42 +125,16 @@ def build_track_map(itunes_xml=ITUNES_XML):
     N.B. Sometimes iTunes stores the artist in the 'Artist' key, and sometimes it
     stores the entire track name in the 'Name' key
 
-    """
-
-    elts = ET.parse(itunes_xml).getroot().getchildren()[0].getchildren()
+    A catalog (cf. catalog.Catalog.track_map) can produce the same map
+    without parsing the library at all.
 
-    # Find the key named 'Tracks'; the next one will be the dictionary we're
-    # looking for.
-    D = dict()
-    for i in range(0, int(len(elts)/2)):
-        D[elts[2*i].text] = elts[2*i+1]
-
-    tracks = D['Tracks'].getchildren()[1::2]
+    """
 
     out = dict()
-    for track in tracks:
-        D = dict()
-        children = track.getchildren()
-        for i in range(0, int(len(children)/2)):
-            D[children[2*i].text] = children[2*i+1].text
-        if not 'Location' in D:
-            log.warning("'{0}' contains no Location attribute".format(D));
-        else:
-            artist = None
-            name = None
-            time = None
-            if 'Artist' in D:
-                artist = D['Artist']
-            if 'Name' in D:
-                name = D['Name']
-            if 'Total Time' in D:
-                time = int(round(float(D['Total Time']) / 1000.0))
-
-            if None != artist or None != name:
-                location = decode_track_location(D['Location'])
-                log.debug('build_file_map: ({0},{1}) => ({2},{3})'.
-                          format(artist, name, location, time))
-                out[(artist, name)] = (location,time)
+    for location, artist, name, time in iter_library_tracks(itunes_xml):
+        log.debug('build_file_map: ({0},{1}) => ({2},{3})'.
+                  format(artist, name, location, time))
+        out[(artist, name)] = (location,time)
 
     return out
 
@@ -103,18 +164,18 @@ def levenshtein(s, t):
 
     return v1[len(t)]
 
-def _try_to_make_extinf(text):
-    """Take a line of text & try to interpret it as M3U extended track
-    information. If such an interpretation is possible, return the
-    corresponding ExtInfo instance. Else, return None.
+def _make_extinf(extinf):
+    """Take extended track information as parsed by m3u.parse_extinf (a
+    two-tuple (duration, title), or None) & return the corresponding ExtInf
+    instance (or None).
     """
 
-    regex = re.compile('^\\s*#\\s*EXTINF:\\s*([0-9]+),(.*)');
-    what = regex.match(text)
-    if not what:
+    if extinf is None:
         return None
 
-    return ExtInf(int(what.group(1)), what.group(2))
+    # A duration of -1 (or none at all) means "unknown"
+    duration, title = extinf
+    return ExtInf(duration if duration and duration > 0 else None, title or '')
 
 class ExtInf(object):
     """Representation of track extended info convenient for matching iTunes
@@ -131,9 +192,8 @@ class ExtInf(object):
         EXTM3U format playlists will provide the duration & title. My
         (personal) convention is to title tracks "$artist - $title"-- if the
         give title conforms to that convention, we parse the artist & title, as
-        well.
-
-        TODO: Get the artist & title from ID3 tags, as well.
+        well. (The track's own tags, where they can be read, are better still;
+        cf. M3UTrack.)
         """
 
         self._duration = duration
@@ -168,27 +228,36 @@ class ExtInf(object):
     def get_title(self):
         return self._title
 
+    def get_line(self):
+        """Return this extended information as an M3U EXTINF line."""
+        return encode_line('#EXTINF:{0},{1} - {2}'.
+                           format(-1 if self._duration is None else
+                                  self._duration, self._artist, self._title))
+
     def writeln(self, out):
-        out.write('{0}\n'.format(
-            encode_line('#EXTINF:{0},{1} - {2}'.
-                        format(self._duration, self._artist, self._title))))
+        out.write('{0}\n'.format(self.get_line()))
 
 class M3UTrack(object):
     """Representation of a single track in a format convenient for matching iTunes
     tracks."""
 
-    def __init__(self, text, extinfo=None):
+    def __init__(self, text, extinfo=None, tags=None):
         """Initialize a track from an M3U or EXTM3U playlist.
 
         :param ExtInf extinf: Extended track information parsed from an EXTINF
         entry
         :param string text: File path
+        :param tags.Tags tags: the artist & title read from the file itself, if
+        available; these are preferred to anything guessed from the file name
         """
         self._extinfo = extinfo
         name = os.path.splitext(os.path.basename(text))[0]
         regex = re.compile('^([^-]+)-(.*)')
         what = regex.match(name)
-        if what:
+        if tags and tags.artist and tags.title:
+            self._artist = tags.artist
+            self._title = tags.title
+        elif what:
             self._artist = what.group(1).strip()
             self._title = what.group(2).strip()
         elif self._extinfo:
@@ -274,6 +343,10 @@ def match_itunes_track(track, D, max_distance=None):
     """Attempt to match a track as defined in an M3U file to one in a local iTunes
     library.
 
+    Tracks whose artist & title came from their own tags (cf. M3UTrack) will
+    usually be found by the first, exact, lookup; the fuzzier fallbacks are
+    for those whose artist & title had to be guessed.
+
     :param M3UTrack track: The M3U track to be matched with an iTunes track
     :param dict D: A dictionary mapping (artist,title) information to
     (location,duration). Duration shall be in seconds, expressed as a int.
@@ -327,7 +400,8 @@ def match_itunes_track(track, D, max_distance=None):
         return None
 
 def m3u_to_itunes(m3u, outfile, itunes_xml=ITUNES_XML,
-                  codepage=None, max_distance=None):
+                  codepage=None, max_distance=None, replacements=None,
+                  tag_cache=None, catalog=None):
 
     """Convert an arbitrary M3U (or EXTM3U) playlist to one suitable for importing
     into a local iTunes library.
@@ -336,6 +410,14 @@ def m3u_to_itunes(m3u, outfile, itunes_xml=ITUNES_XML,
     :param string outfile: path to the output file
     :param string codepage: codepage (e.g. 'cp1252') to be used to read the
     input file; defaults to 'cp1252'
+    :param m3u.Replacements replacements: optional replacements to be applied
+    to the output playlist (e.g. to map iTunes library locations onto the
+    machine on which the playlist will be used)
+    :param tags.TagCache tag_cache: if given, read each track's artist & title
+    from its tags (where the file can be found), through this cache
+    :param catalog.Catalog catalog: if given, look the library's tracks up in
+    this catalog (loading 'itunes_xml' into it, if changed since it was last
+    loaded) rather than parsing 'itunes_xml'
 
     This function will attempt to match each track in the input M3U file to a
     track in the local iTunes library and produce an M3U playlist containing
@@ -369,9 +451,10 @@ def m3u_to_itunes(m3u, outfile, itunes_xml=ITUNES_XML,
 
     So the best solution, I think, is to read the ID3 tags of the original
     files, use the artist & title fields to index into the iTunes library to
-    get the file's location in iTunes, but I can't do that right now.
+    get the file's location in iTunes. That's what we do when given a
+    'tag_cache' & the files are there to be read (cf. tags.py).
 
-    My fallback solution is:
+    Otherwise, my fallback solution is:
 
     - guess the artist & title from track path in the input M3U file & attempt
       to map them into the iTunes library. If that works, we're done
@@ -400,29 +483,27 @@ def m3u_to_itunes(m3u, outfile, itunes_xml=ITUNES_XML,
         hand.setLevel(logging.DEBUG)
 
     # D will map (artist,title) => (location,duration in sec.)
-    D = build_track_map(itunes_xml)
+    if catalog is not None:
+        catalog.load('itunes', itunes_xml)
+        D = catalog.track_map('itunes')
+    else:
+        D = build_track_map(itunes_xml)
 
     # For each track in 'm3u', build a representation that includes:
     #   * the extended information, if any
     #   * our best guess as to the artist name & track title
-    tracks = list()
-    lines = decode_file(m3u, codepage)
-
-    state = 0
-    extinf = None
-    for i in range(1, len(lines)):
-        log.debug('{0}/{1}: {2}'.format(i, state, lines[i].strip()))
-        if 0 == state:
-            # Next line may be #EXTINF, or it may just be a track
-            extinf = _try_to_make_extinf(lines[i])
-            if extinf:
-                state = 1
-            else:
-                tracks.append(M3UTrack(lines[i]))
-        else:
-            state = 0
-            tracks.append(M3UTrack(lines[i], extinf))
-            extinf = None
+    #   * the artist & title from its tags, if asked for
+    entries = list()
+    for text, extinf in iter_tracks_from_m3u(m3u, codepage, strict=False):
+        log.debug('{0}: {1}'.format(text, extinf))
+        entries.append((text, _make_extinf(extinf)))
+
+    if tag_cache:
+        tags = tag_cache.read(text for text, extinf in entries)
+    else:
+        tags = [(text, None) for text, extinf in entries]
+    tracks = [M3UTrack(text, extinf, tag) for (text, extinf), (path, tag) in
+              zip(entries, tags)]
 
     log.debug(tracks)
 
@@ -439,12 +520,143 @@ def m3u_to_itunes(m3u, outfile, itunes_xml=ITUNES_XML,
 
     # Finally, we'll walk the remaining list, writing the tracks to the output
     # file.
-    with open(outfile, 'w') as out:
-        out.write('{0}\n'.format(encode_line(lines[0])))
-        for (extinfo, location) in matches:
-            if extinfo:
-                extinfo.writeln(out)
-            out.write('{0}\n'.format(encode_line(location)))
+    outlines = [encode_line('#EXTM3U')]
+    for (extinfo, location) in matches:
+        if extinfo:
+            outlines.append(extinfo.get_line())
+        outlines.append(encode_line(location))
+    if replacements:
+        outlines = replacements.process(outlines)
+    PlaylistWriter('utf_8', '\n').write(outfile, outlines)
+
+def iter_library_playlists(itunes_xml=ITUNES_XML, only=None, exclude=None):
+    """Walk the playlists in an iTunes library, yielding a two-tuple (title,
+    tracks) for each, where 'tracks' is a list of two-tuples (location,
+    (duration, title)) suitable for m3u.convert_tracks_to_m3u.
+
+    :param str itunes_xml: path to the iTunes XML file containing the library
+    :param sequence only: An optional sequence of titles; if non-None, only the
+    playlists contained herein will be yielded
+    :param sequence exclude: An optional sequence of titles; if non-None, the
+    playlists contained herein will not be yielded
+
+    The library is read once, front to back (cf. iter_library): the tracks
+    come first, & are kept only as an index mapping each Track ID to a
+    four-tuple (location, duration, artist, title); each playlist's 'Playlist
+    Items' (a list of Track IDs) is resolved against that index as the
+    playlist is read. Items with no location (e.g. tracks held only in the
+    cloud) are dropped.
+
+    Unless named in 'only', the library's own playlists are skipped: the
+    master playlist ('Library'), those iTunes maintains itself ('Music',
+    'Podcasts' & the like, which carry a 'Distinguished Kind'), & folders.
+    """
+
+    index = dict()
+    for section, D in iter_library(itunes_xml):
+        if 'Tracks' == section:
+            info = _track_info(D) if 'Track ID' in D else None
+            if info:
+                location, artist, title, duration = info
+                index[int(D['Track ID'])] = (location, duration, artist, title)
+            continue
+
+        name = D.get('Name')
+        if only and not name in only:
+            continue
+        if exclude and name in exclude:
+            continue
+        if not only and (D.get('Master') or D.get('Folder') or
+                         'Distinguished Kind' in D):
+            log.debug('skipping {0}'.format(name))
+            continue
+
+        tracks = [ ]
+        missing = 0
+        for item in D.get('Playlist Items', []):
+            entry = index.get(int(item.get('Track ID', -1)))
+            if entry is None:
+                missing += 1
+                continue
+            location, duration, artist, title = entry
+            if artist and title:
+                display = '{0} - {1}'.format(artist, title)
+            else:
+                display = artist or title
+            tracks.append((location, (duration, display)))
+        if missing:
+            log.warning('{0}: {1} tracks have no location; skipping them.'.
+                        format(name, missing))
+        yield name, tracks
+
+def library_to_m3u(itunes_xml=ITUNES_XML, rename=None, replacements=None,
+                   utf8=None, only=None, exclude=None, output=None,
+                   use_bom=None, manifest=None, fsync=None):
+    """Extract playlists from an iTunes library & convert them to M3U format.
+
+    :param str itunes_xml: path to the iTunes XML file containing the library
+    :param str rename: Encoding of how the title shall be processed to produce
+    a playlist filename (cf. rubepl.process_playlist_name)
+    :param Replacements replacements: A Replacements instance representing a
+    list of replacements to be made on the output playlists
+    :param bool utf8: If the caller sets this to true, the output files shall
+    be encoded in UTF-8 & have an '.m3u8' extension; else they shall be
+    encoded as CP1252 and have an '.m3u' extension
+    :param sequence only: An optional sequence of titles; if non-None, only the
+    playlists contained herein will be exported
+    :param sequence exclude: An optional sequence of titles; if non-None, the
+    playlists contained herein will not be exported
+    :param str output: the directory to which playlists shall be written
+    :param bool use_bom: If the caller sets this to true, and if the caller set
+    utf8 to true, the UTF-8 BOM shall be added to the first line of each
+    output file
+    :param Manifest manifest: If non-None, the manifest for 'output';
+    playlists whose tracks & options are unchanged since the last run won't be
+    re-written
+    :param bool fsync: If True, flush each output file to stable storage before
+    renaming it into place
+
+    Cf. rhythmbox.playlists_xml_to_m3u, of which this is the iTunes analog.
+    """
+
+    writer = PlaylistWriter('utf_8' if utf8 else 'cp1252', fsync=fsync)
+    if manifest:
+        signature = replacements.signature() if replacements else ()
+
+    count = 0
+    for title, tracks in iter_library_playlists(itunes_xml, only, exclude):
+        count += 1
+        # iTunes titles may contain path separators ('AC/DC')
+        new_name = rubepl.process_playlist_name(title.replace(os.sep, '-'),
+                                                rename)
+        log.info(title + ' => ' + new_name)
+        outf = new_name + ('.m3u8' if utf8 else '.m3u')
+        if output: outf = os.path.join(output, outf)
+
+        if manifest:
+            key = fingerprint('get-itunes-playlists', title, tuple(tracks),
+                              signature, bool(utf8), bool(use_bom))
+            if manifest.is_current(outf, key):
+                continue
+
+        lines = convert_tracks_to_m3u(tracks, use_bom)
+        if replacements:
+            lines = replacements.process(lines)
+        try:
+            data = writer.encode(lines)
+        except UnicodeEncodeError as ex:
+            log.error('{0} can\'t be written in CP1252 ({1}); try -u.'.
+                      format(title, ex))
+            continue
+        if manifest:
+            manifest.write(outf, key, data, writer)
+        else:
+            writer.write_bytes(outf, data)
+
+    if 0 == count:
+        log.warning("No playlists selected for output.")
+    log.debug('wrote {0} bytes to {1} files in {2:.3f}ms.'.
+              format(writer.bytes, writer.files, writer.latency * 1000.0))
 
 def _itunify_m3u(args):
     """Convert a playlist in M3U format to one suitable for importing into iTunes.
@@ -454,8 +666,21 @@ def _itunify_m3u(args):
 
     """
 
-    m3u_to_itunes(args.file, args.output, itunes_xml=args.itunes_db,
-                  codepage=args.codepage, max_distance=args.max_edit_distance)
+    prefixes = rubepl.prefix.from_args(args)
+    replacements = Replacements(None, prefixes=prefixes) if prefixes else None
+    tag_cache = rubepl.tags.from_args(args)
+    catalog = rubepl.catalog.from_args(args)
+    try:
+        m3u_to_itunes(args.file, args.output, itunes_xml=args.itunes_db,
+                      codepage=args.codepage,
+                      max_distance=args.max_edit_distance,
+                      replacements=replacements, tag_cache=tag_cache,
+                      catalog=catalog)
+    finally:
+        if tag_cache:
+            tag_cache.close()
+        if catalog is not None:
+            catalog.close()
 
 def build_subparser(subparsers, name='itunify-m3u'):
 
@@ -472,6 +697,55 @@ def build_subparser(subparsers, name='itunify-m3u'):
                          + ' containing the music library (defaults to'
                          + ' ~/Music/iTunes/iTunes Music Library.xml)',
                          default=ITUNES_XML)
+    rubepl.prefix.add_arguments(itunify)
+    rubepl.tags.add_arguments(itunify)
+    rubepl.catalog.add_matcher_arguments(itunify)
     itunify.add_argument('file', help='Playlist to be converted')
 
     itunify.set_defaults(func=_itunify_m3u)
+
+def _get_itunes_playlists(args):
+    """Handler for the 'get-itunes-playlists' command."""
+
+    manifest = Manifest(args.output) if args.incremental else None
+    prefixes = rubepl.prefix.from_args(args)
+    replacements = Replacements(None, prefixes=prefixes) if prefixes else None
+    library_to_m3u(args.itunes_db, args.rename, replacements, args.utf8,
+                   args.only, args.exclude, args.output, args.use_bom,
+                   manifest, args.fsync)
+    if manifest:
+        manifest.save()
+
+def build_playlists_subparser(subparsers, name='get-itunes-playlists'):
+    """Build the sub-parser for the 'get-itunes-playlists' command."""
+
+    gp = subparsers.add_parser(name=name, help='Retrieve playlists from an '
+                               + 'iTunes library & convert them to M3U '
+                               + 'format.')
+    gp.add_argument('-x', '--exclude', help='exclude a particular playlist '
+                    + 'by title', action='append')
+    gp.add_argument('-o', '--output', help='output directory')
+    gp.add_argument('-y', '--only', help='Only this playlist (which will be '
+                    + "exported even if it's one of iTunes' own, such as "
+                    + '"Music")', action='append')
+    rubepl.prefix.add_arguments(gp)
+    gp.add_argument('-r', '--rename', help='Rename code: a sequence of'
+                    + ' characters indicating transformations to be applied'
+                    + ' to the playlist title: "l" will convert all characters'
+                    + ' to lowercase, "-" will replace whitespace with a dash')
+    gp.add_argument('-u', '--utf8', help='Use UTF-8 encoding '
+                    + 'on output', action='store_true')
+    gp.add_argument('-b', '--use-bom', help='Use the UTF-8 '
+                    + 'byte order mark on output (in UTF8)',
+                    action='store_true')
+    gp.add_argument('-I', '--incremental', help='Keep a manifest in the'
+                    + ' output directory & skip playlists whose tracks &'
+                    + ' options are unchanged since the last run',
+                    action='store_true')
+    gp.add_argument('--fsync', help='Flush each output file to stable storage'
+                    + ' before renaming it into place', action='store_true')
+    gp.add_argument('itunes_db', help='path to the iTunes XML file'
+                    + ' containing the music library (typically ~/Music/'
+                    + 'iTunes/iTunes Music Library.xml)', nargs='?',
+                    default=ITUNES_XML)
+    gp.set_defaults(func=_get_itunes_playlists)
@@ -14,27 +14,191 @@ __status__     = "Prototype"
 
 
 import codecs
+import collections
+import concurrent.futures
 import logging
+import multiprocessing
 import os
 import re
+import sys
 
 import rubepl
-
-from rubepl.decode import decode_file, maybe_remove_bom
+import rubepl.extsort
+import rubepl.fsindex
+import rubepl.prefix
+import rubepl.profile
+import rubepl.repair
+
+from rubepl.decode import iter_decoded_lines, maybe_remove_bom
+from rubepl.extsort import iter_distinct_sorted
 from rubepl.encode import encode_line, maybe_add_utf8_bom
+from rubepl.mapped import MappedPlaylist
+from rubepl.manifest import fingerprint, file_fingerprint
+from rubepl.transcode import is_ascii_compatible, iter_normalized
+from rubepl.writer import PlaylistWriter
 
 
 COMMENT_REGEX = re.compile('^\s*#')
 EXTINFO_REGEX = re.compile('^\s*#\s*EXTINF\s*:\s*([-0-9]+)?\s*,\s*(.*)?')
+# EXTINFO_REGEX, for undecoded lines in an ASCII-compatible encoding; anything
+# this matches, EXTINFO_REGEX will match once decoded (but not vice versa)
+EXTINFO_BYTES_REGEX = re.compile(rb'\s*#\s*EXTINF\s*:\s*([-0-9]+)?\s*,')
 
 log = logging.getLogger(__name__)
 
+# A bounded repeat, e.g. {2} or {1,3}
+_BOUNDED_REPEAT = re.compile(r'\{\d*,?\d*\}')
+
+def _analyze_regex(regex):
+    """Work out what literal text any match of 'regex' must contain.
+
+    :param regex: a compiled regular expression
+    :return: a two-tuple (required, literal): 'required' is a (possibly empty)
+    string that every match of 'regex' must contain, & 'literal' is the text
+    'regex' matches if it's a plain string with no special characters at all
+    (None otherwise)
+
+    This is a deliberately conservative scan of the pattern source: we only
+    pick up runs of literal characters at the top level of the pattern, and
+    we give up altogether on top-level alternation & on flags that change the
+    meaning of literal characters.
+    """
+
+    if regex.flags & (re.IGNORECASE | re.VERBOSE):
+        return ('', None)
+
+    pattern = regex.pattern
+    if isinstance(pattern, bytes):
+        return ('', None)
+
+    runs = []
+    run = []
+    pure = True
+    depth = 0
+    idx = 0
+    n = len(pattern)
+    while idx < n:
+        c = pattern[idx]
+        idx += 1
+        if '\\' == c:
+            if idx == n:
+                return ('', None)
+            c = pattern[idx]
+            idx += 1
+            if c.isalnum():
+                # A character class, backreference, anchor or the like
+                pure = False
+                runs.append(run)
+                run = []
+            elif 0 == depth:
+                run.append(c)
+        elif '[' == c:
+            # Skip the set
+            pure = False
+            runs.append(run)
+            run = []
+            if idx < n and '^' == pattern[idx]:
+                idx += 1
+            if idx < n and ']' == pattern[idx]:
+                idx += 1
+            while idx < n and ']' != pattern[idx]:
+                idx += 2 if '\\' == pattern[idx] else 1
+            idx += 1
+        elif '(' == c:
+            pure = False
+            depth += 1
+            runs.append(run)
+            run = []
+        elif ')' == c:
+            depth -= 1
+        elif '|' == c:
+            if 0 == depth:
+                return ('', None)
+        elif c in '*+?{':
+            # The preceding item is optional or repeated: don't rely on it
+            pure = False
+            if run:
+                run.pop()
+            runs.append(run)
+            run = []
+            if '{' == c:
+                match = _BOUNDED_REPEAT.match(pattern, idx - 1)
+                if match:
+                    idx = match.end()
+        elif c in '.^$':
+            pure = False
+            runs.append(run)
+            run = []
+        elif 0 == depth:
+            run.append(c)
+    runs.append(run)
+
+    literal = ''.join(run) if pure and run else None
+    required = max((''.join(r) for r in runs), key=len)
+    return (required, literal)
+
+def _overlap(s, t):
+    """Return True if an occurrence of 's' & an occurrence of 't' could share
+    any characters (i.e. one contains the other, or a suffix of one is a prefix
+    of the other)."""
+
+    if s in t or t in s:
+        return True
+    for i in range(1, min(len(s), len(t))):
+        if s.endswith(t[:i]) or t.endswith(s[:i]):
+            return True
+    return False
 
 class Replacements(object):
+    """A sequence of regex replacements to be applied, in order, to lines of
+    text.
+
+    The replacements are compiled into a sequence of 'stages' that give
+    exactly the same result as applying each regex to each line in turn, but
+    do less work:
 
-    def __init__(self, args):
+        - a rule that is just a literal string (e.g. 'M:/=>/pub/mp3/') is
+          applied with str.replace
+
+        - a run of consecutive literal rules that can't interfere with one
+          another (no rule's text or replacement overlaps a later rule's text)
+          is combined into a single alternation, so the line is scanned once
+          for all of them
+
+        - a regex containing some required literal text is only run against
+          lines containing that text
+
+    Optionally, replacements can be restricted to track locations, leaving
+    the '#EXTM3U' header & '#EXTINF' lines untouched.
+
+    A Replacements instance may also carry a prefix.PrefixRewriter, which is
+    applied to track locations before any regexes, and a relocate.MoveMap &
+    a repair.RepairIndex, which are applied (in that order) to track
+    locations after them.
+    """
+
+    def __init__(self, args, locations_only=False, prefixes=None, repairs=None,
+                 moves=None):
+        """Construct with a list of replacement strings of the form 'A=>B' (cf.
+        process_replacement_string).
+
+        :param list args: replacement strings (may be None)
+        :param bool locations_only: if True, only apply the replacements to
+        lines that aren't M3U comments or directives
+        :param prefix.PrefixRewriter prefixes: optional path-prefix rewrites to
+        be applied to track locations
+        :param repair.RepairIndex repairs: optional index with which to repair
+        missing track locations
+        :param relocate.MoveMap moves: optional map of moved track locations
+        """
 
         self._regexes = []
+        self._args = []
+        self._stages = []
+        self._locations_only = locations_only
+        self._prefixes = prefixes
+        self._repairs = repairs
+        self._moves = moves
         self.add(args)
 
     def add(self, args):
@@ -42,6 +206,66 @@ class Replacements(object):
             return
         for arg in args:
             self._regexes.append(self.process_replacement_string(arg))
+            self._args.append(arg)
+        self._stages = self._compile()
+
+    def is_empty(self):
+        """Return True if this instance makes no changes at all."""
+
+        return not (self._stages or self._prefixes or self._repairs or
+                    self._moves)
+
+    def signature(self):
+        """Return a value identifying this set of replacements (suitable for
+        inclusion in a manifest.fingerprint)."""
+
+        return (tuple(self._args), self._locations_only,
+                self._prefixes.signature() if self._prefixes else None,
+                self._repairs.signature() if self._repairs else None,
+                self._moves.signature() if self._moves else None)
+
+    def _compile(self):
+        """Compile our regexes into a list of callables, each taking & returning
+        a line of text."""
+
+        stages = []
+        group = []
+
+        def close_group():
+            if 1 == len(group):
+                text, repl = group[0]
+                stages.append(lambda line: line.replace(text, repl))
+            elif group:
+                table = dict(group)
+                alt = re.compile('|'.join(map(re.escape, table.keys())))
+                lookup = lambda match: table[match.group(0)]
+                stages.append(lambda line: alt.sub(lookup, line))
+            del group[:]
+
+        for regex, repl in self._regexes:
+            required, literal = _analyze_regex(regex)
+            if literal is not None and '\\' not in repl:
+                if any(_overlap(text, literal) or _overlap(prev, literal)
+                       for text, prev in group):
+                    close_group()
+                group.append((literal, repl))
+                continue
+
+            close_group()
+            if required:
+                def stage(line, regex=regex, repl=repl, required=required):
+                    if required not in line:
+                        return line
+                    return regex.sub(repl, line)
+                stages.append(stage)
+            else:
+                stages.append(lambda line, regex=regex, repl=repl:
+                              regex.sub(repl, line))
+        close_group()
+
+        log.debug('compiled {0} replacements into {1} stages'.
+                  format(len(self._regexes), len(stages)))
+        return stages
 
     def process_replacement_string(self, text):
         """Process a configuration-specified replacement string into a
@@ -98,21 +322,92 @@ class Replacements(object):
 
         return (regex,repl)
 
-    def process(self, lines):
+    def iterate(self, lines, base=None):
+        """Apply our regexes to each line in 'lines' (any iterable), yielding
+        the results one at a time; relative track locations are repaired
+        against 'base' (the playlist's directory), if given."""
+
+        stages = self._stages
+        prefixes = self._prefixes
+        repairs = self._repairs
+        moves = self._moves
+        if not (stages or prefixes or repairs or moves):
+            yield from lines
+            return
+        locations_only = self._locations_only
+        for line in lines:
+            if prefixes or repairs or moves or locations_only:
+                location = is_location(line)
+                if locations_only and not location:
+                    yield line
+                    continue
+                if prefixes and location:
+                    line = prefixes.rewrite(line)
+            for stage in stages:
+                line = stage(line)
+            if moves and location:
+                line = moves.relocate(line)
+            if repairs and location:
+                line = repairs.repair(line, base)
+            yield line
+
+    def process(self, lines, base=None):
         """Apply our regexes to every line in 'lines', return the result."""
 
-        outlines = []
-        for line in lines:
-            out = line
-            for regex in self._regexes:
-                out = re.sub(regex[0], regex[1], out)
-            outlines.append(out)
-        return outlines
+        return list(self.iterate(lines, base))
+
+
+def parse_extinf(line):
+    """Interpret a line of an M3U playlist as extended track information.
+
+    :param str line: a line from an M3U playlist
+    :return: a two-tuple (duration, title) if 'line' is an #EXTINF directive
+    ('duration' is an integer, or None if the directive gives none), else None
+
+    This is the one place in which #EXTINF lines are parsed; cf. render_extinf
+    for its inverse.
+    """
+
+    what = EXTINFO_REGEX.match(line)
+    if what is None:
+        return None
+    duration = what.group(1)
+    if duration:
+        duration = int(duration)
+    return (duration, what.group(2))
+
+def render_extinf(extinf):
+    """Render extended track information, a two-tuple (duration, title) either
+    of which may be None, as an #EXTINF line; return None if there's nothing
+    to render."""
+
+    duration, title = extinf
+    if None == duration and None == title:
+        return None
+    if None == duration: duration = -1
+    if None == title: title = ""
+    return "#EXTINF:{0},{1}".format(duration, title)
+
+def is_location(line):
+    """Return True if 'line' (a line from an M3U playlist) names a track, as
+    opposed to being blank, a comment, or a directive such as #EXTINF."""
+
+    text = line.lstrip(' \t\ufeff')
+    return 0 != len(text) and '#' != text[0] and not text.isspace()
+
+def _add_bom(lines):
+    """Yield 'lines', adding the UTF-8 BOM to the first."""
+
+    it = iter(lines)
+    for first in it:
+        yield maybe_add_utf8_bom(first)
+        break
+    yield from it
 
 
 def normalize_m3u_playlist(title, filename, rename, replacements,
                            utf8=None, use_bom=None, codepage=None,
-                           output=None):
+                           output=None, manifest=None, fsync=None):
     """Transform an M3U playlist in various ways.
 
     :param str title: The playlist title
@@ -134,10 +429,21 @@ def normalize_m3u_playlist(title, filename, rename, replacements,
     deduce it.
     :param str output: If specified, the directory to which output files shall
     be written; if not specified, the present working directory shall be used.
+    :param Manifest manifest: If specified, the manifest for 'output'; if the
+    input file, 'replacements' & the encoding options are unchanged since the
+    output was last written, the playlist won't be processed at all, and if the
+    result is byte-for-byte identical to the existing output, it won't be
+    re-written.
+    :param bool fsync: If true, flush the output to stable storage before
+    renaming it into place (output files are always replaced atomically).
 
     This method will transform an M3U playlist according to 'replacements',
     rename it according to 'rename', and write out the result according to
-    'output', 'use_bom', and 'utf8'.
+    'output', 'use_bom', and 'utf8'. The playlist is streamed from input to
+    output a line at a time, so memory use doesn't grow with its size. If there
+    are no replacements to be made, & both encodings are ASCII-compatible, the
+    work is done at the byte level by transcode.iter_normalized, without
+    decoding each line.
 
     'rename' is a textual string where each character represents a given
     transformation to be performed on the title. The following characters are
@@ -164,21 +470,101 @@ def normalize_m3u_playlist(title, filename, rename, replacements,
         outf = new_name + ".m3u"
         outcp = 'cp1252'
 
-    encoded = [x for x in map(lambda x: encode_line(x), decode_file(filename, codepage))]
-    outlines = replacements.process(encoded)
-
     if output:
         outf = os.path.join(output, outf)
 
+    if manifest:
+        key = fingerprint('normalize-m3u', file_fingerprint(filename),
+                          replacements.signature(), utf8, use_bom, codepage)
+        if manifest.is_current(outf, key):
+            return
+
+    writer = PlaylistWriter(outcp, fsync=fsync)
+
+    if replacements.is_empty():
+        with MappedPlaylist(filename, codepage) as pls:
+            if pls.mappable and is_ascii_compatible(outcp):
+                blocks = iter_normalized(pls, pls.encoding, pls.errors, outcp,
+                                         utf8 and use_bom)
+                if manifest:
+                    manifest.write(outf, key, blocks, writer)
+                else:
+                    writer.write_bytes(outf, blocks)
+                return
+
+    encoded = map(encode_line, iter_decoded_lines(filename, codepage))
+    outlines = replacements.iterate(encoded,
+                                    os.path.dirname(os.path.abspath(filename)))
+
     if utf8 and use_bom:
-        outlines[0] = maybe_add_utf8_bom(outlines[0])
+        outlines = _add_bom(outlines)
 
-    with open(outf, 'w', -1, outcp) as fd:
-        for x in map(lambda line: line + os.linesep, outlines):
-            fd.write(x)
+    if manifest:
+        manifest.write(outf, key, writer.iter_encode(outlines), writer)
+    else:
+        writer.write(outf, outlines)
 
-def get_tracks_from_m3u(filename, codepage=None):
-    """Read a playlist in M3U format & return the contents.
+def render_m3u_playlist(title, filename, profiles, codepage=None):
+    """Transform an M3U playlist once for each of several output profiles.
+
+    :param str title: The playlist title
+    :param str filename: The file containing the input playlist
+    :param list profiles: a list of profile.Profile instances, each naming
+    the rename code, replacements, encoding options, output directory &
+    manifest as for normalize_m3u_playlist
+    :param str codepage: The encoding of the input file (or None, in which case
+    the implementation will try to deduce it)
+
+    The input is read & decoded once, and the lines kept in memory while they
+    are rendered to each profile whose output isn't current. Given a single
+    profile, this is just normalize_m3u_playlist (which streams).
+    """
+
+    if 1 == len(profiles):
+        p = profiles[0]
+        normalize_m3u_playlist(title, filename, p.rename, p.replacements,
+                               p.utf8, p.use_bom, codepage, p.output,
+                               p.manifest, p.fsync)
+        return
+
+    if not os.path.isfile(filename):
+        log.error('{0} (for {1}) does not appear to exist!'.format(filename, title))
+        return
+
+    # [(profile, output file, manifest key),...]
+    pending = []
+    inkey = None
+    for profile in profiles:
+        outf = profile.outfile(title)
+        log.info('"{0}"=>"{1}"'.format(title, outf))
+        key = None
+        if profile.manifest:
+            if inkey is None:
+                inkey = file_fingerprint(filename)
+            key = fingerprint('normalize-m3u', inkey,
+                              profile.replacements.signature(), profile.utf8,
+                              profile.use_bom, codepage)
+            if profile.manifest.is_current(outf, key):
+                continue
+        pending.append((profile, outf, key))
+    if not pending:
+        return
+
+    lines = list(map(encode_line, iter_decoded_lines(filename, codepage)))
+    base = os.path.dirname(os.path.abspath(filename))
+    for profile, outf, key in pending:
+        outlines = profile.replacements.iterate(lines, base)
+        if profile.utf8 and profile.use_bom:
+            outlines = _add_bom(outlines)
+        if profile.manifest:
+            profile.manifest.write(outf, key,
+                                   profile.writer.iter_encode(outlines),
+                                   profile.writer)
+        else:
+            profile.writer.write(outf, outlines)
+
+def iter_tracks_from_m3u(filename, codepage=None, strict=True):
+    """Read a playlist in M3U format & yield its tracks one at a time.
 
     :param str filename: path to the M3U playlist of interest
     :param str codepage: The encoding of the input file; the caller can specify
@@ -186,20 +572,14 @@ def get_tracks_from_m3u(filename, codepage=None):
     (cf. `here<https://docs.python.org/3.3/library/codecs.html#standard-encodings>`_)
     or decline to provide it, in which case the implementation will try to
     deduce it.
+    :param bool strict: if True, raise if the playlist doesn't begin with
+    '#EXTM3U'; if False, take such a playlist to be a plain M3U file
 
-    For each track in 'filename' a two-tuple of (path, extinfo) will be
-    returned, where 'path' is the path to the actual file, and 'extinfo' is the
-    optional extended information (if non-None, then it shall be a two-tuple
-    (duration, title), either of which may be None. If non-None, duration shall
-    be an integer.
-
+    This is the streaming equivalent of get_tracks_from_m3u, on which more
+    below.
     """
 
-    lines = decode_file(filename, codepage)
-    lines[0] = maybe_remove_bom(lines[0])
-    lines = map(lambda x: x.strip(), lines)
-
-    tracks = []
+    lines = map(lambda x: x.strip(), iter_decoded_lines(filename, codepage))
 
     INIT = 0
     PARSING = 1
@@ -207,25 +587,147 @@ def get_tracks_from_m3u(filename, codepage=None):
     state = INIT
     for line in lines:
         if INIT == state:
-            if '#EXTM3U' != line:
-                raise Exception('{0} is not in M3U format'.format(filename))
             state = PARSING
-        elif PARSING == state:
-            what = EXTINFO_REGEX.match(line)
-            if what is None:
-                tracks.append((line, None))
+            if '#EXTM3U' == line:
+                continue
+            if strict:
+                raise Exception('{0} is not in M3U format'.format(filename))
+        if PARSING == state:
+            extinf = parse_extinf(line)
+            if extinf is None:
+                yield (line, None)
             else:
-                duration = what.group(1)
-                display = what.group(2)
-                if duration:
-                    duration = int(duration)
                 state = SAW_EXTINF
-                extinf = (duration, display)
         elif SAW_EXTINF == state:
-            tracks.append((line, extinf))
+            yield (line, extinf)
             state = PARSING
 
-    return tracks
+def iter_track_locations(filename, codepage=None):
+    """Yield the location of each track in an M3U playlist.
+
+    :param str filename: path to the M3U playlist of interest
+    :param str codepage: the encoding of the input file (None means guess)
+
+    This yields exactly the paths that iter_tracks_from_m3u would, but reads
+    the playlist through a MappedPlaylist: #EXTINF lines are recognized
+    without being decoded, and only the track locations themselves are
+    decoded.
+    """
+
+    with MappedPlaylist(filename, codepage) as pls:
+        if not pls.mappable:
+            for line, extinf in iter_tracks_from_m3u(filename, pls.encoding):
+                yield line
+            return
+
+        decode = pls.decode
+        extinf_match = EXTINFO_BYTES_REGEX.match
+        lines = pls.raw_lines()
+        for raw in lines:
+            if '#EXTM3U' != decode(raw).strip():
+                raise Exception('{0} is not in M3U format'.format(filename))
+            break
+        saw_extinf = False
+        for raw in lines:
+            if saw_extinf:
+                saw_extinf = False
+                yield decode(raw).strip()
+            elif extinf_match(raw):
+                saw_extinf = True
+            else:
+                line = decode(raw).strip()
+                if EXTINFO_REGEX.match(line):
+                    saw_extinf = True
+                else:
+                    yield line
+
+def _read_track_locations(filename, codepage=None):
+    """Return a list of the distinct track locations in 'filename', in the
+    order in which they first appear (run in a worker process by
+    iter_playlist_tracks)."""
+
+    return list(dict.fromkeys(iter_track_locations(filename, codepage)))
+
+def _pool_context():
+    """Return the multiprocessing context in which to start worker processes:
+    'forkserver' where there is one, else 'spawn'."""
+
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+def iter_playlist_tracks(files, codepage=None, processes=None,
+                         keep_order=False):
+    """Read many M3U playlists in parallel, yielding the tracks of each.
+
+    :param list files: paths to the M3U playlists of interest
+    :param str codepage: the encoding of the input files (None means guess)
+    :param int processes: the number of worker processes with which to read
+    playlists (default: one per CPU); if one, they're read in turn, in this
+    process
+    :param bool keep_order: if True, yield the tracks of each playlist in the
+    order in which they appear in 'files'; if False, yield them as each
+    playlist is read
+
+    For each playlist, yield an iterable over its track locations (duplicates
+    within a playlist may be dropped). No more than two playlists per worker
+    are in flight at once, so results don't pile up if the caller consumes
+    them slowly.
+    """
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    if processes <= 1 or len(files) <= 1:
+        for f in files:
+            yield iter_track_locations(f, codepage)
+        return
+
+    window = 2 * processes
+    files = iter(files)
+    # Don't fork workers from this process: the caller may have other threads
+    # running (e.g. under 'batch'), & a forked child would inherit any locks
+    # they hold, held, forever
+    with concurrent.futures.ProcessPoolExecutor(
+            processes, mp_context=_pool_context()) as pool:
+        if keep_order:
+            pending = collections.deque()
+            for f in files:
+                pending.append(pool.submit(_read_track_locations, f, codepage))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        else:
+            pending = set()
+            for f in files:
+                pending.add(pool.submit(_read_track_locations, f, codepage))
+                if len(pending) >= window:
+                    done, pending = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            for future in concurrent.futures.as_completed(pending):
+                yield future.result()
+
+def get_tracks_from_m3u(filename, codepage=None):
+    """Read a playlist in M3U format & return the contents.
+
+    :param str filename: path to the M3U playlist of interest
+    :param str codepage: The encoding of the input file; the caller can specify
+    this explicitly
+    (cf. `here<https://docs.python.org/3.3/library/codecs.html#standard-encodings>`_)
+    or decline to provide it, in which case the implementation will try to
+    deduce it.
+
+    For each track in 'filename' a two-tuple of (path, extinfo) will be
+    returned, where 'path' is the path to the actual file, and 'extinfo' is the
+    optional extended information (if non-None, then it shall be a two-tuple
+    (duration, title), either of which may be None. If non-None, duration shall
+    be an integer.
+
+    """
+
+    return list(iter_tracks_from_m3u(filename, codepage))
 
 def convert_tracks_to_m3u(tracks, use_bom=None):
     """Convert a collection of tracks with optional extended information to M3U
@@ -241,24 +743,23 @@ def convert_tracks_to_m3u(tracks, use_bom=None):
 
     """
 
+    return list(iter_m3u_lines(tracks, use_bom))
+
+def iter_m3u_lines(tracks, use_bom=None):
+    """Yield the lines of an M3U playlist containing 'tracks' (any iterable of
+    two-tuples (path, extinfo), as for convert_tracks_to_m3u) one at a time."""
+
     header = encode_line("#EXTM3U")
     if use_bom:
         header = maybe_add_utf8_bom(header)
+    yield header
 
-    encoded = [ header ]
-    for track in tracks:
-        if None != track[1]:
-            duration = track[1][0]
-            title = track[1][1]
-            if None != duration or None != title:
-                if None == duration: duration = -1
-                if None == title: title = ""
-                text = "#EXTINF:{0},{1}".format(duration, title)
-                encoded.append(encode_line(text))
-
-        encoded.append(encode_line(track[0]))
-
-    return encoded
+    for location, extinf in tracks:
+        if None != extinf:
+            text = render_extinf(extinf)
+            if text is not None:
+                yield encode_line(text)
+        yield encode_line(location)
 
 def _normalize_m3u_pls(args):
     """Handler for the 'normalize-m3u' command.
@@ -270,12 +771,17 @@ def _normalize_m3u_pls(args):
     Namespace & pass them on to the implementation.
     """
 
-    replacements = Replacements(args.replace)
+    repairs = rubepl.repair.from_args(args)
+    profiles = rubepl.profile.from_args(args, repairs)
     for f in args.files:
         title = os.path.splitext(os.path.split(f)[-1])[0]
-        normalize_m3u_playlist(title, f, args.rename, replacements,
-                           args.utf8, args.use_bom, args.codepage,
-                           args.output)
+        render_m3u_playlist(title, f, profiles, args.codepage)
+    rubepl.profile.save(profiles)
+    if repairs:
+        report = repairs.report()
+        log.info(report[0])
+        for line in report[1:]:
+            log.warning(line)
 
 def _get_tracks_from_m3us(args):
     """Given a list of playlists in M3U format, print out the set of all distinct
@@ -289,22 +795,80 @@ def _get_tracks_from_m3us(args):
         - codepage: The input code page for all playlists
         - check-missing: If true, just print tracks that are missing on
           the source side
+        - library_root, snapshot, snapshot_max_age, jobs: how to check for
+          missing tracks (cf. rubepl.fsindex.add_arguments)
+        - repair_root: if given, missing tracks are repaired before being
+          printed (cf. rubepl.repair); a report goes to stderr
+        - processes: number of processes with which to read playlists
+        - keep_order: if true, print tracks in the order in which they're
+          first seen in 'files' (else, playlist by playlist as each is read)
+        - null: if true, terminate each track with NUL rather than newline
+        - sort: if true, print tracks in sorted order
+        - memory_budget, temp_dir: if the former is given, de-duplicate tracks
+          in about that many bytes of memory, spilling to temporary files in
+          the latter if need be (cf. rubepl.extsort); tracks are then printed
+          in sorted order
 
     This can be used to copy them to another host like so:
 
         rubepl get-tracks athens.m3u8 | xargs -d '\n' -I {} scp {} 192.168.0.99:doc/import
 
+    or, with an xargs that lacks -d (e.g. on BSD or macOS):
+
+        rubepl get-tracks -0 athens.m3u8 | xargs -0 -I {} scp {} 192.168.0.99:doc/import
+
+    Unless they're to be sorted, each track is printed as soon as it's first
+    seen, so output begins before the playlists have been read in full.
     """
 
-    S = set()
-    for f in args.files:
-        tracks = map(lambda x: x[0], get_tracks_from_m3u(f, args.codepage))
-        S = S.union(set(tracks))
+    repairs = rubepl.repair.from_args(args)
 
+    if args.memory_budget:
+        def distinct(tracks):
+            return iter_distinct_sorted(tracks, args.memory_budget,
+                                        args.temp_dir)
+    elif args.sort:
+        def distinct(tracks):
+            return iter(sorted(set(tracks)))
+    else:
+        def distinct(tracks):
+            S = set()
+            for track in tracks:
+                if track not in S:
+                    S.add(track)
+                    yield track
+
+    def all_tracks():
+        for tracks in iter_playlist_tracks(args.files, args.codepage,
+                                           args.processes, args.keep_order):
+            yield from tracks
+
+    def repaired_tracks():
+        # Relative locations are repaired against their own playlist's
+        # directory, so the playlists must come back in order
+        for f, tracks in zip(args.files, iter_playlist_tracks(
+                args.files, args.codepage, args.processes, keep_order=True)):
+            base = os.path.dirname(os.path.abspath(f))
+            for track in tracks:
+                yield repairs.repair(track, base)
+
+    if repairs:
+        # Two locations may be repaired to the same track
+        tracks = distinct(repaired_tracks())
+    else:
+        tracks = distinct(all_tracks())
     if args.check_missing:
-        S = filter(lambda x: not os.path.exists(x), S)
+        snapshot = rubepl.fsindex.from_args(args)
+        tracks = (track for track, exists in
+                  rubepl.fsindex.iter_exists(tracks, snapshot, args.jobs)
+                  if not exists)
+
+    end = '\0' if args.null else '\n'
+    for track in tracks:
+        print(track, end=end)
 
-    print('\n'.join(S))
+    if repairs:
+        print('\n'.join(repairs.report()), file=sys.stderr)
 
 def build_normalize_subparser(subparsers, name='normalize-m3u'):
     """Build a sub-parser for a command that will transform one or more M3U
@@ -333,6 +897,11 @@ playlists in various ways.
                      + ' expression and REPLACEMENT is the text with which to'
                      + ' replace any matches (REPLACEMENT may include'
                      + ' sub-expressions)', action='append')
+    m3u.add_argument('-L', '--locations-only', help='Only apply replacements'
+                     + ' to track locations (leaving #EXTM3U & #EXTINF lines'
+                     + ' untouched)', action='store_true')
+    rubepl.prefix.add_arguments(m3u)
+    rubepl.repair.add_arguments(m3u)
     m3u.add_argument('-r', '--rename', help='Rename code: a sequence of'
                      + ' characters indicating transformations to be applied'
                      + ' to the playlist title: "l" will convert all characters'
@@ -342,6 +911,14 @@ playlists in various ways.
     m3u.add_argument('-b', '--use-bom', help='Use the UTF-8 '
                       + 'byte order mark on output (in UTF8)',
                       action='store_true')
+    m3u.add_argument('-I', '--incremental', help='Keep a manifest in the'
+                     + ' output directory & skip playlists whose inputs &'
+                     + ' options are unchanged since the last run (and outputs'
+                     + ' whose contents would be identical)',
+                     action='store_true')
+    m3u.add_argument('--fsync', help='Flush each output file to stable storage'
+                     + ' before renaming it into place', action='store_true')
+    rubepl.profile.add_arguments(m3u)
     m3u.set_defaults(func=_normalize_m3u_pls)
 
 def build_get_tracks_subparser(subparsers, name='get-tracks'):
@@ -355,4 +932,20 @@ def build_get_tracks_subparser(subparsers, name='get-tracks'):
     gt.add_argument('-m', '--check-missing', help='Just print tracks that are '
                     + 'missing on the source side',
                     action='store_true')
+    gt.add_argument('--processes', help='Number of processes with which to '
+                    + 'read playlists (default: one per CPU; 1 reads them in '
+                    + 'turn)', type=int, metavar='N')
+    gt.add_argument('-k', '--keep-order', help='Print tracks in the order in '
+                    + 'which they first appear in the playlists, as given on '
+                    + 'the command line (by default, tracks are printed '
+                    + 'playlist by playlist, as each is read)',
+                    action='store_true')
+    gt.add_argument('-s', '--sort', help='Print tracks in sorted order',
+                    action='store_true')
+    rubepl.extsort.add_arguments(gt)
+    gt.add_argument('-0', '--null', help='Terminate each track with a NUL '
+                    + 'character rather than a newline (for xargs -0)',
+                    action='store_true')
+    rubepl.fsindex.add_arguments(gt)
+    rubepl.repair.add_arguments(gt)
     gt.set_defaults(func=_get_tracks_from_m3us)
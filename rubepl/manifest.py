@@ -0,0 +1,183 @@
+"""manifest.py -- Bookkeeping for incremental playlist export.
+
+Every exporter in this package will, by default, re-render & re-write every
+playlist it is asked to produce. That's simple, but it bumps the mtime of every
+output file, which in turn makes tools like rsync re-transfer all of them. A
+Manifest records, for each output file in a directory, a fingerprint of the
+inputs & options that produced it, and a digest of the bytes that were
+written. Exporters can consult it to skip rendering a playlist whose inputs
+haven't changed, and to skip writing an output whose contents would be
+identical to what's already on disk.
+"""
+
+__author__     = "Michael Herstine <sp1ff@pobox.com>"
+__copyright__  = "Copyright (C) 2015, 2016 Michael Herstine"
+__credits__    = ["Michael Herstine"]
+__license__    = "GPL"
+__version__    = "$Revision: $"
+__maintainer__ = "Michael Herstine <sp1ff@pobox.com>"
+__email__      = "sp1ff@pobox.com"
+__status__     = "Prototype"
+
+import hashlib
+import json
+import logging
+import os
+
+from rubepl.writer import atomic_write
+
+MANIFEST_NAME = '.rubepl-manifest.json'
+MANIFEST_VERSION = 1
+
+log = logging.getLogger(__name__)
+
+def fingerprint(*parts):
+    """Reduce an arbitrary collection of (repr-able) values to a short, stable
+    string.
+
+    :param parts: the values to be fingerprinted (strings, numbers, tuples &c)
+    :return: a hex digest identifying 'parts'
+    """
+
+    return hashlib.sha1(repr(parts).encode('utf-8', 'surrogateescape')).hexdigest()
+
+def file_fingerprint(path):
+    """Fingerprint a file by name, size & modification time.
+
+    :param str path: the file of interest
+    :return: a tuple (absolute path, size, mtime in ns) suitable for inclusion
+    in a call to fingerprint
+
+    This is what make does: if neither the size nor the mtime of an input have
+    changed, we assume its contents haven't, either.
+    """
+
+    st = os.stat(path)
+    return (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+class Manifest(object):
+    """A record of the output files in a given directory.
+
+    For each output file (identified by name, relative to the manifest's
+    directory), we record:
+
+        - key: a fingerprint of the inputs & options that produced it
+        - digest: the SHA-1 of the bytes last written
+        - size, mtime_ns: the size & mtime of the file after we wrote it (so we
+          can notice if someone else has changed it since)
+
+    """
+
+    def __init__(self, directory=None):
+        """Load the manifest for 'directory' (the present working directory if
+        None); if there is no such manifest, start a new one."""
+
+        self._dir = directory if directory else os.getcwd()
+        self._path = os.path.join(self._dir, MANIFEST_NAME)
+        self._entries = {}
+        self._dirty = False
+        self.rendered = 0
+        self.skipped = 0
+        self.written = 0
+        self.unchanged = 0
+        try:
+            with open(self._path, 'r', encoding='utf-8') as fh:
+                doc = json.load(fh)
+            if MANIFEST_VERSION == doc.get('version'):
+                self._entries = doc['entries']
+            else:
+                log.warning('{0}: unknown manifest version; starting afresh'.
+                            format(self._path))
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError) as ex:
+            log.warning('{0}: unreadable manifest ({1}); starting afresh'.
+                        format(self._path, ex))
+
+    def _name(self, outf):
+        return os.path.relpath(os.path.abspath(outf), os.path.abspath(self._dir))
+
+    def _on_disk(self, outf, entry):
+        """Return True if 'outf' is on disk, untouched since we wrote it."""
+        try:
+            st = os.stat(outf)
+        except FileNotFoundError:
+            return False
+        return st.st_size == entry['size'] and st.st_mtime_ns == entry['mtime_ns']
+
+    def is_current(self, outf, key):
+        """Return True if 'outf' was produced from inputs fingerprinted as 'key'
+        & hasn't been touched since.
+
+        Callers can use this to skip rendering 'outf' altogether.
+        """
+
+        entry = self._entries.get(self._name(outf))
+        if entry is None or entry['key'] != key or not self._on_disk(outf, entry):
+            return False
+        log.debug('{0} is up-to-date.'.format(outf))
+        self.skipped += 1
+        return True
+
+    def write(self, outf, key, data, writer=None):
+        """Write 'data' to 'outf', unless 'outf' already holds exactly 'data'.
+
+        :param str outf: output file
+        :param str key: fingerprint of the inputs that produced 'data'
+        :param data: the rendered output; a bytes-like object, or an iterable of
+        them
+        :param writer.PlaylistWriter writer: if given, the writer to be used to
+        write 'data' (else it will be written atomically, without fsync)
+        :return: True if 'outf' was written, False if it was left alone
+
+        Either way, record 'key' against 'outf' so that the next run can skip
+        rendering it altogether.
+
+        'data' is streamed to a temporary file & digested on the way; if the
+        digest matches that of the existing output, the temporary is simply
+        discarded.
+        """
+
+        self.rendered += 1
+        name = self._name(outf)
+        entry = self._entries.get(name)
+        result = {}
+
+        def keep(hexdigest):
+            result['digest'] = hexdigest
+            result['keep'] = not (entry and entry['digest'] == hexdigest and
+                                  self._on_disk(outf, entry))
+            return result['keep']
+
+        if writer:
+            writer.write_bytes(outf, data, keep)
+        else:
+            atomic_write(outf, data, keep=keep)
+        hexdigest = result['digest']
+
+        if not result['keep']:
+            log.debug('{0} is unchanged.'.format(outf))
+            if entry['key'] != key:
+                entry['key'] = key
+                self._dirty = True
+            self.unchanged += 1
+            return False
+
+        st = os.stat(outf)
+        self._entries[name] = {'key': key, 'digest': hexdigest,
+                               'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+        self._dirty = True
+        self.written += 1
+        return True
+
+    def save(self):
+        """Persist this manifest, if it's changed."""
+
+        log.info('{0} up-to-date, {1} rendered ({2} written, {3} unchanged).'.
+                 format(self.skipped, self.rendered, self.written, self.unchanged))
+        if not self._dirty:
+            return
+        doc = {'version': MANIFEST_VERSION, 'entries': self._entries}
+        atomic_write(self._path, json.dumps(doc, indent=1, sort_keys=True).
+                     encode('utf-8'))
+        self._dirty = False
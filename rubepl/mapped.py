@@ -0,0 +1,215 @@
+"""mapped.py -- Memory-mapped access to (very large) M3U playlists.
+
+Reading a playlist through a text-mode file object copies every byte twice
+(from the page cache into the file object's buffer, and from there into a
+decoded string), and decodes every line whether or not anyone is interested
+in it. A MappedPlaylist instead maps the file into memory & hands out its
+lines undecoded: block boundaries are found with a bytes-level search for
+line breaks in the mapped file, and each block is split into lines in a
+single C-level call. Callers decide which lines to decode, and can match
+directives like #EXTINF against the raw bytes without decoding them at all.
+
+This only works for encodings in which line breaks & the ASCII characters
+are represented by their ASCII bytes (cf. transcode.is_ascii_compatible); for
+anything else (e.g. UTF-16), a MappedPlaylist falls back to decoding the file
+a line at a time.
+"""
+
+__author__     = "Michael Herstine <sp1ff@pobox.com>"
+__copyright__  = "Copyright (C) 2015, 2016 Michael Herstine"
+__credits__    = ["Michael Herstine"]
+__license__    = "GPL"
+__version__    = "$Revision: $"
+__maintainer__ = "Michael Herstine <sp1ff@pobox.com>"
+__email__      = "sp1ff@pobox.com"
+__status__     = "Prototype"
+
+import codecs
+import mmap
+import os
+import re
+import stat
+
+from rubepl.decode import SNIFF_SIZE, choose_codec, decode_bytes, \
+    iter_decoded_lines
+from rubepl.transcode import is_ascii_compatible
+
+# Split the mapped file into blocks of (about) this many bytes
+DEFAULT_BLOCK_SIZE = 1 << 20
+
+# Universal newlines, as understood by open() in text mode
+_NEWLINE_REGEX = re.compile(rb'\r\n|\r|\n')
+
+class MappedPlaylist(object):
+    """A playlist file, mapped into memory.
+
+    Use as a context manager:
+
+        with MappedPlaylist(filename) as pls:
+            for raw in pls.raw_lines():
+                if not raw.startswith(b'#'):
+                    location = pls.decode(raw)
+                    ...
+
+    The encoding is chosen as for decode.iter_decoded_lines, but the sniffing
+    is done on the mapped file, so it's read only once. Files that aren't
+    regular files (pipes, FIFOs, /dev/fd/N) aren't mapped: they're never
+    'mappable', & their 'encoding' is just 'codepage' (None meaning that it's
+    to be guessed when they're decoded).
+    """
+
+    def __init__(self, filename, codepage=None):
+        """Map 'filename' into memory.
+
+        :param str filename: the playlist to be read
+        :param str codepage: the encoding of 'filename' (None means guess)
+        """
+
+        self.filename = filename
+        self._pos = 0
+        self._start = 0
+        self._fh = open(filename, 'rb')
+        try:
+            st = os.fstat(self._fh.fileno())
+            if not stat.S_ISREG(st.st_mode):
+                # Pipes & the like can't be mapped (& report a size of zero),
+                # nor sniffed here without draining them: leave them to the
+                # streamed, decoded path (cf. lines)
+                self._map = b''
+                self.encoding, self.errors = codepage, 'strict'
+                self.mappable = False
+                return
+            if st.st_size:
+                self._map = mmap.mmap(self._fh.fileno(), 0,
+                                      access=mmap.ACCESS_READ)
+                if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                    self._map.madvise(mmap.MADV_SEQUENTIAL)
+            else:
+                # Empty files can't be mapped
+                self._map = b''
+            self.encoding, self.errors = choose_codec(filename, codepage,
+                                                      self._map[:SNIFF_SIZE])
+        except:
+            self._fh.close()
+            raise
+
+        # Can we find line breaks at the byte level?
+        self.mappable = is_ascii_compatible(self.encoding)
+        if self.mappable and 'utf-8' == codecs.lookup(self.encoding).name and \
+           self._map[:len(codecs.BOM_UTF8)] == codecs.BOM_UTF8:
+            self._start = len(codecs.BOM_UTF8)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        """Unmap & close the underlying file."""
+
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._fh.close()
+
+    def read(self, size=-1):
+        """Read & return up to 'size' bytes (all remaining bytes if 'size' is
+        negative), as a binary file object would; this lets a MappedPlaylist
+        stand in for one (e.g. for transcode.iter_normalized).
+
+        The first read starts at the beginning of the file (BOM included);
+        pages are released as they're read.
+        """
+
+        start = self._pos
+        end = len(self._map) if size < 0 else min(start + size, len(self._map))
+        data = self._map[start:end]
+        self._release(start, end)
+        self._pos = end
+        return data
+
+    def _release(self, start, end):
+        """Tell the OS we're done with the pages in [start, end) of the map.
+
+        They stay in the page cache, but no longer count against our resident
+        set; if we touch them again, they'll simply be faulted back in.
+        """
+
+        if isinstance(self._map, mmap.mmap) and hasattr(mmap, 'MADV_DONTNEED'):
+            start -= start % mmap.PAGESIZE
+            end -= end % mmap.PAGESIZE
+            if end > start:
+                self._map.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+    def blocks(self, block_size=DEFAULT_BLOCK_SIZE):
+        """Yield the playlist (less any leading BOM) in blocks of about
+        'block_size' bytes, each ending on a line break (save perhaps the
+        last).
+
+        Each block is a copy, so the pages it came from are released as soon
+        as it's been taken; however large the file, only about one block's
+        worth of it is resident at a time.
+        """
+
+        buf = self._map
+        size = len(buf)
+        pos = self._start
+        while pos < size:
+            end = pos + block_size
+            if end >= size:
+                end = size
+            else:
+                nl = buf.rfind(b'\n', pos, end)
+                if -1 == nl:
+                    nl = buf.find(b'\n', end)
+                end = size if -1 == nl else nl + 1
+            block = buf[pos:end]
+            self._release(pos, end)
+            yield block
+            pos = end
+
+    def raw_lines(self, block_size=DEFAULT_BLOCK_SIZE):
+        """Yield each line in the playlist as bytes, without its terminator
+        (& without any leading BOM).
+
+        Lines are broken as text-mode I/O would break them: on '\\n', '\\r\\n'
+        or a lone '\\r'. Only valid if 'mappable' is True.
+        """
+
+        if not self.mappable:
+            raise ValueError('{0}: {1} is not ASCII-compatible'.
+                             format(self.filename, self.encoding))
+
+        if self._start and self._start == len(self._map):
+            # Nothing but a BOM: that's a single, empty line
+            yield b''
+            return
+
+        for block in self.blocks(block_size):
+            if b'\r' not in block:
+                lines = block.split(b'\n')
+            elif block.count(b'\r') == block.count(b'\r\n'):
+                lines = block.replace(b'\r\n', b'\n').split(b'\n')
+            else:
+                lines = _NEWLINE_REGEX.split(block)
+            if block.endswith(b'\n') or block.endswith(b'\r'):
+                lines.pop()
+            yield from lines
+
+    def decode(self, raw):
+        """Decode the line 'raw' (as returned by raw_lines)."""
+
+        return decode_bytes(raw, self.encoding, self.errors)
+
+    def lines(self):
+        """Yield each line in the playlist, decoded, without its terminator."""
+
+        if not self.mappable:
+            for line in iter_decoded_lines(self.filename, self.encoding):
+                yield line.rstrip('\n')
+            return
+
+        decode = self.decode
+        for raw in self.raw_lines():
+            yield decode(raw)
@@ -0,0 +1,278 @@
+"""pipeline.py -- Convert playlists from one format to another, as streams of
+tracks.
+
+Whatever its source, a playlist comes down to a title & a sequence of
+tracks, each a two-tuple (location, extinf), where 'extinf' is None or a
+two-tuple (duration, title), either of which may be None: the
+representation m3u.iter_tracks_from_m3u yields & m3u.convert_tracks_to_m3u
+consumes. This module connects
+
+    - sources, each of which yields a two-tuple (title, tracks) for each
+      playlist it holds: M3U files, a Winamp Music Library, Rhythmbox's
+      'playlists.xml' & database, or an iTunes library (cf. SOURCES)
+
+    - stages, each of which takes a title & tracks, & returns a (possibly
+      different) title & tracks: renaming the playlist, or making
+      replacements on its contents
+
+    - sinks, which write each playlist out: as M3U (or M3U8) files, or as
+      NDJSON, one JSON object per track (cf. SINKS)
+
+Each is joined to the next by iterators, so that tracks flow from source to
+sink one at a time: converting an M3U playlist holds no more than a track of
+it in memory at once, however long it is. (The Rhythmbox & iTunes sources
+must still index their libraries' tracks, but not their playlists.)
+
+E.g. to dump a Rhythmbox library's playlists as NDJSON:
+
+    rubepl convert -f rhythmbox -t ndjson ~/.local/share/rhythmbox/rhythmdb.xml ~/.local/share/rhythmbox/playlists.xml
+
+"""
+
+__author__     = "Michael Herstine <sp1ff@pobox.com>"
+__copyright__  = "Copyright (C) 2015, 2016 Michael Herstine"
+__credits__    = ["Michael Herstine"]
+__license__    = "GPL"
+__version__    = "$Revision: $"
+__maintainer__ = "Michael Herstine <sp1ff@pobox.com>"
+__email__      = "sp1ff@pobox.com"
+__status__     = "Prototype"
+
+import json
+import logging
+import os
+import sys
+
+import rubepl
+import rubepl.itunes
+import rubepl.prefix
+import rubepl.rhythmbox
+import rubepl.winamp
+
+from rubepl.encode import encode_line
+from rubepl.m3u import Replacements, is_location, iter_m3u_lines, \
+    iter_tracks_from_m3u, parse_extinf, render_extinf
+from rubepl.writer import PlaylistWriter
+
+log = logging.getLogger(__name__)
+
+# Each source, & the number of input files it takes (None meaning any
+# number): M3U files, a Winamp 'playlists.xml', Rhythmbox's database &
+# 'playlists.xml' (in that order), or an iTunes library
+SOURCES = {'m3u': None, 'winamp': 1, 'rhythmbox': 2, 'itunes': 1}
+
+# The sinks: M3U files, or NDJSON
+SINKS = ('m3u', 'ndjson')
+
+def iter_m3u_playlists(files, codepage=None):
+    """Source: yield (title, tracks) for each of the M3U playlists 'files',
+    each titled after its file name (less extension)."""
+
+    for filename in files:
+        if not os.path.isfile(filename):
+            log.error('{0} does not appear to exist!'.format(filename))
+            continue
+        title = os.path.splitext(os.path.basename(filename))[0]
+        yield title, iter_tracks_from_m3u(filename, codepage)
+
+def iter_winamp_playlists(playlists, only=None, exclude=None, codepage=None):
+    """Source: yield (title, tracks) for each playlist in a Winamp Music
+    Library (cf. winamp.iter_playlists)."""
+
+    for title, filename in rubepl.winamp.iter_playlists(playlists, only,
+                                                        exclude):
+        if not os.path.isfile(filename):
+            log.error('{0} (for {1}) does not appear to exist!'.
+                      format(filename, title))
+            continue
+        yield title, iter_tracks_from_m3u(filename, codepage)
+
+def _open_source(name, inputs, only=None, exclude=None, codepage=None):
+    """Return an iterator over the playlists of the source 'name' (one of
+    SOURCES), reading 'inputs' (a list of paths); raise ValueError if there
+    are the wrong number of them."""
+
+    if 'm3u' == name:
+        if only or exclude:
+            log.warning('--only & --exclude are ignored for M3U files.')
+        return iter_m3u_playlists(inputs, codepage)
+
+    count = SOURCES[name]
+    if len(inputs) != count:
+        raise ValueError('the {0} source takes {1} input file{2}, not {3}'.
+                         format(name, count, '' if 1 == count else 's',
+                                len(inputs)))
+    if 'winamp' == name:
+        return iter_winamp_playlists(inputs[0], only, exclude, codepage)
+    if 'rhythmbox' == name:
+        return rubepl.rhythmbox.iter_playlists(inputs[1], inputs[0], only,
+                                               exclude)
+    return rubepl.itunes.iter_library_playlists(inputs[0], only, exclude)
+
+def rename_stage(rename):
+    """Stage: transform each playlist's title according to the rename code
+    'rename' (cf. rubepl.process_playlist_name)."""
+
+    def stage(title, tracks):
+        return rubepl.process_playlist_name(title, rename), tracks
+    return stage
+
+def _replace(tracks, replacements):
+    """Yield 'tracks' with 'replacements' made on each.
+
+    Each track is rendered as the lines it would occupy in an M3U playlist,
+    the replacements made on those, & the results parsed back, so that this
+    gives just what making the replacements on an M3U file would (if an
+    #EXTINF line no longer parses as one, though, it's dropped).
+    """
+
+    for location, extinf in tracks:
+        text = None if extinf is None else render_extinf(extinf)
+        if text is None:
+            location, = replacements.process([encode_line(location)])
+        else:
+            text, location = replacements.process([encode_line(text),
+                                                   encode_line(location)])
+            extinf = parse_extinf(text)
+        yield location, extinf
+
+def replace_stage(replacements):
+    """Stage: make 'replacements' (an m3u.Replacements instance) on each
+    playlist's tracks."""
+
+    def stage(title, tracks):
+        return title, _replace(tracks, replacements)
+    return stage
+
+def apply_stages(playlists, stages):
+    """Yield each of 'playlists' (two-tuples (title, tracks)) after passing it
+    through each of 'stages' in turn."""
+
+    for title, tracks in playlists:
+        for stage in stages:
+            title, tracks = stage(title, tracks)
+        yield title, tracks
+
+def write_m3u(playlists, output=None, utf8=False, use_bom=False, fsync=False):
+    """Sink: write each of 'playlists' to an M3U file named after its title.
+
+    :param playlists: an iterable of two-tuples (title, tracks)
+    :param str output: the directory to which playlists shall be written (the
+    present working directory if None)
+    :param bool utf8: if True, write UTF-8 to '.m3u8' files; else CP1252 to
+    '.m3u' files
+    :param bool use_bom: if True (& 'utf8' is, too), begin each file with the
+    UTF-8 BOM
+    :param bool fsync: if True, flush each file to stable storage before
+    renaming it into place
+    :return: the PlaylistWriter used (whose counters total what was written)
+
+    Each playlist is encoded & written as its tracks arrive.
+    """
+
+    writer = PlaylistWriter('utf_8' if utf8 else 'cp1252', fsync=fsync)
+    for title, tracks in playlists:
+        # Titles may contain path separators ('AC/DC')
+        outf = title.replace(os.sep, '-') + ('.m3u8' if utf8 else '.m3u')
+        if output: outf = os.path.join(output, outf)
+        log.info('"{0}"=>"{1}"'.format(title, outf))
+        try:
+            writer.write(outf, iter_m3u_lines(tracks, utf8 and use_bom))
+        except UnicodeEncodeError as ex:
+            log.error('{0} can\'t be written in CP1252 ({1}); try -u.'.
+                      format(title, ex))
+    log.debug('wrote {0} bytes to {1} files in {2:.3f}ms.'.
+              format(writer.bytes, writer.files, writer.latency * 1000.0))
+    return writer
+
+def write_ndjson(playlists, fh):
+    """Sink: write each track of each of 'playlists' to the text stream 'fh'
+    as a line of JSON: an object with the keys 'playlist', 'location',
+    'duration' & 'title' (the last two may be null). Comments & blank lines
+    in the source are dropped. Return the number of tracks written."""
+
+    count = 0
+    for title, tracks in playlists:
+        for location, extinf in tracks:
+            if not is_location(location):
+                continue
+            duration, display = extinf if extinf else (None, None)
+            fh.write(json.dumps({'playlist': title, 'location': location,
+                                 'duration': duration, 'title': display}))
+            fh.write('\n')
+            count += 1
+    return count
+
+def _convert(args):
+    """Handler for the 'convert' command."""
+
+    playlists = _open_source(args.source, args.inputs, args.only,
+                             args.exclude, args.codepage)
+
+    stages = []
+    replacements = Replacements(args.replace, args.locations_only,
+                                rubepl.prefix.from_args(args))
+    if not replacements.is_empty():
+        stages.append(replace_stage(replacements))
+    if args.rename:
+        stages.append(rename_stage(args.rename))
+    playlists = apply_stages(playlists, stages)
+
+    if 'm3u' == args.sink:
+        write_m3u(playlists, args.output, args.utf8, args.use_bom, args.fsync)
+    elif args.output:
+        with open(args.output, 'w', encoding='utf-8') as fh:
+            write_ndjson(playlists, fh)
+    else:
+        write_ndjson(playlists, sys.stdout)
+
+def build_subparser(subparsers, name='convert'):
+    """Build the sub-parser for the 'convert' command."""
+
+    cp = subparsers.add_parser(name=name, help='Convert playlists from any'
+                               + ' source (M3U files, a Winamp Music Library,'
+                               + ' Rhythmbox or iTunes) to M3U or NDJSON,'
+                               + ' streaming each playlist from source to'
+                               + ' sink.')
+    cp.add_argument('-f', '--from', dest='source', help='The source of the'
+                    + ' playlists: "m3u" (INPUTS are M3U files), "winamp" (a'
+                    + ' Winamp playlists.xml), "rhythmbox" (rhythmdb.xml &'
+                    + ' playlists.xml) or "itunes" (an iTunes library XML'
+                    + ' file)', choices=sorted(SOURCES), default='m3u')
+    cp.add_argument('-t', '--to', dest='sink', help='The format to which they'
+                    + ' shall be written: "m3u" (one file per playlist, in the'
+                    + ' output directory) or "ndjson" (one JSON object per'
+                    + ' track, to the output file, or stdout)',
+                    choices=SINKS, default='m3u')
+    cp.add_argument('-c', '--codepage', help='specify the codepage of input'
+                    + ' M3U files (if not specified, the implementation will'
+                    + ' attempt to deduce it)')
+    cp.add_argument('-o', '--output', help='output directory (for M3U) or'
+                    + ' file (for NDJSON)')
+    cp.add_argument('-x', '--exclude', help='exclude a particular playlist '
+                    + 'by title', action='append')
+    cp.add_argument('-y', '--only', help='Only this playlist', action='append')
+    cp.add_argument('-p', '--replace', help='Specify a replacement'
+                    + ' string to be applied to all text within the file; use'
+                    + ' REGEX=>REPLACEMENT where REGEX is a Python regular'
+                    + ' expression and REPLACEMENT is the text with which to'
+                    + ' replace any matches (REPLACEMENT may include'
+                    + ' sub-expressions)', action='append')
+    cp.add_argument('-L', '--locations-only', help='Only apply replacements'
+                    + ' to track locations (leaving #EXTINF information'
+                    + ' untouched)', action='store_true')
+    rubepl.prefix.add_arguments(cp)
+    cp.add_argument('-r', '--rename', help='Rename code: a sequence of'
+                    + ' characters indicating transformations to be applied'
+                    + ' to the playlist title: "l" will convert all characters'
+                    + ' to lowercase, "-" will replace whitespace with a dash')
+    cp.add_argument('-u', '--utf8', help='Use UTF-8 encoding '
+                    + 'on output', action='store_true')
+    cp.add_argument('-b', '--use-bom', help='Use the UTF-8 '
+                    + 'byte order mark on output (in UTF8)',
+                    action='store_true')
+    cp.add_argument('--fsync', help='Flush each output file to stable storage'
+                    + ' before renaming it into place', action='store_true')
+    cp.add_argument('inputs', help='The input file(s), as given by --from',
+                    nargs='+')
+    cp.set_defaults(func=_convert)
@@ -0,0 +1,162 @@
+"""prefix.py -- Rewrite track locations by longest matching path prefix.
+
+The most common use of replacements is relocating a library root: e.g.
+'C:\\Users\\x\\Music=>/srv/music'. Expressed as regexes, every such rule costs
+a scan of every line. A PrefixRewriter instead stores OLD=>NEW mappings in a
+trie keyed on path components, so each location is rewritten with a single
+walk down the trie, whose cost depends on the depth of the path, not the
+number of mappings.
+"""
+
+__author__     = "Michael Herstine <sp1ff@pobox.com>"
+__copyright__  = "Copyright (C) 2015, 2016 Michael Herstine"
+__credits__    = ["Michael Herstine"]
+__license__    = "GPL"
+__version__    = "$Revision: $"
+__maintainer__ = "Michael Herstine <sp1ff@pobox.com>"
+__email__      = "sp1ff@pobox.com"
+__status__     = "Prototype"
+
+import hashlib
+import logging
+import re
+
+log = logging.getLogger(__name__)
+
+# Path separators; we accept either, regardless of platform
+SEPARATOR_REGEX = re.compile(r'[\\/]')
+
+def split_path(path):
+    """Split 'path' into components on either '/' or '\\', ignoring trailing
+    separators. An absolute POSIX path will produce a leading empty
+    component."""
+
+    parts = SEPARATOR_REGEX.split(path)
+    while len(parts) > 1 and not parts[-1]:
+        parts.pop()
+    return parts
+
+def parse_mapping(text):
+    """Parse a mapping of the form OLD=>NEW (or OLD=NEW) into a two-tuple."""
+
+    if '=>' in text:
+        old, new = text.split('=>', 1)
+    elif '=' in text:
+        old, new = text.split('=', 1)
+    else:
+        raise ValueError("'{0}' is not of the form OLD=NEW".format(text))
+    return (old.strip(), new.strip())
+
+class PrefixRewriter(object):
+    """A set of path-prefix mappings, stored as a trie.
+
+    Each node of the trie is a two-element list: a dictionary mapping the next
+    path component to a child node, and the replacement for the path ending at
+    this node (or None). Rewriting a location walks the trie component by
+    component, remembering the deepest replacement seen, then joins the
+    remainder of the path onto it using the separator that the replacement
+    itself uses (so 'C:\\Users\\x\\Music\\A\\b.mp3' under
+    'C:\\Users\\x\\Music=>/srv/music' becomes '/srv/music/A/b.mp3').
+    """
+
+    def __init__(self, mappings=None):
+        """Construct with an optional sequence of OLD=NEW strings."""
+
+        self._root = [{}, None]
+        self._count = 0
+        self._hash = hashlib.sha1()
+        if mappings:
+            for text in mappings:
+                self.add(*parse_mapping(text))
+
+    def __len__(self):
+        return self._count
+
+    def add(self, old, new):
+        """Map locations beginning with the path 'old' to 'new'.
+
+        Prefixes match whole path components only: 'C:\\Music' will match
+        'C:\\Music\\a.mp3', but not 'C:\\Musical\\a.mp3'.
+        """
+
+        node = self._root
+        for part in split_path(old):
+            node = node[0].setdefault(part, [{}, None])
+        if node[1] is None:
+            self._count += 1
+        if '\\' in new and '/' not in new:
+            sep = '\\'
+        else:
+            sep = '/'
+        node[1] = (new.rstrip('\\/') if len(new) > 1 else new, sep)
+        self._hash.update('{0}\0{1}\0'.format(old, new).encode('utf-8', 'surrogateescape'))
+
+    def load(self, filename):
+        """Read mappings from 'filename', one per line (blank lines & lines
+        beginning with '#' are ignored); return the number read."""
+
+        n = 0
+        with open(filename, 'r', encoding='utf-8') as fh:
+            for line in fh:
+                line = line.strip()
+                if not line or line.startswith('#'):
+                    continue
+                self.add(*parse_mapping(line))
+                n += 1
+        log.debug('read {0} prefix mappings from {1}'.format(n, filename))
+        return n
+
+    def signature(self):
+        """Return a value identifying this set of mappings (suitable for
+        inclusion in a manifest.fingerprint)."""
+
+        return self._hash.hexdigest()
+
+    def rewrite(self, location):
+        """Rewrite 'location' according to the longest matching prefix; if no
+        prefix matches, return it unchanged."""
+
+        parts = SEPARATOR_REGEX.split(location)
+        node = self._root
+        best = None
+        depth = 0
+        for i, part in enumerate(parts):
+            node = node[0].get(part)
+            if node is None:
+                break
+            if node[1] is not None:
+                best = node[1]
+                depth = i + 1
+        if best is None:
+            return location
+
+        new, sep = best
+        rest = parts[depth:]
+        if not rest:
+            return new
+        if new.endswith(sep):
+            return new + sep.join(rest)
+        return sep.join([new] + rest)
+
+def add_arguments(parser):
+    """Add the options controlling prefix rewrites to an argparse parser."""
+
+    parser.add_argument('-P', '--rewrite-prefix', help='Rewrite track'
+                        + ' locations beginning with the path OLD to begin with'
+                        + ' NEW instead; use OLD=NEW (may be given more than'
+                        + ' once; the longest matching prefix wins)',
+                        action='append', metavar='OLD=NEW')
+    parser.add_argument('--rewrite-prefix-file', help='Read prefix rewrites'
+                        + ' (OLD=NEW, one per line) from a file',
+                        action='append', metavar='FILE')
+
+def from_args(args):
+    """Build a PrefixRewriter from parsed arguments (cf. add_arguments); return
+    None if no prefix rewrites were requested."""
+
+    if not args.rewrite_prefix and not args.rewrite_prefix_file:
+        return None
+    rewriter = PrefixRewriter(args.rewrite_prefix)
+    for filename in args.rewrite_prefix_file or []:
+        rewriter.load(filename)
+    return rewriter
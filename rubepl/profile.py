@@ -0,0 +1,167 @@
+"""profile.py -- Output profiles: writing each playlist several ways at once.
+
+An output profile is one way of writing a playlist: its encoding (& whether
+it carries a BOM), the replacements to be made on its contents, how its title
+becomes a file name, & the directory to which it's written. It's common to
+want several: cp1252 '.m3u' files for one player, UTF-8 '.m3u8' files with a
+BOM for another, & a copy with rewritten locations for a phone. Rather than
+running an exporter once per profile (parsing its inputs every time), the
+exporters accept a list of profiles, read each playlist once, & render it to
+every profile in turn.
+
+Profiles are given on the command line in a JSON file (cf. add_arguments),
+as a list of objects, e.g.
+
+    [{"output": "pc"},
+     {"output": "m3u8", "utf8": true, "use_bom": true},
+     {"output": "phone", "utf8": true, "replace": ["/pub/mp3/=>/sdcard/Music/"],
+      "locations_only": true}]
+
+Any key a profile doesn't give takes the value of the corresponding option.
+"""
+
+__author__     = "Michael Herstine <sp1ff@pobox.com>"
+__copyright__  = "Copyright (C) 2015, 2016 Michael Herstine"
+__credits__    = ["Michael Herstine"]
+__license__    = "GPL"
+__version__    = "$Revision: $"
+__maintainer__ = "Michael Herstine <sp1ff@pobox.com>"
+__email__      = "sp1ff@pobox.com"
+__status__     = "Prototype"
+
+import json
+import logging
+import os
+
+import rubepl
+import rubepl.m3u
+import rubepl.prefix
+
+from rubepl.manifest import Manifest
+from rubepl.writer import PlaylistWriter
+
+log = logging.getLogger(__name__)
+
+# The keys a profile may give, each of which names the corresponding option
+PROFILE_KEYS = ('output', 'utf8', 'use_bom', 'rename', 'replace',
+                'locations_only', 'rewrite_prefix', 'incremental', 'fsync')
+
+class Profile(object):
+    """One way of writing playlists.
+
+    The attributes 'rename', 'replacements', 'utf8', 'use_bom', 'output',
+    'manifest' & 'fsync' have the meanings of the like-named parameters to
+    m3u.normalize_m3u_playlist; 'writer' is the PlaylistWriter with which
+    this profile's playlists are written (so its counters total this
+    profile's output).
+    """
+
+    def __init__(self, rename=None, replacements=None, utf8=None,
+                 use_bom=None, output=None, manifest=None, fsync=None):
+        self.rename = rename
+        if replacements is None:
+            replacements = rubepl.m3u.Replacements(None)
+        self.replacements = replacements
+        self.utf8 = utf8
+        self.use_bom = use_bom
+        self.output = output
+        self.manifest = manifest
+        self.fsync = fsync
+        self.writer = PlaylistWriter('utf_8' if utf8 else 'cp1252',
+                                     fsync=fsync)
+
+    def outfile(self, title):
+        """Return the path to which the playlist 'title' is written."""
+
+        outf = rubepl.process_playlist_name(title, self.rename) + \
+            ('.m3u8' if self.utf8 else '.m3u')
+        if self.output:
+            outf = os.path.join(self.output, outf)
+        return outf
+
+def load_profiles(filename):
+    """Read a list of profiles from the JSON file 'filename'; return a list of
+    dictionaries (whose keys are among PROFILE_KEYS). Raise ValueError if the
+    file isn't such a list."""
+
+    with open(filename, 'r', encoding='utf-8') as fh:
+        profiles = json.load(fh)
+    if not isinstance(profiles, list) or not profiles:
+        raise ValueError('{0}: expected a non-empty list of profiles'.
+                         format(filename))
+    for i, profile in enumerate(profiles):
+        if not isinstance(profile, dict):
+            raise ValueError('{0}: profile {1} is not an object'.
+                             format(filename, i))
+        for key in profile:
+            if key not in PROFILE_KEYS:
+                raise ValueError('{0}: unknown key "{1}" in profile {2}'.
+                                 format(filename, key, i))
+    return profiles
+
+def add_arguments(parser):
+    """Add the option naming a file of output profiles to an argparse
+    parser."""
+
+    parser.add_argument('--profiles', help='Write each playlist once for each'
+                        + ' output profile in FILE, reading the inputs only'
+                        + ' once; FILE is a JSON list of objects with any of'
+                        + ' the keys ' + ', '.join(PROFILE_KEYS) + ' (keys'
+                        + ' not given take the values of the corresponding'
+                        + ' options)', metavar='FILE')
+
+def from_args(args, repairs=None):
+    """Build a list of Profiles from parsed arguments (cf. add_arguments): one
+    for each profile named by --profiles, else a single one given by the
+    other options.
+
+    :param Namespace args: parsed arguments, including the options named by
+    PROFILE_KEYS & those of prefix.add_arguments
+    :param repair.RepairIndex repairs: optional index with which every profile
+    shall repair missing tracks
+
+    Profiles writing to the same directory share a Manifest (cf. save). Raise
+    ValueError if two profiles would write the same files.
+    """
+
+    specs = load_profiles(args.profiles) if args.profiles else [{}]
+    prefixes = rubepl.prefix.from_args(args)
+    manifests = {}
+    profiles = []
+    for i, spec in enumerate(specs):
+        opts = dict((key, spec.get(key, getattr(args, key)))
+                    for key in PROFILE_KEYS)
+        if 'rewrite_prefix' in spec:
+            rewriter = rubepl.prefix.PrefixRewriter(opts['rewrite_prefix'])
+        else:
+            rewriter = prefixes
+        manifest = None
+        if opts['incremental']:
+            directory = os.path.abspath(opts['output'] or os.curdir)
+            if directory not in manifests:
+                manifests[directory] = Manifest(opts['output'])
+            manifest = manifests[directory]
+        profile = Profile(opts['rename'],
+                          rubepl.m3u.Replacements(opts['replace'],
+                                                  opts['locations_only'],
+                                                  rewriter, repairs),
+                          opts['utf8'], opts['use_bom'], opts['output'],
+                          manifest, opts['fsync'])
+        for j, other in enumerate(profiles):
+            if (os.path.abspath(other.output or os.curdir) ==
+                os.path.abspath(profile.output or os.curdir) and
+                bool(other.utf8) == bool(profile.utf8) and
+                other.rename == profile.rename):
+                raise ValueError('profiles {0} & {1} would write the same '
+                                 'files'.format(j, i))
+        profiles.append(profile)
+    return profiles
+
+def save(profiles):
+    """Save the manifests (if any) of 'profiles', each once."""
+
+    saved = set()
+    for profile in profiles:
+        if profile.manifest and id(profile.manifest) not in saved:
+            profile.manifest.save()
+            saved.add(id(profile.manifest))
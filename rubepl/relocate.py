@@ -0,0 +1,161 @@
+"""relocate.py -- Point playlists at tracks that have moved.
+
+Re-organizing the music tree produces a map from old path to new for every
+file moved, and there may be hundreds of thousands of them. Applying that map
+as replacements ('normalize-m3u -p') would mean a regex per moved file, each
+tried against every line. A MoveMap instead loads the map into a dictionary,
+so relocating a track is a single lookup however large the map, and the
+'relocate' command streams each playlist through it once (cf.
+m3u.normalize_m3u_playlist, which does the reading & writing).
+
+Move maps are text files (UTF-8), one move per line: the old location, a tab,
+and the new location. Blank lines, & lines beginning with '#', are ignored.
+With --canonical, the map also moves every track with duplicates to the
+canonical copy of its audio, as recorded in a content index (cf. content.py).
+"""
+
+__author__     = "Michael Herstine <sp1ff@pobox.com>"
+__copyright__  = "Copyright (C) 2015, 2016 Michael Herstine"
+__credits__    = ["Michael Herstine"]
+__license__    = "GPL"
+__version__    = "$Revision: $"
+__maintainer__ = "Michael Herstine <sp1ff@pobox.com>"
+__email__      = "sp1ff@pobox.com"
+__status__     = "Prototype"
+
+import logging
+import os
+import time
+
+import rubepl.content
+
+from rubepl.content import ContentIndex
+from rubepl.manifest import Manifest, file_fingerprint, fingerprint
+from rubepl.m3u import Replacements, normalize_m3u_playlist
+
+log = logging.getLogger(__name__)
+
+class MoveMap(object):
+    """A map from old track locations to new.
+
+    The attribute 'relocated' counts the locations relocated so far.
+    """
+
+    def __init__(self, moves=None):
+        """Construct from a dictionary of old location to new (or empty)."""
+
+        self._moves = dict(moves) if moves else {}
+        # Identify each source of moves, in order: a digest of 'moves' (taken
+        # now, since a content index can change without its file's size or
+        # mtime doing so), & the fingerprint of each file loaded
+        self._sources = []
+        if self._moves:
+            self._sources.append(fingerprint(sorted(self._moves.items())))
+        self.relocated = 0
+
+    def __len__(self):
+        return len(self._moves)
+
+    def load(self, filename):
+        """Add the moves in 'filename' (cf. above); later moves of the same
+        location supersede earlier ones."""
+
+        start = time.perf_counter()
+        moves = self._moves
+        with open(filename, 'r', encoding='utf_8_sig',
+                  errors='surrogateescape') as fh:
+            for lineno, line in enumerate(fh, 1):
+                line = line.rstrip('\r\n')
+                if not line or line.startswith('#'):
+                    continue
+                old, sep, new = line.partition('\t')
+                if not sep or not old or not new:
+                    raise ValueError('{0}:{1}: expected OLD<TAB>NEW'.
+                                     format(filename, lineno))
+                moves[old] = new
+        self._sources.append(file_fingerprint(filename))
+        log.debug('loaded {0} ({1} moves in all) in {2:.2f}s.'.format(
+            filename, len(moves), time.perf_counter() - start))
+
+    def signature(self):
+        """Return a value identifying this map (suitable for inclusion in a
+        manifest.fingerprint)."""
+
+        return tuple(self._sources)
+
+    def relocate(self, location):
+        """Return the new location of 'location' (or 'location' itself, if it
+        hasn't moved)."""
+
+        new = self._moves.get(location)
+        if new is None:
+            return location
+        self.relocated += 1
+        return new
+
+def _relocate(args):
+    """Handler for the 'relocate' command.
+
+    :param Namespace args: Presumably the result of calling parse_args on the
+    rubepl ArgumentParser.
+    """
+
+    if not args.move_map and not args.canonical:
+        log.error('relocate needs a move map (-m), --canonical, or both.')
+        return
+    if args.canonical:
+        with ContentIndex(args.content_index) as index:
+            moves = MoveMap(index.canonical_map())
+    else:
+        moves = MoveMap()
+    for filename in args.move_map or ():
+        moves.load(filename)
+
+    replacements = Replacements(None, moves=moves)
+    manifest = Manifest(args.output) if args.incremental else None
+    for f in args.files:
+        title = os.path.splitext(os.path.split(f)[-1])[0]
+        normalize_m3u_playlist(title, f, args.rename, replacements,
+                               args.utf8, args.use_bom, args.codepage,
+                               args.output, manifest, args.fsync)
+    if manifest:
+        manifest.save()
+    log.info('relocated {0} tracks.'.format(moves.relocated))
+
+def build_subparser(subparsers, name='relocate'):
+    """Build the sub-parser for the 'relocate' command."""
+
+    rl = subparsers.add_parser(name=name, help='Rewrite the locations of '
+                               + 'tracks that have moved in one or more M3U '
+                               + 'playlists, according to a map of old '
+                               + 'locations to new.')
+    rl.add_argument('files', help='Playlists to be rewritten', nargs='+')
+    rl.add_argument('-m', '--move-map', help='File listing the moves, one per'
+                    + ' line: the old location, a tab & the new location (may'
+                    + ' be given more than once)', action='append',
+                    metavar='FILE')
+    rl.add_argument('--canonical', help='Also move each track to the '
+                    + 'canonical copy of its audio, according to the index '
+                    + 'built by the "content-index" command (moves given with'
+                    + ' -m take precedence)', action='store_true')
+    rubepl.content.add_arguments(rl)
+    rl.add_argument('-c', '--codepage', help='specify the input codepage; if '
+                    + 'not specified, the implementation will attempt to '
+                    + 'deduce the input encoding automatically')
+    rl.add_argument('-o', '--output', help='output directory')
+    rl.add_argument('-r', '--rename', help='Rename code: a sequence of'
+                    + ' characters indicating transformations to be applied'
+                    + ' to the playlist title: "l" will convert all characters'
+                    + ' to lowercase, "-" will replace whitespace with a dash')
+    rl.add_argument('-u', '--utf8', help='Use UTF-8 encoding '
+                    + 'on output', action='store_true')
+    rl.add_argument('-b', '--use-bom', help='Use the UTF-8 '
+                    + 'byte order mark on output (in UTF8)',
+                    action='store_true')
+    rl.add_argument('-I', '--incremental', help='Keep a manifest in the'
+                    + ' output directory & skip playlists whose inputs,'
+                    + ' move maps & options are unchanged since the last run',
+                    action='store_true')
+    rl.add_argument('--fsync', help='Flush each output file to stable storage'
+                    + ' before renaming it into place', action='store_true')
+    rl.set_defaults(func=_relocate)
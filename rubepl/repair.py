@@ -0,0 +1,196 @@
+"""repair.py -- Point missing tracks at the files they (probably) meant.
+
+Playlists written on Windows (by Winamp, say) often name tracks by paths that
+differ from those of the real files on the server only in case, in the path
+separator, or in the directories leading up to them. A RepairIndex walks the
+music library once (cf. fsindex.walk) & indexes every file twice: by its full
+path, casefolded, and by its basename, casefolded. Each missing location can
+then be repaired with a dictionary lookup or two, and one index serves any
+number of playlists.
+
+A missing location is repaired, in order of preference, to:
+
+    1. the one file whose path matches it but for case & separators
+    2. the one file with the same basename (again, ignoring case)
+    3. of several files with the same basename, the one whose trailing
+       directories match those of the location most closely
+
+If there's no candidate at all, the location is 'unresolved'; if there's no
+single best candidate, it's 'ambiguous'. Either way it's left unchanged &
+recorded for the report.
+"""
+
+__author__     = "Michael Herstine <sp1ff@pobox.com>"
+__copyright__  = "Copyright (C) 2015, 2016 Michael Herstine"
+__credits__    = ["Michael Herstine"]
+__license__    = "GPL"
+__version__    = "$Revision: $"
+__maintainer__ = "Michael Herstine <sp1ff@pobox.com>"
+__email__      = "sp1ff@pobox.com"
+__status__     = "Prototype"
+
+import logging
+import os
+import time
+
+import rubepl.fsindex
+
+from rubepl.prefix import SEPARATOR_REGEX
+
+log = logging.getLogger(__name__)
+
+def _normalize(location, base=None):
+    """Make 'location' absolute (relative to 'base', if given), using this
+    platform's separator."""
+
+    location = SEPARATOR_REGEX.sub(lambda m: os.sep, location)
+    if base is not None:
+        location = os.path.join(base, location)
+    return os.path.abspath(location)
+
+def _add(table, key, path):
+    """Map 'key' to 'path' in 'table'; colliding paths are kept in a list."""
+
+    old = table.get(key)
+    if old is None:
+        table[key] = path
+    elif isinstance(old, list):
+        old.append(path)
+    else:
+        table[key] = [old, path]
+
+def _suffix_score(parts, path):
+    """Count the trailing path components 'path' shares with 'parts' (a
+    reversed list of casefolded components)."""
+
+    score = 0
+    for mine, theirs in zip(parts, reversed(SEPARATOR_REGEX.split(path.casefold()))):
+        if mine != theirs:
+            break
+        score += 1
+    return score
+
+class RepairIndex(object):
+    """An index of the files under one or more library roots, for repairing
+    missing track locations.
+
+    After repairing, the attributes 'ok', 'fixed', 'ambiguous' & 'unresolved'
+    record what happened: the first two are counts, 'ambiguous' maps each
+    ambiguous location to its candidates, & 'unresolved' is the set of
+    locations for which there were none.
+    """
+
+    def __init__(self, roots, workers=rubepl.fsindex.DEFAULT_WORKERS):
+        """Walk 'roots' with 'workers' threads & index every file found."""
+
+        start = time.perf_counter()
+        self.roots = sorted(os.path.abspath(root) for root in roots)
+        self._paths = set()
+        self._by_path = {}
+        self._by_name = {}
+        self._signature = None
+        for directory, files, subdirs in rubepl.fsindex.walk(self.roots, workers):
+            for path in files:
+                self._paths.add(path)
+                _add(self._by_path, path.casefold(), path)
+                _add(self._by_name, os.path.basename(path).casefold(), path)
+        self.ok = 0
+        self.fixed = 0
+        self.ambiguous = {}
+        self.unresolved = set()
+        log.debug('indexed {0} files under {1} in {2:.2f}s.'.format(
+            len(self._paths), ', '.join(self.roots), time.perf_counter() - start))
+
+    def __len__(self):
+        return len(self._paths)
+
+    def signature(self):
+        """Return a value identifying this index (suitable for inclusion in a
+        manifest.fingerprint); it changes if any file is added or removed."""
+
+        # The index never changes once built, so hash it just the once (this
+        # is asked for once per playlist)
+        if self._signature is None:
+            total = sum(map(rubepl.fsindex.path_key, self._paths)) & (2**64 - 1)
+            self._signature = (tuple(self.roots), len(self._paths), total)
+        return self._signature
+
+    def candidates(self, location, base=None):
+        """Return a list of the files 'location' might have meant, best first
+        (only the first is a match if the list has one element); a relative
+        'location' is taken relative to 'base', if given."""
+
+        norm = _normalize(location, base)
+        match = self._by_path.get(norm.casefold())
+        if isinstance(match, str):
+            return [match]
+
+        found = self._by_name.get(os.path.basename(norm).casefold())
+        if found is None:
+            return []
+        if isinstance(found, str):
+            return [found]
+
+        # Several files of that name: rank them by how many of their trailing
+        # directories match those of 'location'
+        parts = list(reversed(SEPARATOR_REGEX.split(norm.casefold())))
+        ranked = sorted(found, key=lambda path: -_suffix_score(parts, path))
+        best = _suffix_score(parts, ranked[0])
+        return [path for path in ranked if _suffix_score(parts, path) == best]
+
+    def repair(self, location, base=None):
+        """Return the repaired form of 'location' (or 'location' itself, if
+        it exists or can't be repaired).
+
+        :param str location: a track location, as it appears in a playlist
+        :param str base: the directory against which a relative 'location' is
+        resolved (typically that of its playlist); if None, the current
+        working directory
+        """
+
+        path = location if base is None else os.path.join(base, location)
+        if path in self._paths or os.path.exists(path):
+            self.ok += 1
+            return location
+
+        found = self.candidates(location, base)
+        if 1 == len(found):
+            self.fixed += 1
+            log.debug('{0} => {1}'.format(location, found[0]))
+            return found[0]
+        if found:
+            self.ambiguous[location] = found
+        else:
+            self.unresolved.add(location)
+        return location
+
+    def report(self):
+        """Return a list of lines summarizing the repairs made so far."""
+
+        lines = ['{0} tracks present, {1} repaired, {2} ambiguous, {3} '
+                 'unresolved.'.format(self.ok, self.fixed, len(self.ambiguous),
+                                      len(self.unresolved))]
+        for location in sorted(self.ambiguous):
+            lines.append('ambiguous: {0} (could be any of {1})'.format(
+                location, ', '.join(self.ambiguous[location])))
+        for location in sorted(self.unresolved):
+            lines.append('unresolved: {0}'.format(location))
+        return lines
+
+def add_arguments(parser):
+    """Add the options controlling track repair to an argparse parser."""
+
+    parser.add_argument('-R', '--repair-root', help='Repair tracks that are '
+                        + 'missing by finding the file they most likely name '
+                        + '(ignoring case, separators & leading directories) '
+                        + 'under this directory (may be given more than once)',
+                        action='append', metavar='DIR')
+
+def from_args(args):
+    """Build a RepairIndex from parsed arguments (cf. add_arguments); return
+    None if no repair roots were given."""
+
+    if not args.repair_root:
+        return None
+    return RepairIndex(args.repair_root,
+                       getattr(args, 'jobs', rubepl.fsindex.DEFAULT_WORKERS))
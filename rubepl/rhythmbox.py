@@ -4,6 +4,11 @@ E.g. the following command will grab 'Fall 2013' out of Rhythmbox & export it to
 
 rubepl --debug get-playlists-xml --only 'Fall 2013' -ub ~/.local/share/rhythmbox/rhythmdb.xml ~/.local/share/rhythmbox/playlists.xml
 
+& this one will put it back (replacing the static playlist of that name, or
+adding one if there's none):
+
+rubepl put-playlists-xml ~/.local/share/rhythmbox/playlists.xml 'Fall 2013.m3u8'
+
 """
 
 __author__     = "Michael Herstine <sp1ff@pobox.com>"
@@ -15,20 +20,80 @@ __maintainer__ = "Michael Herstine <sp1ff@pobox.com>"
 __email__      = "sp1ff@pobox.com"
 __status__     = "Prototype"
 
+import collections
 import logging
 import os
 import xml.etree.ElementTree as ET
+import xml.parsers.expat
+
+from xml.sax.saxutils import escape, quoteattr
 
 import rubepl
+import rubepl.catalog
+import rubepl.prefix
+import rubepl.profile
 
 from rubepl.decode import decode_track_location
-from rubepl.m3u import convert_tracks_to_m3u, Replacements
+from rubepl.encode import encode_track_location
+from rubepl.manifest import fingerprint, file_fingerprint
+from rubepl.shared import shared
+from rubepl.m3u import convert_tracks_to_m3u, iter_track_locations
+from rubepl.writer import atomic_write
 
 DEFAULT_DB = os.path.expanduser('~/.local/share/rhythmbox/rhythmdb.xml')
 DEFAULT_PL = os.path.expanduser('~/.local/share/rhythmbox/playlists.xml')
 
 log = logging.getLogger(__name__)
 
+# The attributes given a newly-added playlist (Rhythmbox's defaults)
+NEW_PLAYLIST_ATTRS = (('show-browser', 'true'), ('browser-position', '180'),
+                      ('search-type', 'search-match'))
+
+# Copy unchanged parts of playlists.xml in chunks of this many bytes
+_CHUNK_SIZE = 1 << 20
+
+def iter_db(dbpath=DEFAULT_DB):
+    """Walk the songs in the Rhythmbox database, yielding a four-tuple
+    (location, duration, artist, title) for each.
+
+    :param str dbpath: path to the XML file containing the Rhythmbox database;
+    defaults to ~/.local/share/rhythmbox/rhythmdb.xml)
+
+    The database is read incrementally (cf.
+    xml.etree.ElementTree.iterparse), each entry being discarded once it's
+    been yielded.
+    """
+
+    log.debug("parsing '{0}'...".format(dbpath))
+    # 'entry' should be a child of the root
+    depth = 0
+    for event, child in ET.iterparse(dbpath, events=('start', 'end')):
+        if 'start' == event:
+            depth += 1
+            continue
+        depth -= 1
+        if 1 != depth:
+            continue
+        if 'entry' == child.tag and 'song' == child.attrib.get('type'):
+            title = None
+            artist = None
+            duration = None
+            location = None
+            for attr in child:
+                if 'title' == attr.tag:
+                    title = attr.text
+                elif 'artist' == attr.tag:
+                    artist = attr.text
+                elif 'duration' == attr.tag:
+                    duration = int(attr.text)
+                elif 'location' == attr.tag:
+                    location = decode_track_location(attr.text)
+            if location:
+                yield (location, duration, artist, title)
+        child.clear()
+    log.debug("parsing '{0}'...done.".format(dbpath))
+
+@shared('dbpath')
 def build_db(dbpath=DEFAULT_DB):
     """Walk the Rhythmbox database, building a mapping from file location to track
     information.
@@ -38,32 +103,10 @@ def build_db(dbpath=DEFAULT_DB):
     :return: a dictionary mapping track location to a (duration, artist, title) triplet
     """
 
-    log.debug("parsing '{0}'...".format(dbpath))
-    root = ET.parse(dbpath).getroot()
-    log.debug("parsing '{0}'...done.".format(dbpath))
-
-    # 'child' should be a node of type 'entry'
-    db = { }
-    for child in root:
-        if 'song' != child.attrib['type']: continue
-        title = None
-        artist = None
-        duration = None
-        location = None
-        for attr in child.getchildren():
-            if 'title' == attr.tag:
-                title = attr.text
-            elif 'artist' == attr.tag:
-                artist = attr.text
-            elif 'duration' == attr.tag:
-                duration = int(attr.text)
-            elif 'location' == attr.tag:
-                location = decode_track_location(attr.text)
-        if not location: continue
-        db[location] = (duration, artist, title)
-
-    return db
+    return dict((location, (duration, artist, title))
+                for location, duration, artist, title in iter_db(dbpath))
 
+@shared('playlists')
 def get_playlists(playlists=DEFAULT_PL, only=None, exclude=None):
     """Extract a set of playlists from playlists.xml
 
@@ -97,9 +140,71 @@ def get_playlists(playlists=DEFAULT_PL, only=None, exclude=None):
 
     return out
 
+class _TrackLookup(object):
+    """Look tracks up by location in the Rhythmbox database, which is only
+    parsed (or, given a catalog, loaded into it) on first use."""
+
+    def __init__(self, dbpath=DEFAULT_DB, catalog=None):
+        self._dbpath = dbpath
+        self._catalog = catalog
+        # {location=>(duration,artist,title)...}
+        self._db = None
+
+    def tracks(self, locations):
+        """Yield a two-tuple (location, (duration, display)) for each of
+        'locations' in turn ((location, None) for those not in the
+        database)."""
+
+        if self._db is None and self._catalog is not None:
+            self._catalog.load('rhythmbox', self._dbpath)
+            self._db = {}
+        if self._catalog is not None:
+            self._db.update((location, (track.duration, track.artist,
+                                        track.title))
+                            for location, track in self._catalog.by_location(
+                                locations, 'rhythmbox').items())
+        elif self._db is None:
+            self._db = build_db(self._dbpath)
+
+        db = self._db
+        for location in locations:
+            if location in db:
+                duration, artist, title = db[location]
+                if not duration: duration = -1
+                if artist:
+                    display = '{0} - {1}'.format(artist, title)
+                else:
+                    display = title
+                yield (location, (duration, display))
+            else:
+                yield (location, None)
+
+def iter_playlists(playlists=DEFAULT_PL, dbpath=DEFAULT_DB, only=None,
+                   exclude=None, catalog=None):
+    """Yield a two-tuple (title, tracks) for each static playlist in a
+    Rhythmbox-style 'playlists.xml', where 'tracks' is an iterator over
+    two-tuples (location, (duration, display)) suitable for
+    m3u.convert_tracks_to_m3u.
+
+    :param str playlists: Location of the 'playlists.xml' file to be parsed
+    :param str dbpath: path to the XML file containing the Rhythmbox database
+    :param sequence only: An optional sequence of titles; if non-None, only the
+    playlists contained herein will be yielded
+    :param sequence exclude: An optional sequence of titles; if non-None, the
+    playlists contained herein will not be yielded
+    :param catalog.Catalog catalog: If non-None, look tracks up in this
+    catalog rather than parsing 'dbpath'
+    """
+
+    lookup = _TrackLookup(dbpath, catalog)
+    for title, locations in get_playlists(playlists, only, exclude):
+        yield title, lookup.tracks(locations)
+
 def playlists_xml_to_m3u(playlists=DEFAULT_PL, dbpath=DEFAULT_DB,
                          rename=None, replacements=None, utf8=None, only=None,
-                         exclude=None, output=None, use_bom=None):
+                         exclude=None, output=None, use_bom=None,
+                         manifest=None, fsync=None, catalog=None,
+                         profiles=None):
     """Extract playlists from a Rhythmbox-style 'playlists.xml' & convert them to
     M3U format.
 
@@ -121,6 +226,22 @@ def playlists_xml_to_m3u(playlists=DEFAULT_PL, dbpath=DEFAULT_DB,
     playlists contained herein will be exported
     :param sequence exclude: An optional sequence of titles; if non-None, the
     playlists contained herein will not be exported
+    :param Manifest manifest: If non-None, the manifest for 'output'; playlists
+    whose tracks, database & options are unchanged since the last run will be
+    skipped, as will outputs whose contents would be identical
+    :param bool fsync: If True, flush each output file to stable storage before
+    renaming it into place
+    :param catalog.Catalog catalog: If non-None, look tracks up in this
+    catalog (loading 'dbpath' into it, if changed since it was last loaded)
+    rather than parsing 'dbpath'
+    :param list profiles: If non-None, a list of profile.Profile instances,
+    each of which every playlist shall be written to (in which case 'rename',
+    'replacements', 'utf8', 'output', 'use_bom', 'manifest' & 'fsync' are
+    ignored); the inputs are parsed, & each playlist's tracks looked up, only
+    once, however many there are
+
+    When a manifest is given and every selected playlist is up-to-date, the
+    Rhythmbox database won't even be parsed.
 
     'rename' is a textual string where each character represents a
     given transformation to be performed on the title. The following
@@ -137,47 +258,238 @@ def playlists_xml_to_m3u(playlists=DEFAULT_PL, dbpath=DEFAULT_DB,
         log.warn("No playlists selected for output.")
         return
 
-    # {location=>(duration,artist,title)...}
-    db = build_db(dbpath)
+    if profiles is None:
+        profiles = [rubepl.profile.Profile(rename, replacements, utf8, use_bom,
+                                           output, manifest, fsync)]
+
+    # The database is only parsed once some playlist needs writing
+    lookup = _TrackLookup(dbpath, catalog)
+    if any(profile.manifest for profile in profiles):
+        dbkey = file_fingerprint(dbpath)
 
     # For each playlist...
     for pl in out:
 
-        new_name = rubepl.process_playlist_name(pl[0], rename)
-        log.info(pl[0] + ' => ' + new_name)
+        # [(profile, output file, manifest key),...]
+        pending = []
+        for profile in profiles:
+            outf = profile.outfile(pl[0])
+            log.info(pl[0] + ' => ' + outf)
+            key = None
+            if profile.manifest:
+                key = fingerprint('get-playlists-xml', pl[0], tuple(pl[1]),
+                                  dbkey, profile.replacements.signature(),
+                                  profile.utf8, profile.use_bom)
+                if profile.manifest.is_current(outf, key):
+                    continue
+            pending.append((profile, outf, key))
+        if not pending:
+            continue
 
-        if utf8:
-            outf = new_name + ".m3u8"
-            outcp = 'utf_8'
-        else:
-            outf = new_name + ".m3u"
-            outcp = 'cp1252'
+        tracks = list(lookup.tracks(pl[1]))
 
-        tracks = [ ]
-        locations = pl[1] # [location,...]
-        for location in locations:
-            if location in db:
-                duration, artist, title = db[location]
-                # log.debug('{0} => ({1}, {2}, {3})'.format(location, duration, artist, title))
-                if not duration: duration = -1
-                if artist:
-                    display = '{0} - {1}'.format(artist, title)
-                else:
-                    display = title
-                tracks.append((location, (duration,display)))
+        for profile, outf, key in pending:
+            lines = profile.replacements.process(
+                convert_tracks_to_m3u(tracks, profile.use_bom))
+            log.debug(lines)
+
+            data = profile.writer.encode(lines)
+            if profile.manifest:
+                profile.manifest.write(outf, key, data, profile.writer)
             else:
-                tracks.append((location, None))
+                profile.writer.write_bytes(outf, data)
+
+    for profile in profiles:
+        writer = profile.writer
+        log.debug('wrote {0} bytes to {1} files in {2:.3f}ms.'.
+                  format(writer.bytes, writer.files, writer.latency * 1000.0))
+
+def scan_playlists_xml(playlists=DEFAULT_PL):
+    """Find the top-level elements of a Rhythmbox-style 'playlists.xml'
+    without building a tree.
 
-        lines = convert_tracks_to_m3u(tracks, use_bom)
-        if replacements:
-            lines = replacements.process(lines)
-        log.debug(lines)
+    :param str playlists: Location of the 'playlists.xml' file to be scanned
+    :return: a two-tuple (elements, end), where 'elements' is a list of
+    three-tuples (tag, attributes, offset), one for each child of the root
+    element, in order, & 'end' is the offset of the root element's end tag
+    (offsets are in bytes from the start of the file)
 
-        if output: outf = os.path.join(output, outf)
+    Each element's bytes run from its offset to the next's (or to 'end'),
+    which takes in any whitespace or comments that follow it.
+    """
+
+    parser = xml.parsers.expat.ParserCreate()
+    elements = [ ]
+    # depth & end of root, in a list for the benefit of the closures below
+    state = [0, None]
+    def start(tag, attrs):
+        if 1 == state[0]:
+            elements.append((tag, attrs, parser.CurrentByteIndex))
+        state[0] += 1
+    def end(tag):
+        state[0] -= 1
+        if 0 == state[0]:
+            state[1] = parser.CurrentByteIndex
+    parser.StartElementHandler = start
+    parser.EndElementHandler = end
+    with open(playlists, 'rb') as fh:
+        parser.ParseFile(fh)
+    return elements, state[1]
+
+def _serialize_playlist(name, locations, attrs=None):
+    """Serialize a static playlist named 'name' holding 'locations' (file
+    paths) as a <playlist> element, indented as Rhythmbox would; 'attrs' are
+    the attributes of the playlist being replaced, if any."""
+
+    if attrs is None:
+        attrs = (('name', name),) + NEW_PLAYLIST_ATTRS
+    attrs = dict(attrs)
+    attrs['name'] = name
+    attrs['type'] = 'static'
+    tag = '<playlist' + ''.join(' {0}={1}'.format(key, quoteattr(value))
+                                for key, value in attrs.items())
+    if not locations:
+        return tag + '/>'
+    lines = [tag + '>']
+    for location in locations:
+        lines.append('    <location>{0}</location>'.format(
+            escape(encode_track_location(location))))
+    lines.append('  </playlist>')
+    return '\n'.join(lines)
+
+def _copy_range(fh, start, end):
+    """Yield the bytes of 'fh' from offset 'start' to 'end', in chunks."""
+
+    fh.seek(start)
+    while start < end:
+        chunk = fh.read(min(_CHUNK_SIZE, end - start))
+        if not chunk:
+            return
+        start += len(chunk)
+        yield chunk
+
+def update_playlists_xml(playlists, updates, output=None, fsync=None):
+    """Write static playlists into a Rhythmbox-style 'playlists.xml'.
+
+    :param str playlists: Location of the 'playlists.xml' file to be updated
+    :param list updates: a list of two-tuples (title, [location,...]); each
+    replaces the contents of the static playlist of that title, or is added
+    (after the existing playlists) if there's no such playlist
+    :param str output: if given, write the result here rather than back to
+    'playlists'
+    :param bool fsync: If True, flush the result to stable storage before
+    renaming it into place
+    :return: a two-tuple (replaced, added) counting the playlists replaced &
+    added
+
+    The document is never parsed into a tree: it's scanned once to find the
+    byte offsets of its playlists (cf. scan_playlists_xml), & then copied,
+    byte-for-byte, to a temporary file, except that the playlists being
+    replaced are serialized afresh (keeping their attributes, such as their
+    position in the browser) & new ones are inserted just before the root's
+    end tag. The temporary file is then renamed into place.
+
+    Raise ValueError if a title names an automatic playlist (or the play
+    queue), or if the document can't take new playlists.
+    """
 
-        with open(outf, 'w', -1, outcp) as fd:
-            for x in map(lambda line: line + os.linesep, lines):
-                fd.write(x)
+    updates = collections.OrderedDict(updates)
+    elements, end = scan_playlists_xml(playlists)
+    for tag, attrs, offset in elements:
+        if 'playlist' == tag and attrs.get('name') in updates and \
+           'static' != attrs.get('type'):
+            raise ValueError('"{0}" in {1} is not a static playlist'.
+                             format(attrs['name'], playlists))
+    replacing = set(attrs.get('name') for tag, attrs, offset in elements
+                    if 'playlist' == tag and attrs.get('name') in updates)
+    adding = [name for name in updates if name not in replacing]
+    counts = [0, len(adding)]
+
+    def generate(fh):
+        first = elements[0][2] if elements else end
+        for chunk in _copy_range(fh, 0, first):
+            yield chunk
+        bounds = [offset for tag, attrs, offset in elements[1:]] + [end]
+        for (tag, attrs, offset), stop in zip(elements, bounds):
+            name = attrs.get('name')
+            if 'playlist' != tag or name not in updates:
+                for chunk in _copy_range(fh, offset, stop):
+                    yield chunk
+                continue
+            # Keep the whitespace (&c) that follows the element
+            fh.seek(max(offset, stop - 4096))
+            tail = fh.read(stop - fh.tell())
+            trailer = tail[len(tail.rstrip()):]
+            counts[0] += 1
+            yield _serialize_playlist(name, updates[name], attrs).encode(
+                'utf-8') + trailer
+        for name in adding:
+            yield '  {0}\n'.format(_serialize_playlist(
+                name, updates[name])).encode('utf-8')
+        for chunk in _copy_range(fh, end, os.fstat(fh.fileno()).st_size):
+            yield chunk
+
+    with open(playlists, 'rb') as fh:
+        if adding:
+            fh.seek(end)
+            if b'</' != fh.read(2):
+                raise ValueError('{0} has no room for new playlists'.
+                                 format(playlists))
+        atomic_write(output or playlists, generate(fh), fsync)
+
+    log.debug('{0}: {1} playlists replaced, {2} added.'.
+              format(output or playlists, counts[0], counts[1]))
+    return tuple(counts)
+
+def _put_playlists(args):
+    """Handler for the 'put-playlists-xml' command.
+
+    Each M3U playlist is titled after its file name (less extension); track
+    locations are first rewritten according to any prefixes given, & those
+    still relative are then taken relative to the playlist.
+    """
+
+    prefixes = rubepl.prefix.from_args(args)
+    updates = [ ]
+    for f in args.files:
+        title = os.path.splitext(os.path.basename(f))[0]
+        base = os.path.dirname(os.path.abspath(f))
+        locations = [ ]
+        for location in iter_track_locations(f, args.codepage):
+            if prefixes:
+                location = prefixes.rewrite(location)
+            if not os.path.isabs(location):
+                location = os.path.normpath(os.path.join(base, location))
+            locations.append(location)
+        updates.append((title, locations))
+    replaced, added = update_playlists_xml(args.playlists, updates,
+                                           args.output, args.fsync)
+    log.info('{0} playlists replaced, {1} added.'.format(replaced, added))
+
+def build_put_subparser(subparsers, name='put-playlists-xml'):
+    """Build a parser for a sub-command that will write M3U playlists into a
+    Rhythmbox-style 'playlists.xml' file.
+
+    :param subparsers: "special action object" returned from argparse.ArgumentParser.add_subparsers
+    """
+
+    pp = subparsers.add_parser(name=name, help='Write one or more M3U '
+                               + 'playlists into a Rhythmbox-style '
+                               + '"playlists.xml" as static playlists, '
+                               + 'replacing those of the same title; the rest'
+                               + ' of the file is left as it was.')
+    pp.add_argument('-c', '--codepage', help='specify the input codepage; if '
+                    + 'not specified, it will be deduced')
+    pp.add_argument('-o', '--output', help='Write the result to this file, '
+                    + 'rather than back to the playlists XML file')
+    rubepl.prefix.add_arguments(pp)
+    pp.add_argument('--fsync', help='Flush the output file to stable storage'
+                    + ' before renaming it into place', action='store_true')
+    pp.add_argument('playlists', help='location of the playlists XML file '
+                    + 'to be updated (typically ' + DEFAULT_PL + ')')
+    pp.add_argument('files', help='M3U playlists to be written; each is '
+                    + 'titled after its file name, less extension', nargs='+')
+    pp.set_defaults(func=_put_playlists)
 
 def _entry(args):
     """Handler for the 'get-playlists-xml' command.
@@ -190,9 +502,16 @@ def _entry(args):
 
     """
 
-    playlists_xml_to_m3u(args.playlists, args.dbpath, args.rename,
-                         Replacements(args.replace), args.utf8, args.only,
-                         args.exclude, args.output, args.use_bom)
+    profiles = rubepl.profile.from_args(args)
+    catalog = rubepl.catalog.from_args(args)
+    try:
+        playlists_xml_to_m3u(args.playlists, args.dbpath, only=args.only,
+                             exclude=args.exclude, catalog=catalog,
+                             profiles=profiles)
+    finally:
+        if catalog is not None:
+            catalog.close()
+    rubepl.profile.save(profiles)
 
 def build_subparser(subparsers, name='get-playlists-xml'):
     """Build a parser for a sub-command that will retrieve playlists from a
@@ -215,6 +534,10 @@ def build_subparser(subparsers, name='get-playlists-xml'):
                     + ' expression and REPLACEMENT is the text with which to'
                     + ' replace any matches (REPLACEMENT may include'
                     + ' sub-expressions)', action='append')
+    gp.add_argument('-L', '--locations-only', help='Only apply replacements'
+                    + ' to track locations (leaving #EXTM3U & #EXTINF lines'
+                    + ' untouched)', action='store_true')
+    rubepl.prefix.add_arguments(gp)
     gp.add_argument('-r', '--rename', help='Rename code: a sequence of'
                     + ' characters indicating transformations to be applied'
                     + ' to the playlist title: "l" will convert all characters'
@@ -224,6 +547,15 @@ def build_subparser(subparsers, name='get-playlists-xml'):
     gp.add_argument('-b', '--use-bom', help='Use the UTF-8 '
                     + 'byte order mark on output (in UTF8)',
                     action='store_true')
+    gp.add_argument('-I', '--incremental', help='Keep a manifest in the'
+                    + ' output directory & skip playlists whose inputs &'
+                    + ' options are unchanged since the last run (and outputs'
+                    + ' whose contents would be identical)',
+                    action='store_true')
+    rubepl.catalog.add_matcher_arguments(gp)
+    gp.add_argument('--fsync', help='Flush each output file to stable storage'
+                    + ' before renaming it into place', action='store_true')
+    rubepl.profile.add_arguments(gp)
     gp.add_argument('dbpath', help='location of the Rhythmbox DB file (typically '
                     + DEFAULT_DB + ')')
     gp.add_argument('playlists', help='location of the playlists XML file '
@@ -0,0 +1,132 @@
+"""shared.py -- Share loaded inputs between commands run in one process.
+
+Parsing rhythmdb.xml or an iTunes library, or walking a library tree, is the
+bulk of the work for most commands. Run one at a time, each command must do
+it afresh. Run many in one process (cf. batch.py), those reading the same
+inputs can share the results.
+
+Functions that load such inputs are decorated with 'shared'. While a
+SharedInputs is active, a call with the same arguments, on input files that
+haven't changed, returns the result of the first such call (callers must
+therefore treat these results as read-only). Concurrent calls with the same
+arguments wait on the first, rather than loading the inputs again. With no
+SharedInputs active, the decorator does nothing.
+"""
+
+__author__     = "Michael Herstine <sp1ff@pobox.com>"
+__copyright__  = "Copyright (C) 2015, 2016 Michael Herstine"
+__credits__    = ["Michael Herstine"]
+__license__    = "GPL"
+__version__    = "$Revision: $"
+__maintainer__ = "Michael Herstine <sp1ff@pobox.com>"
+__email__      = "sp1ff@pobox.com"
+__status__     = "Prototype"
+
+import concurrent.futures
+import functools
+import inspect
+import logging
+import os
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# The active SharedInputs, if any
+_active = None
+
+def _file_key(path):
+    """Identify the file 'path' by name, size & mtime (cf.
+    manifest.file_fingerprint), or by name alone if it can't be stat'd."""
+
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError, ValueError):
+        return path
+    return (os.path.abspath(path), st.st_size, st.st_mtime_ns)
+
+class SharedInputs(object):
+    """A cache of loaded inputs, active while in use as a context manager:
+
+        with SharedInputs() as inputs:
+            ...
+        print(inputs.loads, inputs.hits)
+
+    The attributes 'loads' & 'hits' count the calls that loaded inputs & those
+    that re-used them; 'seconds' is the time spent loading.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # {key=>Future}
+        self._results = {}
+        self.loads = 0
+        self.hits = 0
+        self.seconds = 0.0
+
+    def __enter__(self):
+        global _active
+        if _active is not None:
+            raise ValueError('shared inputs are already active')
+        _active = self
+        return self
+
+    def __exit__(self, *exc):
+        global _active
+        _active = None
+        self._results.clear()
+        return False
+
+    def call(self, fn, key, args, kwargs):
+        """Return fn(*args, **kwargs), re-using the result of an earlier call
+        made under 'key'."""
+
+        with self._lock:
+            future = self._results.get(key)
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                self._results[key] = future
+                self.loads += 1
+            else:
+                self.hits += 1
+
+        if owner:
+            start = time.perf_counter()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except BaseException as ex:
+                # Don't remember failures; the next caller will try again
+                with self._lock:
+                    del self._results[key]
+                future.set_exception(ex)
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                with self._lock:
+                    self.seconds += elapsed
+            log.debug('loaded {0}{1} in {2:.3f}s.'.format(
+                fn.__qualname__, key[2], elapsed))
+        return future.result()
+
+def shared(*files):
+    """Decorator for functions loading inputs that may be shared (cf.
+    SharedInputs); 'files' names the parameters that name input files, which
+    are fingerprinted so that a file changed between calls is loaded again."""
+
+    def decorate(fn):
+        signature = inspect.signature(fn)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            inputs = _active
+            if inputs is None:
+                return fn(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (fn.__module__, fn.__qualname__,
+                   repr(tuple(bound.arguments.items())),
+                   tuple(_file_key(bound.arguments[name]) for name in files))
+            return inputs.call(fn, key, bound.args, bound.kwargs)
+        return wrapper
+    return decorate
@@ -0,0 +1,348 @@
+"""sync.py -- Copy the tracks of one or more playlists somewhere else.
+
+'get-tracks | xargs scp' copies every track, every time, one process per
+file. The 'sync' command instead:
+
+    1. collects the distinct tracks named by the playlists (cf.
+       m3u.iter_playlist_tracks; relative locations are taken relative to
+       the playlist naming them, as put-playlists-xml does), & maps each
+       to a path under the destination by replacing the source root (by
+       default, the deepest directory containing them all) with the
+       destination directory
+    2. takes a snapshot of the destination, walking it once (cf.
+       fsindex.walk) & noting the size & mtime of everything there
+    3. copies only tracks that are missing from the destination, or whose
+       size or mtime differ from the source's, from a pool of threads. Each
+       copy is done in the kernel where possible (os.copy_file_range, else
+       os.sendfile), or replaced by a hard link if asked & source &
+       destination share a filesystem
+    4. writes each playlist to the destination, its locations rewritten to
+       point at the copies (cf. m3u.normalize_m3u_playlist)
+
+Each track is copied to a temporary file alongside its destination, given
+the source's mtime, & only then renamed into place; so an interrupted sync
+leaves behind only complete tracks (which the next run will find up-to-date)
+& temporary files (which it will remove).
+"""
+
+__author__     = "Michael Herstine <sp1ff@pobox.com>"
+__copyright__  = "Copyright (C) 2015, 2016 Michael Herstine"
+__credits__    = ["Michael Herstine"]
+__license__    = "GPL"
+__version__    = "$Revision: $"
+__maintainer__ = "Michael Herstine <sp1ff@pobox.com>"
+__email__      = "sp1ff@pobox.com"
+__status__     = "Prototype"
+
+import collections
+import concurrent.futures
+import errno
+import logging
+import os
+import time
+
+from rubepl.fsindex import DEFAULT_WORKERS, walk
+from rubepl.m3u import Replacements, iter_playlist_tracks, \
+    normalize_m3u_playlist
+from rubepl.prefix import PrefixRewriter
+from rubepl.relocate import MoveMap
+
+log = logging.getLogger(__name__)
+
+# Tracks are copied by this many threads, by default
+DEFAULT_JOBS = 4
+
+# Copies in progress are written to a file named after the destination, with
+# this suffix
+PARTIAL_SUFFIX = '.rubepl-partial'
+
+# A destination file whose mtime is within this many seconds of its source's
+# is up-to-date (FAT records mtimes to the nearest two seconds)
+MTIME_TOLERANCE = 2
+
+# Copy at most this many bytes per system call
+_CHUNK_SIZE = 1 << 24
+
+# The errors with which copy_file_range & sendfile refuse a pair of files
+# they can't handle (as opposed to failing part-way through a copy)
+_UNSUPPORTED = frozenset([errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                          errno.ENOTSUP, errno.EOPNOTSUPP, errno.EBADF])
+
+# One track to be copied: its location, its destination, & its size & mtime
+Transfer = collections.namedtuple('Transfer', ['src', 'dst', 'size',
+                                               'mtime_ns'])
+
+class SyncPlan(object):
+    """What a sync must do: the attribute 'transfers' lists the Transfers to
+    be made, 'current' counts tracks already up-to-date, & 'missing' &
+    'outside' list the locations that couldn't be found, & those not under
+    the source root ('root')."""
+
+    def __init__(self, root=None):
+        self.root = root
+        self.transfers = []
+        self.current = 0
+        self.missing = []
+        self.outside = []
+
+def _stat(path):
+    """Return os.stat(path), or None if there's no such file."""
+
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+def snapshot(dest, workers=DEFAULT_WORKERS):
+    """Walk 'dest'; return a dictionary mapping the path of each file there to
+    a two-tuple (size, mtime_ns). Temporary files left by an interrupted sync
+    are removed."""
+
+    files = []
+    for directory, found, subdirs in walk([dest], workers):
+        files.extend(found)
+    stale = [path for path in files if path.endswith(PARTIAL_SUFFIX)]
+    for path in stale:
+        try:
+            os.remove(path)
+        except OSError as ex:
+            log.warning('failed to remove {0}: {1}'.format(path, ex))
+    if stale:
+        log.debug('removed {0} partial copies from {1}.'.
+                  format(len(stale), dest))
+    files = [path for path in files if not path.endswith(PARTIAL_SUFFIX)]
+    with concurrent.futures.ThreadPoolExecutor(max(workers, 1)) as pool:
+        stats = pool.map(_stat, files)
+        return dict((path, (st.st_size, st.st_mtime_ns))
+                    for path, st in zip(files, stats) if st is not None)
+
+def plan_sync(tracks, root, dest, workers=DEFAULT_WORKERS):
+    """Work out what must be copied to bring 'dest' up-to-date with respect
+    to 'tracks'.
+
+    :param list tracks: the locations of the tracks to be copied
+    :param str root: the directory under which they lie; each track is copied
+    to the same relative path under 'dest' (if None, the deepest directory
+    containing all the tracks that exist)
+    :param str dest: the destination directory
+    :param int workers: the number of threads with which to stat files
+    :return: a SyncPlan
+    """
+
+    # The snapshot's keys must be comparable with the (absolute) targets
+    dest = os.path.abspath(dest)
+    tracks = list(tracks)
+    with concurrent.futures.ThreadPoolExecutor(max(workers, 1)) as pool:
+        stats = list(pool.map(_stat, tracks))
+    if root is None:
+        found = [os.path.dirname(os.path.abspath(track))
+                 for track, st in zip(tracks, stats) if st is not None]
+        root = os.path.commonpath(found) if found else os.getcwd()
+    plan = SyncPlan(os.path.abspath(root))
+    targets = PrefixRewriter()
+    targets.add(plan.root, dest)
+    there = snapshot(dest, workers) if os.path.isdir(dest) else {}
+    for track, st in zip(tracks, stats):
+        if st is None:
+            plan.missing.append(track)
+            continue
+        dst = targets.rewrite(os.path.abspath(track))
+        if dst == os.path.abspath(track):
+            plan.outside.append(track)
+            continue
+        have = there.get(dst)
+        if have and have[0] == st.st_size and \
+           abs(have[1] - st.st_mtime_ns) <= MTIME_TOLERANCE * 10**9:
+            plan.current += 1
+        else:
+            plan.transfers.append(Transfer(track, dst, st.st_size,
+                                           st.st_mtime_ns))
+    return plan
+
+def _copy_data(fsrc, fdst):
+    """Copy everything from the file object 'fsrc' to 'fdst' (both freshly
+    opened), in the kernel if we can."""
+
+    for name in ('copy_file_range', 'sendfile'):
+        call = getattr(os, name, None)
+        if call is None:
+            continue
+        copied = 0
+        try:
+            while True:
+                if 'sendfile' == name:
+                    n = call(fdst.fileno(), fsrc.fileno(), None, _CHUNK_SIZE)
+                else:
+                    n = call(fsrc.fileno(), fdst.fileno(), _CHUNK_SIZE)
+                if not n:
+                    return
+                copied += n
+        except OSError as ex:
+            if copied or ex.errno not in _UNSUPPORTED:
+                raise
+    while True:
+        buf = fsrc.read(_CHUNK_SIZE)
+        if not buf:
+            return
+        fdst.write(buf)
+
+def transfer(xfer, link=False):
+    """Make one Transfer; return 'linked' or 'copied'.
+
+    :param Transfer xfer: the track to be copied
+    :param bool link: if True, hard link the destination to the source if
+    they're on the same filesystem (copying otherwise)
+    """
+
+    directory, name = os.path.split(xfer.dst)
+    os.makedirs(directory, exist_ok=True)
+    partial = os.path.join(directory, '.' + name + PARTIAL_SUFFIX)
+    try:
+        if link:
+            try:
+                os.link(xfer.src, partial)
+                os.replace(partial, xfer.dst)
+                return 'linked'
+            except OSError as ex:
+                if ex.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+                    raise
+        with open(xfer.src, 'rb') as fsrc, open(partial, 'wb') as fdst:
+            _copy_data(fsrc, fdst)
+        os.utime(partial, ns=(time.time_ns(), xfer.mtime_ns))
+        os.replace(partial, xfer.dst)
+        return 'copied'
+    except BaseException:
+        try:
+            os.remove(partial)
+        except OSError:
+            pass
+        raise
+
+def run_plan(plan, jobs=DEFAULT_JOBS, link=False):
+    """Make every Transfer in 'plan' from a pool of 'jobs' threads; return a
+    Counter of the outcomes ('copied', 'linked' & 'failed') & of the bytes
+    copied ('bytes')."""
+
+    counts = collections.Counter()
+    with concurrent.futures.ThreadPoolExecutor(max(jobs, 1)) as pool:
+        futures = dict((pool.submit(transfer, xfer, link), xfer)
+                       for xfer in plan.transfers)
+        for future in concurrent.futures.as_completed(futures):
+            xfer = futures[future]
+            try:
+                outcome = future.result()
+            except OSError as ex:
+                log.warning('failed to copy {0} to {1}: {2}'.
+                            format(xfer.src, xfer.dst, ex))
+                counts['failed'] += 1
+                continue
+            counts[outcome] += 1
+            if 'copied' == outcome:
+                counts['bytes'] += xfer.size
+            log.debug('{0} {1}'.format(outcome, xfer.dst))
+    return counts
+
+def _sync(args):
+    """Handler for the 'sync' command.
+
+    :param Namespace args: Presumably the result of calling parse_args on the
+    rubepl ArgumentParser.
+    """
+
+    start = time.perf_counter()
+    # Relative locations are taken relative to their playlist; remember what
+    # each playlist's resolve to, so that they can be rewritten, too
+    tracks = {}
+    relative = {}
+    for f, found in zip(args.files, iter_playlist_tracks(
+            args.files, args.codepage, args.processes, keep_order=True)):
+        base = os.path.dirname(os.path.abspath(f))
+        resolved = relative[f] = {}
+        for track in found:
+            if not os.path.isabs(track):
+                resolved[track] = os.path.normpath(os.path.join(base, track))
+                track = resolved[track]
+            tracks[track] = None
+    tracks = list(tracks)
+    if not tracks:
+        log.info('no tracks to sync.')
+        return
+    plan = plan_sync(tracks, args.source_root, args.dest, args.jobs)
+    for track in plan.missing:
+        log.warning('{0} does not appear to exist.'.format(track))
+    for track in plan.outside:
+        log.warning('{0} is not under {1}; skipping.'.format(track, plan.root))
+    log.debug('planned in {0:.2f}s: {1} to copy, {2} up-to-date.'.format(
+        time.perf_counter() - start, len(plan.transfers), plan.current))
+    if args.dry_run:
+        for xfer in plan.transfers:
+            print('{0}\t{1}'.format(xfer.src, xfer.dst))
+        return
+
+    copying = time.perf_counter()
+    counts = run_plan(plan, args.jobs, args.link)
+    elapsed = time.perf_counter() - copying
+    rate = counts['bytes'] / elapsed / (1 << 20) if elapsed else 0.0
+    log.info('{0} copied ({1:.1f}MB at {2:.1f}MB/s), {3} linked, {4} '
+             'up-to-date, {5} missing, {6} failed, in {7:.2f}s.'.format(
+                 counts['copied'], counts['bytes'] / (1 << 20), rate,
+                 counts['linked'], plan.current, len(plan.missing),
+                 counts['failed'], time.perf_counter() - start))
+
+    locations = PrefixRewriter()
+    locations.add(plan.root,
+                  args.location_root or os.path.abspath(args.dest))
+    output = args.playlist_dir or args.dest
+    for f in args.files:
+        moves = MoveMap((track, locations.rewrite(path))
+                        for track, path in relative[f].items())
+        replacements = Replacements(None, prefixes=locations, moves=moves)
+        title = os.path.splitext(os.path.split(f)[-1])[0]
+        normalize_m3u_playlist(title, f, args.rename, replacements, args.utf8,
+                               args.use_bom, args.codepage, output)
+
+def build_subparser(subparsers, name='sync'):
+    """Build the sub-parser for the 'sync' command."""
+
+    sy = subparsers.add_parser(name=name, help='Copy the tracks of one or '
+                               + 'more M3U playlists to a destination '
+                               + 'directory (only those missing or changed), '
+                               + 'and write the playlists there, rewritten to '
+                               + 'name the copies.')
+    sy.add_argument('dest', help='Destination directory')
+    sy.add_argument('files', help='M3U playlists whose tracks are to be '
+                    + 'copied', nargs='+')
+    sy.add_argument('-s', '--source-root', help='Copy each track to its path'
+                    + ' relative to DIR, under the destination (default: the '
+                    + 'deepest directory containing every track)',
+                    metavar='DIR')
+    sy.add_argument('-L', '--location-root', help='Write track locations in '
+                    + 'the playlists relative to PATH, rather than to the '
+                    + 'destination (e.g. the mount point of the destination '
+                    + 'on another machine)', metavar='PATH')
+    sy.add_argument('-p', '--playlist-dir', help='Write the playlists to DIR'
+                    + ' (default: the destination)', metavar='DIR')
+    sy.add_argument('-l', '--link', help='Hard link tracks rather than copy '
+                    + 'them, where source & destination share a filesystem',
+                    action='store_true')
+    sy.add_argument('-n', '--dry-run', help='Just print the tracks that would'
+                    + ' be copied (source & destination, separated by a tab)',
+                    action='store_true')
+    sy.add_argument('-j', '--jobs', help='Number of threads with which to '
+                    + 'copy tracks (default %(default)s)', type=int,
+                    default=DEFAULT_JOBS)
+    sy.add_argument('-c', '--codepage', help='specify the input codepage; if '
+                    + 'not specified, it will be deduced')
+    sy.add_argument('--processes', help='Number of processes with which to '
+                    + 'read playlists (default: one per CPU; 1 reads them in '
+                    + 'turn)', type=int, metavar='N')
+    sy.add_argument('-r', '--rename', help='Rename code: a sequence of'
+                    + ' characters indicating transformations to be applied'
+                    + ' to the playlist title: "l" will convert all characters'
+                    + ' to lowercase, "-" will replace whitespace with a dash')
+    sy.add_argument('-u', '--utf8', help='Use UTF-8 encoding '
+                    + 'on output', action='store_true')
+    sy.add_argument('-b', '--use-bom', help='Use the UTF-8 '
+                    + 'byte order mark on output (in UTF8)',
+                    action='store_true')
+    sy.set_defaults(func=_sync)
@@ -0,0 +1,341 @@
+"""tags.py -- Read artist & title from audio files' own tags, quickly.
+
+Matching a playlist entry to a track in some other library (cf.
+itunes.match_itunes_track) goes best by the artist & title the file itself
+carries, rather than those guessed from its name. This module reads them,
+touching as little of each file as it can:
+
+    - ID3v2 (versions 2.2, 2.3 & 2.4) at the start of the file: frame
+      headers are read one at a time, & only the frames of interest are read
+      in full, so that (for instance) embedded cover art is skipped over
+    - FLAC metadata blocks, likewise: only the VORBIS_COMMENT block is read
+    - ID3v1, from the file's last 128 bytes, but only for values still
+      missing after the above
+
+A typical file costs an open & two or three small reads. Files are read from
+a pool of threads, so that the waits overlap, & the results kept in a
+TagCache (an SQLite database, keyed by path, size & mtime), so that a file
+is only read again once it's changed.
+
+Ogg & MP4 files keep their tags elsewhere, & are reported as untagged.
+"""
+
+__author__     = "Michael Herstine <sp1ff@pobox.com>"
+__copyright__  = "Copyright (C) 2015, 2016 Michael Herstine"
+__credits__    = ["Michael Herstine"]
+__license__    = "GPL"
+__version__    = "$Revision: $"
+__maintainer__ = "Michael Herstine <sp1ff@pobox.com>"
+__email__      = "sp1ff@pobox.com"
+__status__     = "Prototype"
+
+import collections
+import concurrent.futures
+import io
+import logging
+import os
+import sqlite3
+import time
+
+from rubepl.fsindex import DEFAULT_WORKERS
+
+log = logging.getLogger(__name__)
+
+DEFAULT_CACHE = os.path.expanduser('~/.local/share/rubepl/tags.db')
+
+# Bump this whenever the schema (or what's read from files) changes; a cache
+# of any other version is discarded
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE tags (path BLOB PRIMARY KEY,
+                   size INTEGER NOT NULL,
+                   mtime_ns INTEGER NOT NULL,
+                   artist TEXT,
+                   title TEXT) WITHOUT ROWID;
+"""
+
+# The tags of one file; either field may be None
+Tags = collections.namedtuple('Tags', ['artist', 'title'])
+
+# ID3v2 frames of interest (v2.2 ids are three characters long)
+_ID3V2_FRAMES = {'TPE1': 'artist', 'TP1': 'artist',
+                 'TIT2': 'title', 'TT2': 'title'}
+
+# ID3v2 text encodings
+_ID3V2_ENCODINGS = {0: 'latin-1', 1: 'utf-16', 2: 'utf-16-be', 3: 'utf-8'}
+
+# Vorbis comment fields of interest
+_VORBIS_FIELDS = {'ARTIST': 'artist', 'TITLE': 'title'}
+
+def _syncsafe(data):
+    """Decode an ID3v2 'syncsafe' integer (seven bits per byte)."""
+
+    n = 0
+    for byte in data:
+        n = (n << 7) | (byte & 0x7f)
+    return n
+
+def _id3v2_text(body):
+    """Decode the body of an ID3v2 text frame; return its first value."""
+
+    if not body:
+        return None
+    encoding = _ID3V2_ENCODINGS.get(body[0], 'latin-1')
+    data = body[1:]
+    if encoding.startswith('utf-16'):
+        data = data[:len(data) & ~1]
+    text = data.decode(encoding, 'replace').split('\0')[0].strip()
+    return text or None
+
+def _read_id3v2(fh, found):
+    """Read the ID3v2 tag (if any) at the current position of 'fh' into the
+    dictionary 'found'; return True if there was one (leaving 'fh'
+    positioned just past it)."""
+
+    start = fh.tell()
+    header = fh.read(10)
+    if len(header) < 10 or b'ID3' != header[:3]:
+        fh.seek(start)
+        return False
+    major, flags, size = header[3], header[5], _syncsafe(header[6:10])
+    end = start + 10 + size + (10 if flags & 0x10 else 0)
+    if major not in (2, 3, 4):
+        fh.seek(end)
+        return True
+
+    src, limit = fh, size
+    if flags & 0x80 and major < 4:
+        # Unsynchronisation applies to the whole tag: undo it up front
+        src = io.BytesIO(fh.read(size).replace(b'\xff\x00', b'\xff'))
+        limit = len(src.getbuffer())
+    pos = 0
+    if flags & 0x40 and major > 2:
+        ext = src.read(4)
+        skip = _syncsafe(ext) - 4 if 4 == major else int.from_bytes(ext, 'big')
+        src.seek(skip, io.SEEK_CUR)
+        pos = 4 + skip
+
+    idlen, hdrlen = (3, 6) if 2 == major else (4, 10)
+    wanted = set(_ID3V2_FRAMES.values()) - set(found)
+    while wanted and pos + hdrlen <= limit:
+        header = src.read(hdrlen)
+        if len(header) < hdrlen or not header[0]:
+            # Padding
+            break
+        fid = header[:idlen].decode('latin-1')
+        if 2 == major:
+            fsize, fflags = int.from_bytes(header[3:6], 'big'), 0
+        elif 3 == major:
+            fsize, fflags = int.from_bytes(header[4:8], 'big'), header[9]
+        else:
+            fsize, fflags = _syncsafe(header[4:8]), header[9]
+        pos += hdrlen + fsize
+        key = _ID3V2_FRAMES.get(fid)
+        # Compressed or encrypted frames aren't worth the trouble
+        opaque = fflags & (0xc0 if 3 == major else 0x0c)
+        if key not in wanted or opaque:
+            src.seek(fsize, io.SEEK_CUR)
+            continue
+        body = src.read(fsize)
+        if 3 == major and fflags & 0x20:
+            body = body[1:]
+        elif 4 == major:
+            if fflags & 0x40:
+                body = body[1:]
+            if fflags & 0x02:
+                body = body.replace(b'\xff\x00', b'\xff')
+            if fflags & 0x01:
+                body = body[4:]
+        value = _id3v2_text(body)
+        if value:
+            found[key] = value
+            wanted.discard(key)
+    fh.seek(end)
+    return True
+
+def _vorbis_comment(data, found):
+    """Parse a Vorbis comment block into the dictionary 'found'."""
+
+    pos = 4 + int.from_bytes(data[0:4], 'little')
+    count = int.from_bytes(data[pos:pos+4], 'little')
+    pos += 4
+    for i in range(count):
+        length = int.from_bytes(data[pos:pos+4], 'little')
+        field, sep, value = data[pos+4:pos+4+length].decode(
+            'utf-8', 'replace').partition('=')
+        pos += 4 + length
+        key = _VORBIS_FIELDS.get(field.upper())
+        if key and key not in found and value.strip():
+            found[key] = value.strip()
+
+def _read_flac(fh, found):
+    """Read the Vorbis comments (if any) in the FLAC metadata at the current
+    position of 'fh' into the dictionary 'found'."""
+
+    if b'fLaC' != fh.read(4):
+        return
+    while True:
+        header = fh.read(4)
+        if len(header) < 4:
+            return
+        length = int.from_bytes(header[1:4], 'big')
+        if 4 == header[0] & 0x7f:
+            _vorbis_comment(fh.read(length), found)
+            return
+        if header[0] & 0x80:
+            return
+        fh.seek(length, io.SEEK_CUR)
+
+def _read_id3v1(fh, size, found):
+    """Read the ID3v1 tag (if any) at the end of 'fh' (whose size is 'size')
+    into the dictionary 'found'."""
+
+    if size < 128:
+        return
+    fh.seek(size - 128)
+    data = fh.read(128)
+    if b'TAG' != data[:3]:
+        return
+    for key, field in (('title', data[3:33]), ('artist', data[33:63])):
+        value = field.split(b'\0')[0].decode('latin-1').strip()
+        if value and key not in found:
+            found[key] = value
+
+def read_tags(path):
+    """Return the Tags of the file at 'path' (whose fields are None where the
+    file doesn't say); raise OSError if it can't be read."""
+
+    found = {}
+    with open(path, 'rb') as fh:
+        size = os.fstat(fh.fileno()).st_size
+        _read_id3v2(fh, found)
+        if len(found) < len(Tags._fields):
+            _read_flac(fh, found)
+        if len(found) < len(Tags._fields):
+            _read_id3v1(fh, size, found)
+    return Tags(found.get('artist'), found.get('title'))
+
+def _read(path, known):
+    """Return a three-tuple (size, mtime_ns, tags) for 'path', re-using
+    'known' (such a tuple, or None) if the file's unchanged (run in a worker
+    thread by TagCache.read). Return None if 'path' can't be read."""
+
+    try:
+        st = os.stat(path)
+        if known and (st.st_size, st.st_mtime_ns) == known[:2]:
+            return known
+        return st.st_size, st.st_mtime_ns, read_tags(path)
+    except (OSError, ValueError) as ex:
+        log.debug('failed to read tags from {0}: {1}'.format(path, ex))
+        return None
+
+class TagCache(object):
+    """A persistent cache of audio files' tags.
+
+    Use as a context manager:
+
+        with TagCache(path) as cache:
+            for location, tags in cache.read(locations):
+                ...
+
+    After read, the attributes 'examined' & 'cached' count the files whose
+    tags were read & those found unchanged in the cache.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE, workers=DEFAULT_WORKERS):
+        """Open (or create) the cache at 'path'; files will be read by
+        'workers' threads."""
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.workers = workers
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA synchronous = NORMAL')
+        version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            with self._conn:
+                self._conn.execute('DROP TABLE IF EXISTS tags')
+                self._conn.executescript(_SCHEMA)
+                self._conn.execute('PRAGMA user_version = {0}'.
+                                   format(SCHEMA_VERSION))
+        self.examined = 0
+        self.cached = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        self._conn.close()
+
+    def _known(self, paths):
+        """Return a dictionary mapping each of 'paths' in the cache to a
+        three-tuple (size, mtime_ns, tags)."""
+
+        known = {}
+        conn = self._conn
+        for i in range(0, len(paths), 500):
+            batch = [path.encode('utf-8', 'surrogateescape')
+                     for path in paths[i:i+500]]
+            for path, size, mtime_ns, artist, title in conn.execute(
+                    'SELECT * FROM tags WHERE path IN ({0})'.format(
+                        ', '.join('?' * len(batch))), batch):
+                known[bytes(path).decode('utf-8', 'surrogateescape')] = \
+                    (size, mtime_ns, Tags(artist, title))
+        return known
+
+    def read(self, paths):
+        """Return a list of two-tuples (path, tags), one for each of 'paths',
+        in order, where 'tags' is None if the file can't be read."""
+
+        start = time.perf_counter()
+        paths = list(paths)
+        distinct = list(dict.fromkeys(paths))
+        known = self._known(distinct)
+        with concurrent.futures.ThreadPoolExecutor(
+                max(self.workers, 1)) as pool:
+            results = dict(zip(distinct, pool.map(
+                lambda path: _read(path, known.get(path)), distinct)))
+
+        fresh = [(path, result) for path, result in results.items()
+                 if result is not None and result is not known.get(path)]
+        self.examined += len(fresh)
+        self.cached += sum(1 for path, result in results.items()
+                           if result is not None and result is known.get(path))
+        with self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO tags VALUES (?, ?, ?, ?, ?)',
+                ((path.encode('utf-8', 'surrogateescape'), size, mtime_ns,
+                  tags.artist, tags.title)
+                 for path, (size, mtime_ns, tags) in fresh))
+        log.debug('tags of {0} files: {1} read, {2} cached, in {3:.2f}s.'.
+                  format(len(distinct), self.examined, self.cached,
+                         time.perf_counter() - start))
+        return [(path, results[path][2] if results[path] else None)
+                for path in paths]
+
+def add_arguments(parser):
+    """Add the options controlling tag reading to an argparse parser."""
+
+    parser.add_argument('-T', '--tags', help='Read artist & title from each '
+                        + "track's own tags (ID3 or FLAC), where the file can "
+                        + 'be found', action='store_true')
+    parser.add_argument('--tag-cache', help='Cache tags read in FILE, so that '
+                        + 'files are only read again once changed (default '
+                        + '{0})'.format(DEFAULT_CACHE), default=DEFAULT_CACHE,
+                        metavar='FILE')
+
+def from_args(args):
+    """Build a TagCache from parsed arguments (cf. add_arguments); return None
+    if tags weren't asked for."""
+
+    if not args.tags:
+        return None
+    return TagCache(args.tag_cache)
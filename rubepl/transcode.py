@@ -0,0 +1,157 @@
+"""transcode.py -- Byte-level normalization of M3U playlists.
+
+When normalize-m3u has no replacements to make, its job is purely
+mechanical: strip any input BOM, strip trailing whitespace from each line,
+re-encode & optionally add an output BOM. For the common case of an ASCII or
+UTF-8 playlist being normalized to UTF-8, none of that requires decoding to
+Python strings at all. This module does the work on memoryview slices of
+large input blocks: blocks that are already in normal form are passed through
+untouched, other blocks are re-assembled from slices of the input, and only
+blocks whose input & output encodings genuinely differ are decoded &
+re-encoded (once per block, rather than once per line).
+"""
+
+__author__     = "Michael Herstine <sp1ff@pobox.com>"
+__copyright__  = "Copyright (C) 2015, 2016 Michael Herstine"
+__credits__    = ["Michael Herstine"]
+__license__    = "GPL"
+__version__    = "$Revision: $"
+__maintainer__ = "Michael Herstine <sp1ff@pobox.com>"
+__email__      = "sp1ff@pobox.com"
+__status__     = "Prototype"
+
+import codecs
+import os
+import re
+
+from rubepl.decode import decode_bytes
+from rubepl.encode import encode_line
+
+# Encodings in which every ASCII character is represented by its ASCII byte,
+# & every byte < 0x80 represents an ASCII character (as canonicalized by
+# codecs.lookup). In such encodings, we can find line breaks & trailing
+# whitespace without decoding.
+ASCII_COMPATIBLE = frozenset(['utf-8', 'cp1252', 'iso8859-1', 'ascii'])
+
+# Read input in blocks of this many bytes (plus the remainder of the last line)
+DEFAULT_BLOCK_SIZE = 1 << 20
+
+# Universal newlines, as understood by open() in text mode
+_NEWLINE_REGEX = re.compile('\r\n|\r|\n')
+
+# Trailing whitespace, as understood by encode.encode_line
+_WHITESPACE = frozenset(b' \t\r\n')
+
+def is_ascii_compatible(encoding):
+    """Return True if 'encoding' is one that this module can process at the
+    byte level."""
+
+    return codecs.lookup(encoding).name in ASCII_COMPATIBLE
+
+def _normalize_block(data, start, end, incp, errs, outcp, same, linesep):
+    """Normalize the lines in data[start:end], returning a bytes-like object.
+
+    'data[start:end]' is assumed to consist of whole lines (the last of which
+    may be unterminated only at the end of the input).
+    """
+
+    view = memoryview(data)
+
+    # Can we do this without decoding?
+    fast = ((same or data.isascii()) and
+            data.count(b'\r', start, end) == data.count(b'\r\n', start, end))
+    if fast and not data.isascii():
+        try:
+            str(view[start:end], incp)
+        except UnicodeDecodeError:
+            fast = False
+
+    if fast:
+        terminated = b'\n' == data[end-1:end]
+        if (b'\n' == linesep and -1 == data.find(b'\r', start, end) and
+            -1 == data.find(b' \n', start, end) and
+            -1 == data.find(b'\t\n', start, end) and
+            (terminated or data[end-1] not in _WHITESPACE)):
+            # Already in normal form
+            if terminated:
+                return view[start:end]
+            return bytes(view[start:end]) + linesep
+        pieces = []
+        pos = start
+        while pos < end:
+            nl = data.find(b'\n', pos, end)
+            if -1 == nl:
+                nl = end
+            stop = nl
+            while stop > pos and data[stop-1] in _WHITESPACE:
+                stop -= 1
+            pieces.append(view[pos:stop])
+            pos = nl + 1
+        return linesep.join(pieces) + linesep
+
+    # Decode the block once, split it exactly as text-mode I/O would, and
+    # re-encode it once.
+    text = decode_bytes(view[start:end], incp, errs)
+    lines = _NEWLINE_REGEX.split(text)
+    if text.endswith('\n') or text.endswith('\r'):
+        lines.pop()
+    sep = linesep.decode('ascii')
+    return (sep.join(map(encode_line, lines)) + sep).encode(outcp)
+
+def iter_normalized(fh, incp, errs, outcp, use_bom=False, linesep=os.linesep,
+                    block_size=DEFAULT_BLOCK_SIZE):
+    """Normalize an M3U playlist at the byte level, yielding the output in
+    blocks.
+
+    :param fh: a file object opened in binary mode
+    :param str incp: the input encoding (must be ASCII-compatible)
+    :param str errs: the error handler to be used when decoding the input
+    :param str outcp: the output encoding (must be ASCII-compatible)
+    :param bool use_bom: if True, the output shall begin with a UTF-8 BOM
+    :param str linesep: the line separator to be used on output
+    :param int block_size: the size of each read from 'fh'
+
+    The output is exactly what decoding 'fh' with 'incp' & 'errs', removing
+    any BOM, stripping trailing whitespace from each line with
+    encode.encode_line, and encoding the result as 'outcp', one line per
+    'linesep', would produce.
+    """
+
+    incp_name = codecs.lookup(incp).name
+    same = incp_name == codecs.lookup(outcp).name
+    linesep = linesep.encode('ascii')
+
+    first = True
+    carry = b''
+    while True:
+        chunk = fh.read(block_size)
+        data = carry + chunk if carry else chunk
+        if not data:
+            break
+        if chunk:
+            end = data.rfind(b'\n') + 1
+            if 0 == end:
+                carry = data
+                continue
+        else:
+            end = len(data)
+        carry = data[end:]
+
+        start = 0
+        if first:
+            first = False
+            if 'utf-8' == incp_name and data.startswith(codecs.BOM_UTF8):
+                start = len(codecs.BOM_UTF8)
+            if use_bom and not ('utf-8' == incp_name and
+                                data.startswith(codecs.BOM_UTF8, start)):
+                yield codecs.BOM_UTF8
+            if start == end:
+                # Nothing but a BOM: that's a single, empty line
+                yield linesep
+                continue
+
+        if start < end:
+            yield _normalize_block(data, start, end, incp, errs, outcp, same,
+                                   linesep)
+        if not chunk:
+            break
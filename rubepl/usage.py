@@ -0,0 +1,344 @@
+"""usage.py -- Which playlists use which tracks?
+
+Before deleting or moving a file, we'd like to know which playlists name it;
+answering that by re-reading every playlist is slow when there are thousands
+of them, and the question is usually asked of many files at once. A
+UsageIndex is a persistent inverted index from track location to the
+playlists (and positions therein) that name it, kept in an SQLite database:
+
+    - sources: the files from which playlists were read (an M3U playlist, or
+      a Rhythmbox 'playlists.xml'), with their size & mtime when read
+    - playlists: each playlist, by title, & the source it came from
+    - tracks: each distinct track location, once
+    - entries: (track, playlist, position) triples, keyed by track
+
+The index is updated incrementally: sources whose size & mtime are unchanged
+since they were last read are skipped, as in manifest.file_fingerprint.
+Queries are answered with a single join against the (indexed) track
+locations, no matter how many locations are asked about.
+
+Locations are stored exactly as they appear in their playlists (as UTF-8,
+with any undecodable bytes restored), & matched exactly.
+"""
+
+__author__     = "Michael Herstine <sp1ff@pobox.com>"
+__copyright__  = "Copyright (C) 2015, 2016 Michael Herstine"
+__credits__    = ["Michael Herstine"]
+__license__    = "GPL"
+__version__    = "$Revision: $"
+__maintainer__ = "Michael Herstine <sp1ff@pobox.com>"
+__email__      = "sp1ff@pobox.com"
+__status__     = "Prototype"
+
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+from rubepl.m3u import iter_track_locations
+from rubepl.rhythmbox import get_playlists
+from rubepl.winamp import read_library
+
+log = logging.getLogger(__name__)
+
+DEFAULT_INDEX = os.path.expanduser('~/.local/share/rubepl/usage.db')
+
+# Bump this whenever the schema changes; an index of any other version is
+# re-built from scratch
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE sources (id INTEGER PRIMARY KEY,
+                      path BLOB UNIQUE NOT NULL,
+                      kind TEXT NOT NULL,
+                      size INTEGER NOT NULL,
+                      mtime_ns INTEGER NOT NULL);
+CREATE TABLE playlists (id INTEGER PRIMARY KEY,
+                        source INTEGER NOT NULL
+                            REFERENCES sources(id) ON DELETE CASCADE,
+                        title TEXT NOT NULL);
+CREATE INDEX playlists_by_source ON playlists(source);
+CREATE TABLE tracks (id INTEGER PRIMARY KEY,
+                     location BLOB UNIQUE NOT NULL);
+CREATE TABLE entries (track INTEGER NOT NULL,
+                      playlist INTEGER NOT NULL
+                          REFERENCES playlists(id) ON DELETE CASCADE,
+                      position INTEGER NOT NULL,
+                      PRIMARY KEY (track, playlist, position)) WITHOUT ROWID;
+CREATE INDEX entries_by_playlist ON entries(playlist);
+"""
+
+def _blob(text):
+    """Encode 'text' (a location or path) for storage."""
+
+    return text.encode('utf-8', 'surrogateescape')
+
+def _text(blob):
+    """Decode a location or path read back from the index."""
+
+    return bytes(blob).decode('utf-8', 'surrogateescape')
+
+class UsageIndex(object):
+    """A persistent index from track location to the playlists containing it.
+
+    Use as a context manager:
+
+        with UsageIndex(path) as index:
+            index.update(m3us=files)
+            for location, uses in index.where_used(paths):
+                ...
+
+    """
+
+    def __init__(self, path=DEFAULT_INDEX, rebuild=False):
+        """Open (or create) the index at 'path'; if 'rebuild' is True, or the
+        index was written by an incompatible version of this module, discard
+        its contents."""
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute('PRAGMA foreign_keys = ON')
+        self._conn.execute('PRAGMA journal_mode = WAL')
+        self._conn.execute('PRAGMA synchronous = NORMAL')
+        version = self._conn.execute('PRAGMA user_version').fetchone()[0]
+        if rebuild or version != SCHEMA_VERSION:
+            with self._conn:
+                for table in ('entries', 'tracks', 'playlists', 'sources'):
+                    self._conn.execute('DROP TABLE IF EXISTS {0}'.format(table))
+                self._conn.executescript(_SCHEMA)
+                self._conn.execute('PRAGMA user_version = {0}'.
+                                   format(SCHEMA_VERSION))
+        self._conn.execute('CREATE TEMP TABLE IF NOT EXISTS staging '
+                           '(location BLOB NOT NULL, position INTEGER NOT NULL)')
+        self.read = 0
+        self.skipped = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        self._conn.close()
+
+    def __len__(self):
+        """Return the number of playlists in the index."""
+
+        return self._conn.execute('SELECT COUNT(*) FROM playlists').fetchone()[0]
+
+    def _update_source(self, path, kind, read):
+        """Bring the index up-to-date with respect to one source.
+
+        :param str path: the source file
+        :param str kind: the sort of source ('m3u', 'winamp' or 'rhythmbox')
+        :param read: a callable returning an iterable of two-tuples (title,
+        locations), one per playlist in 'path'; only called if 'path' has
+        changed since it was last read
+        """
+
+        st = os.stat(path)
+        key = _blob(os.path.abspath(path))
+        conn = self._conn
+        row = conn.execute('SELECT id, size, mtime_ns FROM sources '
+                           'WHERE path = ?', (key,)).fetchone()
+        if row and (st.st_size, st.st_mtime_ns) == row[1:]:
+            self.skipped += 1
+            return
+
+        try:
+            playlists = [(title, list(locations)) for title, locations in read()]
+        except Exception as ex:
+            log.warning('failed to read {0}: {1}'.format(path, ex))
+            return
+
+        with conn:
+            if row:
+                conn.execute('DELETE FROM sources WHERE id = ?', (row[0],))
+            source = conn.execute('INSERT INTO sources (path, kind, size, '
+                                  'mtime_ns) VALUES (?, ?, ?, ?)',
+                                  (key, kind, st.st_size,
+                                   st.st_mtime_ns)).lastrowid
+            for title, locations in playlists:
+                playlist = conn.execute('INSERT INTO playlists (source, title) '
+                                        'VALUES (?, ?)',
+                                        (source, title)).lastrowid
+                conn.executemany('INSERT INTO staging VALUES (?, ?)',
+                                 ((_blob(location), position)
+                                  for position, location in
+                                  enumerate(locations, 1)))
+                conn.execute('INSERT OR IGNORE INTO tracks (location) '
+                             'SELECT location FROM staging')
+                conn.execute('INSERT OR IGNORE INTO entries '
+                             'SELECT tracks.id, ?, staging.position '
+                             'FROM staging JOIN tracks USING (location)',
+                             (playlist,))
+                conn.execute('DELETE FROM staging')
+        self.read += 1
+        log.debug('indexed {0} ({1} playlists).'.format(path, len(playlists)))
+
+    def update(self, m3us=(), winamp=(), rhythmbox=(), codepage=None):
+        """Bring the index up-to-date with respect to a collection of
+        playlists.
+
+        :param list m3us: M3U playlists (each is titled after its file name)
+        :param list winamp: Winamp Music Library 'playlists.xml' files (each of
+        whose playlists is indexed as a separate source, under its title)
+        :param list rhythmbox: Rhythmbox 'playlists.xml' files (of which only
+        static playlists are indexed)
+        :param str codepage: the encoding of all M3U playlists (None means
+        guess)
+
+        Sources named previously but not here are left in the index, unless
+        they no longer exist.
+        """
+
+        start = time.perf_counter()
+
+        def m3u(path, title):
+            return lambda: [(title, iter_track_locations(path, codepage))]
+
+        for path in m3us:
+            title = os.path.splitext(os.path.basename(path))[0]
+            self._update_source(path, 'm3u', m3u(path, title))
+
+        for xml in winamp:
+            for title, path in read_library(xml):
+                if os.path.isfile(path):
+                    self._update_source(path, 'winamp', m3u(path, title))
+
+        for xml in rhythmbox:
+            self._update_source(xml, 'rhythmbox',
+                                lambda: get_playlists(xml))
+
+        self.prune()
+        log.info('{0} sources read, {1} up-to-date, in {2:.2f}s.'.format(
+            self.read, self.skipped, time.perf_counter() - start))
+
+    def prune(self):
+        """Remove sources that no longer exist, & tracks no longer used."""
+
+        conn = self._conn
+        gone = [(row[0],) for row in conn.execute('SELECT id, path FROM sources')
+                if not os.path.exists(_text(row[1]))]
+        with conn:
+            conn.executemany('DELETE FROM sources WHERE id = ?', gone)
+            conn.execute('DELETE FROM tracks WHERE id NOT IN '
+                         '(SELECT track FROM entries)')
+        if gone:
+            log.debug('pruned {0} sources.'.format(len(gone)))
+
+    def where_used(self, locations):
+        """Yield a two-tuple (location, uses) for each of 'locations', where
+        'uses' is a (possibly empty) list of three-tuples (title, position,
+        source): the title of each playlist naming 'location', the (one-based)
+        position at which it appears there, & the file from which that
+        playlist was read."""
+
+        locations = list(locations)
+        conn = self._conn
+        uses = {}
+        with conn:
+            conn.executemany('INSERT INTO staging VALUES (?, ?)',
+                             ((_blob(location), i) for i, location in
+                              enumerate(dict.fromkeys(locations))))
+            # CROSS JOIN fixes the join order: the query planner knows nothing
+            # of the staging table, & would otherwise scan every entry
+            for location, title, position, source in conn.execute(
+                    'SELECT staging.location, playlists.title, '
+                    'entries.position, sources.path '
+                    'FROM staging CROSS JOIN tracks USING (location) '
+                    'CROSS JOIN entries ON entries.track = tracks.id '
+                    'CROSS JOIN playlists ON playlists.id = entries.playlist '
+                    'CROSS JOIN sources ON sources.id = playlists.source '
+                    'ORDER BY playlists.title, entries.position'):
+                uses.setdefault(_text(location), []).append(
+                    (title, position, _text(source)))
+            conn.execute('DELETE FROM staging')
+        for location in locations:
+            yield location, uses.get(location, [])
+
+def add_arguments(parser):
+    """Add the options common to the usage index commands to an argparse
+    parser."""
+
+    parser.add_argument('-D', '--database', help='Location of the usage index '
+                        + '(default {0})'.format(DEFAULT_INDEX),
+                        default=DEFAULT_INDEX, metavar='FILE')
+
+def _index(args):
+    """Handler for the 'index' command."""
+
+    with UsageIndex(args.database, args.rebuild) as index:
+        index.update(args.files, args.winamp or (), args.rhythmbox or (),
+                     args.codepage)
+
+def _where_used(args):
+    """Handler for the 'where-used' command.
+
+    For each location given, print one line per use: the location, the
+    (one-based) position at which it appears, the playlist title & the
+    playlist's source file, separated by tabs. With --unused, just print the
+    locations that no playlist uses.
+    """
+
+    locations = list(args.locations)
+    if args.from_file:
+        fh = sys.stdin if '-' == args.from_file else \
+            open(args.from_file, 'r', encoding='utf-8', errors='surrogateescape')
+        with fh:
+            locations.extend(line.rstrip('\r\n') for line in fh
+                             if line.strip())
+
+    with UsageIndex(args.database) as index:
+        for location, uses in index.where_used(locations):
+            if args.unused:
+                if not uses:
+                    print(location)
+                continue
+            for title, position, source in uses:
+                print('{0}\t{1}\t{2}\t{3}'.format(location, position, title,
+                                                  source))
+
+def build_index_subparser(subparsers, name='index'):
+    """Build the sub-parser for the 'index' command."""
+
+    ix = subparsers.add_parser(name=name, help='Index the tracks used by '
+                               + 'M3U, Winamp & Rhythmbox playlists (for '
+                               + 'where-used); playlists unchanged since they '
+                               + 'were last indexed are skipped.')
+    ix.add_argument('files', help='M3U playlists to be indexed', nargs='*')
+    ix.add_argument('-w', '--winamp', help='Index the playlists in this '
+                    + 'Winamp Music Library playlists.xml (may be given more '
+                    + 'than once)', action='append', metavar='XML')
+    ix.add_argument('-y', '--rhythmbox', help='Index the static playlists in '
+                    + 'this Rhythmbox playlists.xml (may be given more than '
+                    + 'once)', action='append', metavar='XML')
+    ix.add_argument('-c', '--codepage', help='specify the codepage of the M3U '
+                    + 'playlists; if not specified, it will be deduced')
+    ix.add_argument('--rebuild', help='Discard the existing index & start '
+                    + 'over', action='store_true')
+    add_arguments(ix)
+    ix.set_defaults(func=_index)
+
+def build_where_used_subparser(subparsers, name='where-used'):
+    """Build the sub-parser for the 'where-used' command."""
+
+    wu = subparsers.add_parser(name=name, help='Print the playlists that use '
+                               + 'one or more tracks, according to the index '
+                               + 'built by the "index" command (locations '
+                               + 'must match exactly as written in the '
+                               + 'playlists).')
+    wu.add_argument('locations', help='Track locations of interest',
+                    nargs='*')
+    wu.add_argument('-f', '--from-file', help='Read track locations from FILE, '
+                    + 'one per line ("-" for stdin)', metavar='FILE')
+    wu.add_argument('-u', '--unused', help='Just print the locations that no '
+                    + 'playlist uses', action='store_true')
+    add_arguments(wu)
+    wu.set_defaults(func=_where_used)
@@ -17,16 +17,54 @@ import os
 
 import rubepl.decode
 import rubepl.encode
+import rubepl.prefix
+import rubepl.profile
 
 import xml.etree.ElementTree as ET
 
-from rubepl.m3u import normalize_m3u_playlist
+from rubepl.m3u import render_m3u_playlist
+from rubepl.shared import shared
 
 
+@shared('playlists')
+def read_library(playlists):
+    """Read a Winamp Music Library; return a list of two-tuples (title, path),
+    one for each playlist, where 'path' names the M3U file holding its
+    tracks.
+
+    :param string playlists: Location of the 'playlists.xml' file Winamp uses
+    to record all ML playlists
+    """
+
+    dirname = os.path.dirname(playlists)
+    return [(child.attrib['title'],
+             os.path.join(dirname, child.attrib['filename']))
+            for child in ET.parse(playlists).getroot()]
+
+def iter_playlists(playlists, only=None, exclude=None):
+    """Yield a two-tuple (title, path) for each playlist in a Winamp Music
+    Library, where 'path' names the M3U file holding its tracks.
+
+    :param string playlists: Location of the 'playlists.xml' file Winamp uses
+    to record all ML playlists
+    :param list only: If non-None, only playlists whose titles are in this list
+    shall be yielded
+    :param list exclude: If non-None, playlists whose titles are in this list
+    shall not be yielded
+    """
+
+    for title, path in read_library(playlists):
+        if only and not title in only:
+            continue
+        if exclude and title in exclude:
+            continue
+        yield title, path
+
 def extract_playlists(playlists, rename, replacements,
                       utf8=False, only=None, exclude=None,
                       output=None, use_bom=None,
-                      codepage=None):
+                      codepage=None, manifest=None, fsync=None,
+                      profiles=None):
     """Extract some or all playlists from a Winamp Music Library & export them to
     M3U format.
 
@@ -50,6 +88,14 @@ def extract_playlists(playlists, rename, replacements,
     :param str codepage: If non-None, this shall be the name of the code page
     in which the input files are encoded; if None, the input codepage shall be
     deduced ('utf_8' if the file extension is '.m3u8', 'cp1252' otherwise)
+    :param Manifest manifest: If non-None, the manifest for 'output'; playlists
+    whose inputs & options are unchanged since the last run will be skipped
+    :param bool fsync: If True, flush each output file to stable storage before
+    renaming it into place
+    :param list profiles: If non-None, a list of profile.Profile instances,
+    each of which every playlist shall be written to (in which case 'rename',
+    'replacements', 'utf8', 'output', 'use_bom', 'manifest' & 'fsync' are
+    ignored); each playlist is read only once, however many there are
 
     'rename' is a textual string where each character represents a given
     transformation to be performed on the title. The following characters are
@@ -60,19 +106,12 @@ def extract_playlists(playlists, rename, replacements,
 
     """
 
-    dirname = os.path.dirname(playlists)
-    root = ET.parse(playlists).getroot()
-
-    for child in root:
-        title = child.attrib['title']
-        if only and not title in only:
-            continue
-        if exclude and title in exclude:
-            continue
+    if profiles is None:
+        profiles = [rubepl.profile.Profile(rename, replacements, utf8, use_bom,
+                                           output, manifest, fsync)]
 
-        normalize_m3u_playlist(title, os.path.join(dirname, child.attrib['filename']),
-                               rename, replacements, utf8, use_bom,
-                               codepage, output)
+    for title, filename in iter_playlists(playlists, only, exclude):
+        render_m3u_playlist(title, filename, profiles, codepage)
 
 def _get_playlists(args):
     """Handler for the'get-winamp-ml' command.
@@ -84,10 +123,11 @@ def _get_playlists(args):
     Namespace & pass them on to the implementation.
     """
 
-    extract_playlists(args.playlists, args.rename,
-                      rubepl.m3u.Replacements(args.replace),
-                      args.utf8, args.only, args.exclude, args.output,
-                      args.use_bom, args.codepage)
+    profiles = rubepl.profile.from_args(args)
+    extract_playlists(args.playlists, None, None, only=args.only,
+                      exclude=args.exclude, codepage=args.codepage,
+                      profiles=profiles)
+    rubepl.profile.save(profiles)
 
 def build_subparser(subparsers, name='get-winamp-ml'):
     """Build a sub-parser for a command that will extract all playlists from a
@@ -116,6 +156,10 @@ def build_subparser(subparsers, name='get-winamp-ml'):
                      + ' expression and REPLACEMENT is the text with which to'
                      + ' replace any matches (REPLACEMENT may include'
                      + ' sub-expressions)', action='append')
+    get.add_argument('-L', '--locations-only', help='Only apply replacements'
+                     + ' to track locations (leaving #EXTM3U & #EXTINF lines'
+                     + ' untouched)', action='store_true')
+    rubepl.prefix.add_arguments(get)
     get.add_argument('-r', '--rename', help='Rename code: a sequence of'
                      + ' characters indicating transformations to be applied'
                      + ' to the playlist title: "l" will convert all characters'
@@ -125,6 +169,14 @@ def build_subparser(subparsers, name='get-winamp-ml'):
     get.add_argument('-b', '--use-bom', help='Use the UTF-8 '
                     + 'byte order mark on output (in UTF8)',
                     action='store_true')
+    get.add_argument('-I', '--incremental', help='Keep a manifest in the'
+                     + ' output directory & skip playlists whose inputs &'
+                     + ' options are unchanged since the last run (and outputs'
+                     + ' whose contents would be identical)',
+                     action='store_true')
+    get.add_argument('--fsync', help='Flush each output file to stable storage'
+                     + ' before renaming it into place', action='store_true')
+    rubepl.profile.add_arguments(get)
     get.add_argument('playlists', help='location of the '
                     + 'playlists.xml file to be processed')
     get.set_defaults(func=_get_playlists)
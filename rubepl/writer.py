@@ -0,0 +1,208 @@
+"""writer.py -- Buffered, atomic output of playlists.
+
+All the exporters in this package funnel their output through a
+PlaylistWriter: the playlist is encoded into large buffers (for all but
+enormous playlists, a single buffer), each written with one system call to a
+temporary file in the destination directory, optionally fsync'd, and then
+renamed into place. Readers will therefore see either the old playlist or the
+new one, never a half-written file.
+"""
+
+__author__     = "Michael Herstine <sp1ff@pobox.com>"
+__copyright__  = "Copyright (C) 2015, 2016 Michael Herstine"
+__credits__    = ["Michael Herstine"]
+__license__    = "GPL"
+__version__    = "$Revision: $"
+__maintainer__ = "Michael Herstine <sp1ff@pobox.com>"
+__email__      = "sp1ff@pobox.com"
+__status__     = "Prototype"
+
+import collections
+import hashlib
+import logging
+import os
+import stat
+import time
+
+log = logging.getLogger(__name__)
+
+# Give up creating a temporary file after this many names are found taken
+_TEMP_ATTEMPTS = 100
+
+# Encode output in buffers of (about) this many characters
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+WriteStats = collections.namedtuple('WriteStats', ['path', 'bytes', 'latency'])
+"""The result of a single write: destination, number of bytes written, and the
+wall-clock time (in seconds) it took to write them."""
+
+def _write_all(fd, data):
+    """Write 'data' to file descriptor 'fd'; return the number of bytes written
+    (one syscall, unless the OS accepts a partial write)."""
+
+    view = memoryview(data)
+    total = len(view)
+    while len(view):
+        n = os.write(fd, view)
+        view = view[n:]
+    return total
+
+def _create_temp(path):
+    """Create a new, empty file alongside 'path'; return a two-tuple (file
+    descriptor, name).
+
+    Unlike tempfile.mkstemp (which always uses 0600), the file is created with
+    mode 0666 less the umask, just as a plain 'open(path, "w")' would do: the
+    kernel applies the umask, so we needn't read (& briefly change) it.
+    """
+
+    dirname, base = os.path.split(os.path.abspath(path))
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    for _ in range(_TEMP_ATTEMPTS):
+        tmp = os.path.join(dirname, '.{0}.{1}.tmp'.format(
+            base, os.urandom(6).hex()))
+        try:
+            return os.open(tmp, flags, 0o666), tmp
+        except FileExistsError:
+            continue
+    raise FileExistsError('no usable temporary file name for {0}'.
+                          format(path))
+
+def atomic_write(path, data, fsync=False, keep=None):
+    """Atomically replace the contents of 'path' with 'data'.
+
+    :param str path: destination file
+    :param data: the new contents; either a bytes-like object or an iterable
+    of them (which will be written in turn)
+    :param bool fsync: if True, flush the new file (and the directory
+    containing it) to stable storage before returning
+    :param keep: if given, a callable that will be handed the SHA-1 hex digest
+    of everything written just before the new file is renamed into place; if
+    it returns False, the new file is discarded & 'path' left untouched
+    :return: a WriteStats instance describing the write (if the new file was
+    discarded, 'bytes' will be zero)
+
+    'data' is written to a temporary file in the same directory as 'path',
+    which is then renamed over 'path'. If anything goes wrong, the temporary
+    file is removed & 'path' is left untouched. If 'path' already exists, the
+    new file inherits its permissions.
+    """
+
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = (data,)
+
+    start = time.perf_counter()
+
+    dirname = os.path.dirname(os.path.abspath(path))
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode = None
+
+    fd, tmp = _create_temp(path)
+    try:
+        try:
+            hasher = hashlib.sha1() if keep else None
+            nbytes = 0
+            for chunk in data:
+                nbytes += _write_all(fd, chunk)
+                if hasher:
+                    hasher.update(chunk)
+            if fsync:
+                os.fsync(fd)
+        finally:
+            os.close(fd)
+        if keep and not keep(hasher.hexdigest()):
+            os.unlink(tmp)
+            return WriteStats(path, 0, time.perf_counter() - start)
+        if mode is not None:
+            os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+    if fsync and 'posix' == os.name:
+        dirfd = os.open(dirname, os.O_RDONLY)
+        try:
+            os.fsync(dirfd)
+        finally:
+            os.close(dirfd)
+
+    return WriteStats(path, nbytes, time.perf_counter() - start)
+
+class PlaylistWriter(object):
+    """Encode & atomically write playlists.
+
+    A PlaylistWriter is configured once with an output encoding & line
+    separator, and may then be used to write any number of playlists. It keeps
+    running totals of the files & bytes written, and the time spent writing
+    them.
+    """
+
+    def __init__(self, encoding='utf_8', linesep=os.linesep, fsync=False,
+                 buffer_size=DEFAULT_BUFFER_SIZE):
+        """Construct with the output encoding.
+
+        :param str encoding: output encoding (e.g. 'utf_8' or 'cp1252')
+        :param str linesep: the text to be appended to each line
+        :param bool fsync: if True, each playlist will be flushed to stable
+        storage before it's renamed into place
+        :param int buffer_size: when writing an iterable of lines, encode &
+        write them in buffers of about this many characters
+        """
+
+        self._encoding = encoding
+        self._linesep = linesep
+        self._fsync = fsync
+        self._buffer_size = buffer_size
+        self.files = 0
+        self.bytes = 0
+        self.latency = 0.0
+
+    def encode(self, lines):
+        """Encode 'lines' into a single buffer, each line terminated by our line
+        separator."""
+
+        if not lines:
+            return b''
+        return (self._linesep.join(lines) + self._linesep).encode(self._encoding)
+
+    def iter_encode(self, lines):
+        """Encode an iterable of lines into a sequence of buffers.
+
+        Memory use is bounded by the buffer size, regardless of the number of
+        lines; a playlist smaller than that will be encoded into a single
+        buffer.
+        """
+
+        buf = []
+        size = 0
+        for line in lines:
+            buf.append(line)
+            size += len(line) + 1
+            if size >= self._buffer_size:
+                yield self.encode(buf)
+                buf = []
+                size = 0
+        if buf:
+            yield self.encode(buf)
+
+    def write(self, path, lines):
+        """Encode 'lines' (any iterable) & write them to 'path'; return a
+        WriteStats."""
+
+        return self.write_bytes(path, self.iter_encode(lines))
+
+    def write_bytes(self, path, data, keep=None):
+        """Write the (already encoded) buffer 'data' (or iterable of buffers) to
+        'path'; return a WriteStats. 'keep' is as for atomic_write."""
+
+        stats = atomic_write(path, data, self._fsync, keep)
+        self.files += 1
+        self.bytes += stats.bytes
+        self.latency += stats.latency
+        log.debug('wrote {0} bytes to {1} in {2:.3f}ms.'.
+                  format(stats.bytes, path, stats.latency * 1000.0))
+        return stats
@@ -0,0 +1,198 @@
+"""Unit tests for the rubepl.batch module"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import rubepl
+import rubepl.batch
+import rubepl.shared
+
+from test.utils import captured_output
+
+class Fixture(unittest.TestCase):
+
+    _DB = 'test/resources/rhythmbox/rhythmdb.xml'
+    _PL = 'test/resources/rhythmbox/playlists.xml'
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        for name in ('a', 'b', 'c', 'expected'):
+            os.mkdir(os.path.join(self._tmp, name))
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def _path(self, *names):
+        return os.path.join(self._tmp, *names)
+
+    def _contents(self, directory):
+        """Return a dictionary mapping the name of each file in 'directory' to
+        its contents."""
+
+        contents = {}
+        for name in os.listdir(directory):
+            with open(os.path.join(directory, name), 'rb') as fh:
+                contents[name] = fh.read()
+        return contents
+
+    def _jobs(self):
+        return [{'name': 'a', 'args': ['get-playlists-xml', '-o',
+                                       self._path('a'), self._DB, self._PL]},
+                {'name': 'b', 'args': ['get-playlists-xml', '-u', '-r', 'l-',
+                                       '-o', self._path('b'), self._DB,
+                                       self._PL]},
+                # Reads a's output, so must follow it
+                {'name': 'c', 'args': ['normalize-m3u', '-u', '-o',
+                                       self._path('c'),
+                                       self._path('a', 'Fall 2013.m3u')]},
+                {'name': 'again', 'args': ['get-playlists-xml', '-o',
+                                           self._path('a'), self._DB,
+                                           self._PL]},
+                {'name': 'broken', 'args': ['normalize-m3u', '-c', 'no-such',
+                                            self._path('a', 'Fall 2013.m3u')],
+                 'after': ['again']},
+                {'name': 'later', 'args': 'get-playlists-xml -o {0} {1} {2}'.
+                 format(self._path('expected'), self._DB, self._PL),
+                 'after': ['broken']}]
+
+    def test_batch(self):
+        """Run a batch; check its plan, the jobs' statuses & their output"""
+
+        jobfile = self._path('jobs.json')
+        with open(jobfile, 'w') as fh:
+            json.dump({'jobs': self._jobs()}, fh)
+
+        jobs = rubepl.batch.plan(rubepl.batch.load_jobs(jobfile))
+        deps = dict((job.name, job.deps) for job in jobs)
+        self.assertEqual({'a'}, deps['c'])
+        self.assertEqual({'a'}, deps['broken'])
+        self.assertEqual('a', jobs[3].duplicate_of)
+
+        inputs = rubepl.shared.SharedInputs()
+        with captured_output():
+            results = rubepl.batch.run(jobs, 4, inputs)
+        self.assertEqual(['ok', 'ok', 'ok', 'duplicate', 'failed', 'skipped'],
+                         [result.status for result in results])
+        # a & b parsed the same database & playlists once between them
+        assert 0 < inputs.loads
+        assert 0 < inputs.hits
+        assert rubepl.shared._active is None
+
+        # ...& wrote just what they would have on their own
+        with captured_output():
+            rubepl.main(['get-playlists-xml', '-u', '-r', 'l-', '-o',
+                         self._path('expected'), self._DB, self._PL])
+        expected = self._contents(self._path('expected'))
+        assert expected
+        self.assertEqual(expected, self._contents(self._path('b')))
+        assert 'Fall 2013.m3u' in os.listdir(self._path('a'))
+        assert os.listdir(self._path('c'))
+
+        lines = rubepl.batch.report(results, inputs, 1.0)
+        self.assertEqual(len(results) + 2, len(lines))
+        assert lines[-1].startswith('6 jobs')
+
+    def test_outputs(self):
+        """Check that writers without -o are ordered with their readers"""
+
+        pl = self._path('playlists.xml')
+        m3u = self._path('a', 'Fall 2013.m3u')
+        jobs = rubepl.batch.plan([
+            {'name': 'get', 'args': ['get-playlists-xml', '-o',
+                                     self._path('a'), self._DB, pl],
+             'after': []},
+            # Rewrites playlists.xml in place, so must follow 'get'...
+            {'name': 'put', 'args': ['put-playlists-xml', pl, m3u],
+             'after': []},
+            # ...& a sync writes its destination
+            {'name': 'sync', 'args': ['sync', self._path('b'), m3u],
+             'after': []},
+            {'name': 'read', 'args': ['normalize-m3u', '-o', self._path('c'),
+                                      self._path('b', 'Fall 2013.m3u')],
+             'after': []}])
+        deps = dict((job.name, job.deps) for job in jobs)
+        self.assertEqual(set(), deps['get'])
+        self.assertEqual({'get'}, deps['put'])
+        self.assertEqual({'get'}, deps['sync'])
+        self.assertEqual({'sync'}, deps['read'])
+        self.assertEqual({pl}, jobs[1].outputs())
+
+    def test_logged_errors(self):
+        """A job that logs an error has failed, & so has the batch"""
+
+        jobfile = self._path('jobs.json')
+        with open(jobfile, 'w') as fh:
+            json.dump([{'name': 'missing',
+                        'args': ['normalize-m3u', '-o', self._path('a'),
+                                 self._path('no-such.m3u')]},
+                       {'name': 'after', 'args': ['normalize-m3u', '-o',
+                                                  self._path('b'),
+                                                  self._path('a', 'x.m3u')]},
+                       {'name': 'fine', 'args': ['get-playlists-xml', '-o',
+                                                 self._path('c'), self._DB,
+                                                 self._PL]}], fh)
+        with captured_output() as (out, err):
+            status = rubepl.main(['batch', jobfile])
+        assert 1 == status
+        assert '1 ok, 1 failed, 1 skipped' in out.getvalue(), out.getvalue()
+
+        with open(jobfile, 'w') as fh:
+            json.dump([{'args': ['get-playlists-xml', '-o', self._path('c'),
+                                 self._DB, self._PL]}], fh)
+        with captured_output():
+            assert 0 == rubepl.main(['batch', jobfile])
+
+    def test_processes(self):
+        """Jobs may start worker processes while other jobs run"""
+
+        m3us = [os.path.join('test/resources/iTunes', name)
+                for name in ('Fall 2013.m3u', 'Spring 2010.m3u')]
+        jobs = rubepl.batch.plan([
+            {'name': 'tracks', 'args': ['get-tracks', '--processes', '2'] + m3us,
+             'after': []},
+            {'name': 'export', 'args': ['get-playlists-xml', '-o',
+                                        self._path('a'), self._DB, self._PL],
+             'after': []}])
+        with captured_output() as (out, err):
+            results = rubepl.batch.run(jobs, 2)
+        self.assertEqual(['ok', 'ok'], [result.status for result in results])
+        assert '/pub/mp3/' in out.getvalue()
+
+    def test_toml(self):
+        """Run a batch from a TOML job file, through the command line"""
+
+        jobfile = self._path('jobs.toml')
+        with open(jobfile, 'w') as fh:
+            fh.write('[[jobs]]\nname = "a"\nargs = {0}\n\n'
+                     '[[jobs]]\nargs = "get-playlists-xml -u -o {1} {2} {3}"\n'.
+                     format(json.dumps(['get-playlists-xml', '-o',
+                                        self._path('a'), self._DB, self._PL]),
+                            self._path('b'), self._DB, self._PL))
+        with captured_output() as (out, err):
+            rubepl.main(['batch', '-j', '2', jobfile])
+        assert os.listdir(self._path('a'))
+        assert os.listdir(self._path('b'))
+        assert '2 ok' in out.getvalue()
+
+    def test_errors(self):
+        """Check that bad job files are refused"""
+
+        cycle = [{'name': 'x', 'args': ['normalize-m3u', 'x.m3u'],
+                  'after': ['y']},
+                 {'name': 'y', 'args': ['normalize-m3u', 'y.m3u'],
+                  'after': ['x']}]
+        for jobs in ([], [{'name': 'x'}], [{'args': ['no-such-command']}],
+                     [{'args': ['batch', 'jobs.json']}],
+                     [{'args': ['normalize-m3u', 'x.m3u'], 'after': ['z']}],
+                     cycle):
+            jobfile = self._path('jobs.json')
+            with open(jobfile, 'w') as fh:
+                json.dump(jobs, fh)
+            with captured_output():
+                self.assertRaises(ValueError, rubepl.main, ['batch', jobfile])
+
+if __name__ == '__main__':
+    unittest.main()
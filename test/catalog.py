@@ -0,0 +1,116 @@
+"""Unit tests for the rubepl.catalog module"""
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import rubepl
+import rubepl.catalog
+import rubepl.itunes
+import rubepl.rhythmbox
+
+from rubepl.catalog import Track
+from test.utils import captured_output
+
+class Fixture(unittest.TestCase):
+
+    _ML1 = os.path.join(os.getcwd(), 'test/resources/iTunes/itunes-music-library-1.xml')
+    _PL1 = os.path.join(os.getcwd(), 'test/resources/iTunes/Fall 2013.m3u')
+    _DB = os.path.join(os.getcwd(), 'test/resources/rhythmbox/rhythmdb.xml')
+    _PL = os.path.join(os.getcwd(), 'test/resources/rhythmbox/playlists.xml')
+
+    _AMERICAN = '/Users/mgh/Music/iTunes/iTunes Media/Music/The Pogues/' + \
+        'The Very Best Of The Pogues/07 The Body Of An American.mp3'
+    _OPALING = '/mnt/Took-Hall/mp3/T/Tom Harrell - Opaling.mp3'
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._catalog = os.path.join(self._tmp, 'catalog.db')
+        logging.getLogger(rubepl.itunes.__name__).setLevel(logging.ERROR)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def test_catalog(self):
+        """Exercise rubepl.catalog.Catalog"""
+
+        with rubepl.catalog.Catalog(self._catalog) as catalog:
+            itunes = catalog.load('itunes', self._ML1)
+            rhythmbox = catalog.load('rhythmbox', self._DB)
+            assert 6046 == rhythmbox
+            assert itunes + rhythmbox == len(catalog)
+            # Unchanged libraries aren't loaded again
+            assert catalog.load('itunes', self._ML1) is None
+            self.assertEqual(rubepl.itunes.build_track_map(self._ML1),
+                             catalog.track_map('itunes'))
+
+            self.assertEqual([Track('itunes', self._AMERICAN, 'Pogues, The',
+                                    'The Body Of An American', 291)],
+                             catalog.find('pogues body american',
+                                          source='itunes'))
+            tracks = catalog.find('harrell OPAL')
+            self.assertEqual([Track('rhythmbox', self._OPALING, 'Tom Harrell',
+                                    'Opaling', 392)], tracks)
+            # Short words are matched, too, if not through the index
+            assert not catalog.find('harrell opal xz')
+            self.assertEqual(tracks, catalog.find(
+                'opal', artist='tom harrell', duration=390))
+            assert not catalog.find('opal', duration=380)
+            assert 3 == len(catalog.find('the', limit=3))
+
+            self.assertEqual({self._OPALING: tracks[0]},
+                             catalog.by_location([self._OPALING,
+                                                  '/not/there.mp3']))
+            assert not catalog.by_location([self._OPALING], 'itunes')
+
+        # Re-loading a source replaces its tracks (& their index entries)
+        with rubepl.catalog.Catalog(self._catalog) as catalog:
+            assert 6046 == catalog.load('rhythmbox', self._DB, force=True)
+            assert itunes + rhythmbox == len(catalog)
+            assert 1 == len(catalog.find('Opaling'))
+            self.assertRaises(ValueError, catalog.load, 'winamp', self._DB)
+
+    def test_commands(self):
+        """Exercise the catalog & find sub-commands"""
+
+        with captured_output() as (out, err):
+            rubepl.main(['catalog', '-K', self._catalog, '-i', self._ML1,
+                         '-y', self._DB])
+        with captured_output() as (out, err):
+            rubepl.main(['find', '-K', self._catalog, '-s', 'rhythmbox',
+                         'opaling'])
+        self.assertEqual('rhythmbox\t{0}\tTom Harrell\tOpaling\t392'.format(
+            self._OPALING), out.getvalue().split('\n')[0])
+
+    def test_matchers(self):
+        """Exercise the matchers, given a catalog"""
+
+        expected = os.path.join(self._tmp, 'expected')
+        actual = os.path.join(self._tmp, 'actual')
+        os.mkdir(expected)
+        os.mkdir(actual)
+        rubepl.rhythmbox.playlists_xml_to_m3u(self._PL, self._DB,
+                                              output=expected)
+        with rubepl.catalog.Catalog(self._catalog) as catalog:
+            rubepl.rhythmbox.playlists_xml_to_m3u(self._PL, self._DB,
+                                                  output=actual,
+                                                  catalog=catalog)
+            assert 6046 == len(catalog)
+        for name in ('Athens 2002.m3u', 'Fall 2013.m3u'):
+            with open(os.path.join(expected, name)) as a, \
+                 open(os.path.join(actual, name)) as b:
+                self.assertEqual(a.read(), b.read())
+
+        with captured_output():
+            rubepl.main(['itunify-m3u', '-K', self._catalog, '-i', self._ML1,
+                         '-o', os.path.join(actual, 'fall.m3u8'), self._PL1])
+            rubepl.main(['itunify-m3u', '-i', self._ML1, '-o',
+                         os.path.join(expected, 'fall.m3u8'), self._PL1])
+        with open(os.path.join(expected, 'fall.m3u8')) as a, \
+             open(os.path.join(actual, 'fall.m3u8')) as b:
+            self.assertEqual(a.read(), b.read())
+
+if __name__ == '__main__':
+    unittest.main()
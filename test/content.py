@@ -0,0 +1,140 @@
+"""Unit tests for the rubepl.content module"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import rubepl
+import rubepl.content
+
+from test.utils import captured_output
+
+def _id3v2(text, padding=0):
+    """Return an ID3v2.3 tag holding a single TIT2 frame."""
+
+    frame = b'TIT2' + (len(text) + 1).to_bytes(4, 'big') + b'\0\0\0' + \
+        text.encode('latin-1')
+    body = frame + b'\0' * padding
+    size = len(body)
+    syncsafe = bytes([(size >> 21) & 0x7f, (size >> 14) & 0x7f,
+                      (size >> 7) & 0x7f, size & 0x7f])
+    return b'ID3\x03\x00\x00' + syncsafe + body
+
+def _id3v1(title):
+    return b'TAG' + title.encode('latin-1').ljust(125, b'\0')
+
+def _flac(comment, audio):
+    streaminfo = b'\x00' + (34).to_bytes(3, 'big') + b'\x11' * 34
+    vorbis = b'\x84' + len(comment).to_bytes(3, 'big') + comment
+    return b'fLaC' + streaminfo + vorbis + audio
+
+class Fixture(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._db = os.path.join(self._tmp, 'content.db')
+        self._lib = os.path.join(self._tmp, 'lib')
+        os.makedirs(os.path.join(self._lib, 'z'))
+        self._audio = bytes(range(256)) * 64
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def write(self, name, data):
+        path = os.path.join(self._lib, name)
+        with open(path, 'wb') as fh:
+            fh.write(data)
+        return path
+
+    def test_audio_range(self):
+        """Exercise rubepl.content.audio_range"""
+
+        audio = self._audio
+        self.assertEqual((0, len(audio)), rubepl.content.audio_range(audio))
+        tag = _id3v2('Army of Me', 100)
+        self.assertEqual((len(tag), len(audio)), rubepl.content.audio_range(
+            tag + audio + _id3v1('Army of Me')))
+        data = _flac(b'TITLE=One', audio)
+        self.assertEqual((len(data) - len(audio), len(audio)),
+                         rubepl.content.audio_range(data))
+        self.assertEqual((0, 0), rubepl.content.audio_range(b''))
+
+    def test_index(self):
+        """Exercise rubepl.content.ContentIndex"""
+
+        audio = self._audio
+        a = self.write('a.mp3', _id3v2('Army of Me') + audio)
+        b = self.write('z/b.MP3', _id3v2('Army of Me (copy)', 512) + audio +
+                       _id3v1('Army of Me'))
+        c = self.write('c.mp3', audio[::-1])
+        self.write('d.mp3', audio[:100])
+        e = self.write('e.flac', _flac(b'TITLE=Army', audio))
+        self.write('notes.txt', audio)
+
+        with rubepl.content.ContentIndex(self._db) as index:
+            index.update([self._lib])
+            assert 5 == len(index)
+            assert 5 == index.examined and 0 == index.skipped
+            # d.mp3 is the only file of its size, so isn't hashed
+            assert 4 == index.hashed
+            self.assertEqual([[a, e, b]], list(index.duplicates()))
+            self.assertEqual({b: a, e: a}, index.canonical_map())
+            self.assertEqual(a, index.canonical(e))
+            self.assertEqual(c, index.canonical(c))
+
+        # Re-tagging a file doesn't change its identity, & nothing else is
+        # read
+        os.utime(b, ns=(0, 0))
+        self.write('z/b.MP3', _id3v2('One') + audio)
+        with rubepl.content.ContentIndex(self._db) as index:
+            index.update([self._lib])
+            assert 1 == index.examined and 4 == index.skipped
+            assert 1 == index.hashed
+            self.assertEqual([[a, e, b]], list(index.duplicates()))
+
+        # Deleted files are dropped
+        os.remove(a)
+        with rubepl.content.ContentIndex(self._db) as index:
+            index.update([self._lib])
+            assert 0 == index.examined and 0 == index.hashed
+            self.assertEqual({b: e}, index.canonical_map())
+
+    def test_no_audio(self):
+        """Files with no audio (just tags) are never duplicates"""
+
+        a = self.write('a.mp3', _id3v1('Army of Me'))
+        b = self.write('b.mp3', _id3v1('One'))
+        with rubepl.content.ContentIndex(self._db) as index:
+            index.update([self._lib])
+            assert 2 == len(index)
+            assert 0 == index.hashed
+            self.assertEqual([], list(index.duplicates()))
+            self.assertEqual({}, index.canonical_map())
+            self.assertEqual(b, index.canonical(b))
+
+    def test_commands(self):
+        """Exercise the content-index sub-command, & relocate --canonical"""
+
+        a = self.write('a.mp3', _id3v2('Army of Me') + self._audio)
+        b = self.write('z/b.mp3', self._audio)
+        with captured_output() as (out, err):
+            rubepl.main(['content-index', '-C', self._db, '--duplicates',
+                         self._lib])
+        self.assertEqual('{0}\t{1}'.format(a, b),
+                         out.getvalue().split('\n')[-2])
+
+        pls = os.path.join(self._tmp, 'in.m3u8')
+        with open(pls, 'w', encoding='utf-8') as fh:
+            fh.write('#EXTM3U\n#EXTINF:1,Army of Me\n{0}\n'.format(b))
+        out = os.path.join(self._tmp, 'out')
+        os.mkdir(out)
+        with captured_output():
+            rubepl.main(['relocate', '--canonical', '-C', self._db, '-u',
+                         '-o', out, pls])
+        with open(os.path.join(out, 'in.m3u8'), encoding='utf-8') as fh:
+            self.assertEqual(['#EXTM3U', '#EXTINF:1,Army of Me', a],
+                             fh.read().split('\n')[:3])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,3 +1,8 @@
+import codecs
+import os
+import random
+import shutil
+import tempfile
 import unittest
 
 import rubepl.decode
@@ -20,6 +25,81 @@ class Decoding(unittest.TestCase):
         assert '123' == rubepl.decode.maybe_remove_bom('\ufeff123')
         assert '123' == rubepl.decode.maybe_remove_bom('123')
 
+    def test_iter_decoded_lines(self):
+
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, 'x.m3u8')
+            with open(path, 'wb') as fh:
+                fh.write(b'\xef\xbb\xbf#EXTM3U\r\nD\xfcsseldorf.mp3\n')
+            lines = rubepl.decode.iter_decoded_lines(path)
+            assert '#EXTM3U\n' == next(lines)
+            assert 'D\xfcsseldorf.mp3\n' == next(lines)
+            self.assertRaises(StopIteration, next, lines)
+            assert ['#EXTM3U\n', 'D\xfcsseldorf.mp3\n'] == rubepl.decode.decode_file(path)
+        finally:
+            shutil.rmtree(tmp)
+
+    def test_detect_encoding(self):
+
+        detect = rubepl.decode.detect_encoding
+        assert ('utf_8', 'fb_cp1252') == detect(codecs.BOM_UTF8 + b'abc')
+        assert ('utf_16', 'strict') == detect('abc'.encode('utf_16'))
+        assert ('cp1252', 'strict') == detect(b'abc\n')
+        assert ('x', 'y') == detect(b'abc\n', ('x', 'y'))
+        assert ('utf_8', 'fb_cp1252') == detect('D\xfcsseldorf\n'.encode('utf_8'))
+        assert ('cp1252', 'strict') == detect('D\xfcsseldorf\n'.encode('cp1252'))
+        # Mostly UTF-8, with the odd CP1252 character...
+        assert ('utf_8', 'fb_cp1252') == \
+            detect('D\xfcsseldorf \u2014 B\xe9b\xe9 '.encode('utf_8') + b'Caf\xe9' +
+                   b' ' * 100)
+        # ...or lots of them
+        assert ('utf_8', 'repair_cp1252') == \
+            detect('D\xfcsseldorf \u2014 B\xe9b\xe9 '.encode('utf_8') + b'Caf\xe9')
+        # Overlong encodings & surrogates are not UTF-8
+        assert ('cp1252', 'strict') == detect(b'\xc0\xaf\xed\xa0\x80')
+
+    def test_repair_cp1252(self):
+
+        codecs.register_error('fb_cp1252', rubepl.decode.handle_decode_err_by_fb_cp1252)
+        rng = random.Random(1)
+        # Pieces of valid UTF-8, and single bytes that are valid CP1252 but not
+        # UTF-8
+        pieces = [b'a', b'/', b' ', '\xfc'.encode('utf_8'), '\u2014'.encode('utf_8'),
+                  '\U0001f3b5'.encode('utf_8'), b'\xe9', b'\x93', b'\xff', b'\x80']
+        for i in range(200):
+            data = b''.join(rng.choice(pieces) for j in range(rng.randint(0, 40)))
+            try:
+                expected = str(data, 'utf_8', 'fb_cp1252')
+            except UnicodeDecodeError:
+                continue # e.g. 0xe2 0x80 0x93 0x93; cf. repair_cp1252
+            assert expected == rubepl.decode.decode_bytes(data, 'utf_8', 'repair_cp1252')
+
+        self.assertRaises(UnicodeDecodeError, rubepl.decode.decode_bytes,
+                          b'abc\x81', 'utf_8', 'repair_cp1252')
+        assert 'abc' == rubepl.decode.repair_cp1252('abc')
+
+    def test_iter_repaired_lines(self):
+
+        tmp = tempfile.mkdtemp()
+        size = rubepl.decode.REPAIR_BLOCK_SIZE
+        try:
+            path = os.path.join(tmp, 'x.m3u')
+            data = b''.join('D\xfcsseldorf {0}\r\n'.format(i).encode(
+                'cp1252' if i % 2 else 'utf_8') for i in range(100)) + b'Caf\xe9'
+            with open(path, 'wb') as fh:
+                fh.write(data)
+            assert ('utf_8', 'repair_cp1252') == rubepl.decode.choose_codec(path)
+            expected = str(data, 'utf_8', 'fb_cp1252').replace('\r\n', '\n')
+            for n in (7, 1 << 20):
+                rubepl.decode.REPAIR_BLOCK_SIZE = n
+                lines = rubepl.decode.decode_file(path)
+                assert 101 == len(lines)
+                assert expected == ''.join(lines)
+        finally:
+            rubepl.decode.REPAIR_BLOCK_SIZE = size
+            shutil.rmtree(tmp)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,103 @@
+"""Unit tests for the rubepl.diff module"""
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import rubepl
+import rubepl.diff
+
+from rubepl.diff import Change
+
+from test.utils import captured_output
+
+def _lcs_length(a, b):
+    """Length of a longest common subsequence of 'a' & 'b', the slow way."""
+
+    prev = [0] * (len(b) + 1)
+    for x in a:
+        cur = [0]
+        for j, y in enumerate(b):
+            cur.append(prev[j] + 1 if x == y else max(prev[j+1], cur[j]))
+        prev = cur
+    return prev[-1]
+
+class Fixture(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def test_matching_blocks(self):
+        """Exercise rubepl.diff.matching_blocks"""
+
+        rng = random.Random(0)
+        for trial in range(2000):
+            k = rng.choice([3, 5, 40])
+            a = [rng.randrange(k) for i in range(rng.randrange(16))]
+            b = [rng.randrange(k) for i in range(rng.randrange(16))]
+            if 40 == k:
+                a = list(dict.fromkeys(a))
+                b = list(dict.fromkeys(b))
+            blocks = rubepl.diff.matching_blocks(a, b)
+            i = j = 0
+            for bi, bj, n in blocks:
+                assert 0 < n and i <= bi and j <= bj
+                self.assertEqual(a[bi:bi+n], b[bj:bj+n])
+                i, j = bi + n, bj + n
+            if 40 == k:
+                # No duplicates: the LCS is exact
+                self.assertEqual(_lcs_length(a, b),
+                                 sum(n for bi, bj, n in blocks))
+
+    def test_diff_tracks(self):
+        """Exercise rubepl.diff.diff_tracks"""
+
+        old = [('a', (1, 'A')), ('b', (2, 'B')), ('c', (3, 'C')),
+               ('d', (4, 'D')), ('e', (5, 'E'))]
+        new = [('a', (1, 'A')), ('d', (4, 'D')), ('x', None), ('b', (2, 'B')),
+               ('c', (3, 'C!')), ('e', None)]
+        self.assertEqual([Change('>', 4, 2, 'd'), Change('+', None, 3, 'x')],
+                         rubepl.diff.diff_tracks(old, new))
+        # (tracks are still matched by location alone)
+        self.assertEqual([Change('>', 4, 2, 'd'), Change('+', None, 3, 'x'),
+                          Change('~', 3, 5, 'c'), Change('~', 5, 6, 'e')],
+                         rubepl.diff.diff_tracks(old, new, True))
+        self.assertEqual([Change('-', 1, None, 'a'), Change('-', 5, None, 'e')],
+                         rubepl.diff.diff_tracks(old, old[1:4]))
+        self.assertEqual([], rubepl.diff.diff_tracks(old, old))
+
+    def test_diff_cmd(self):
+        """Exercise the diff sub-command"""
+
+        def write(name, tracks, fmt):
+            path = os.path.join(self._tmp, name)
+            with open(path, 'w', encoding='utf-8') as fh:
+                fh.write('#EXTM3U\n')
+                for i in tracks:
+                    fh.write(fmt.format(i))
+            return path
+
+        n = 20000
+        old = list(range(n))
+        new = old[:100] + old[101:15000] + [n] + old[15000:] + [100]
+        a = write('a.m3u8', old, '#EXTINF:{0},Track {0}\n/m/{0}.mp3\n')
+        b = write('b.m3u8', new,
+                  '#EXTINF:{0},Track {0} (remastered)\n/m/{0}.mp3\n')
+        with captured_output() as (out, err):
+            rubepl.main(['diff', a, b])
+        self.assertEqual(['+15000 /m/{0}.mp3'.format(n),
+                          '>101:{0} /m/100.mp3'.format(n + 1)],
+                         out.getvalue().split('\n')[:-1])
+        with captured_output() as (out, err):
+            rubepl.main(['diff', '-s', '-e', a, b])
+        # (the moved track's #EXTINF changed, too)
+        self.assertEqual('1 inserted, 0 deleted, 0 moved, {0} changed.\n'.
+                         format(n), out.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,7 @@
 import unittest
+import xml.sax.saxutils
 
+import rubepl.decode
 import rubepl.encode
 
 class Encoding(unittest.TestCase):
@@ -16,5 +18,14 @@ class Encoding(unittest.TestCase):
         x = rubepl.encode.maybe_add_utf8_bom('123')
         assert '\ufeff123' == rubepl.encode.maybe_add_utf8_bom(x)
 
+    def test_encode_track_location(self):
+        path = "/mnt/Took-Hall/mp3/J-K/Jane's Addiction - Classic Girl.mp3"
+        assert "file:///mnt/Took-Hall/mp3/J-K/Jane's%20Addiction%20-%20" + \
+            "Classic%20Girl.mp3" == rubepl.encode.encode_track_location(path)
+        for path in ['/mp3/Björk - Jóga #1 (100%).mp3', '/a/b&copy<d>/e?f.mp3']:
+            assert path == rubepl.decode.decode_track_location(
+                xml.sax.saxutils.escape(
+                    rubepl.encode.encode_track_location(path)))
+
 if __name__ == '__main__':
     unittest.main()
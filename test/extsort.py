@@ -0,0 +1,70 @@
+"""Unit tests for the rubepl.extsort module"""
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import rubepl
+import rubepl.extsort
+
+from test.utils import captured_output
+
+class Fixture(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def test_parse_size(self):
+        """Exercise rubepl.extsort.parse_size"""
+
+        assert 100 == rubepl.extsort.parse_size('100')
+        assert 512 << 10 == rubepl.extsort.parse_size('512K')
+        assert 64 << 20 == rubepl.extsort.parse_size('64MB')
+        assert 1 << 30 == rubepl.extsort.parse_size('1GiB')
+        self.assertRaises(ValueError, rubepl.extsort.parse_size, '64Q')
+
+    def test_iter_distinct_sorted(self):
+        """Exercise rubepl.extsort.iter_distinct_sorted"""
+
+        rng = random.Random(0)
+        alphabet = 'abcAB/ é\udce9ÿ'
+        items = [''.join(rng.choice(alphabet) for i in range(rng.randint(0, 8)))
+                 for j in range(5000)]
+        expected = sorted(set(items))
+        for budget, fan_in in ((1 << 30, 64), (4096, 64), (4096, 3), (1, 2)):
+            got = list(rubepl.extsort.iter_distinct_sorted(
+                iter(items), budget, self._tmp, fan_in))
+            self.assertEqual(expected, got)
+            # Temporary files are cleaned up
+            self.assertEqual([], os.listdir(self._tmp))
+
+    def test_get_tracks_cmd(self):
+        """Exercise get-tracks --memory-budget"""
+
+        playlists = []
+        for i in range(4):
+            pls = os.path.join(self._tmp, 'pls{0}.m3u8'.format(i))
+            with open(pls, 'w', encoding='utf-8') as fh:
+                fh.write('#EXTM3U\n')
+                for j in range(300):
+                    fh.write('#EXTINF:1,x\n/music/{0:03d}.mp3\n'.format((j * 7 + i * 100) % 500))
+            playlists.append(pls)
+
+        with captured_output() as (out, err):
+            rubepl.main(['get-tracks', '--sort'] + playlists)
+        expected = out.getvalue()
+        assert 500 == len(expected.split('\n')[:-1])
+        tmp = os.path.join(self._tmp, 'spill')
+        os.mkdir(tmp)
+        with captured_output() as (out, err):
+            rubepl.main(['get-tracks', '--memory-budget', '2K', '--temp-dir',
+                         tmp] + playlists)
+        self.assertEqual(expected, out.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
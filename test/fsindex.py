@@ -0,0 +1,123 @@
+"""Unit tests for the rubepl.fsindex module"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import rubepl
+import rubepl.fsindex
+
+from test.utils import captured_output
+
+class Fixture(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._lib = os.path.join(self._tmp, 'lib')
+        self._present = []
+        for artist in ('A', 'B', 'C'):
+            for album in ('x', 'y'):
+                d = os.path.join(self._lib, artist, album)
+                os.makedirs(d)
+                for track in range(3):
+                    path = os.path.join(d, '{0:02d}.mp3'.format(track))
+                    with open(path, 'w') as fh:
+                        fh.write(path)
+                    self._present.append(path)
+        self._missing = [os.path.join(self._lib, 'A', 'x', '99.mp3'),
+                         os.path.join(self._lib, 'D', 'z', '00.mp3'),
+                         os.path.join(self._tmp, 'elsewhere.mp3')]
+        os.symlink(os.path.join(self._lib, 'nowhere'),
+                   os.path.join(self._lib, 'dangling.mp3'))
+        self._missing.append(os.path.join(self._lib, 'dangling.mp3'))
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def test_snapshot(self):
+        """Exercise rubepl.fsindex.Snapshot"""
+
+        snapshot = rubepl.fsindex.Snapshot.build([self._lib], 4)
+        # Tracks, plus 3 artist & 6 album directories, plus the root
+        assert len(self._present) + 10 == len(snapshot)
+        for path in self._present:
+            assert path in snapshot
+        for path in self._missing:
+            assert path not in snapshot
+        assert os.path.join(self._lib, 'A', '..', 'B', 'y', '01.mp3') in snapshot
+
+        cache = os.path.join(self._tmp, 'snapshot')
+        snapshot.save(cache)
+        loaded = rubepl.fsindex.Snapshot.load(cache)
+        assert snapshot.roots == loaded.roots
+        assert len(snapshot) == len(loaded)
+        for path in self._present:
+            assert path in loaded
+
+        with open(cache, 'r+b') as fh:
+            fh.truncate(os.path.getsize(cache) - 3)
+        assert rubepl.fsindex.Snapshot.load(cache) is None
+        assert rubepl.fsindex.Snapshot.load(cache + '.nope') is None
+
+    def test_get_snapshot(self):
+        """Exercise rubepl.fsindex.get_snapshot"""
+
+        cache = os.path.join(self._tmp, 'snapshot')
+        first = rubepl.fsindex.get_snapshot([self._lib], cache)
+        assert os.path.exists(cache)
+        # Re-used...
+        second = rubepl.fsindex.get_snapshot([self._lib], cache)
+        assert first.created == second.created
+        # ...unless too old...
+        third = rubepl.fsindex.get_snapshot([self._lib], cache, max_age=-1)
+        assert third.created > first.created
+        # ...or of different roots
+        other = os.path.join(self._lib, 'A')
+        fourth = rubepl.fsindex.get_snapshot([other], cache)
+        assert [other] == fourth.roots
+
+    def test_iter_exists(self):
+        """Exercise rubepl.fsindex.iter_exists"""
+
+        paths = []
+        for i in range(len(self._missing)):
+            paths.extend(self._present[i*3:i*3+3])
+            paths.append(self._missing[i])
+        expected = [(path, path in self._present) for path in paths]
+
+        snapshot = rubepl.fsindex.Snapshot.build([self._lib])
+        # A file added after the snapshot was taken
+        late = os.path.join(self._lib, 'late.mp3')
+        with open(late, 'w') as fh:
+            fh.write(late)
+        paths.append(late)
+        expected.append((late, True))
+
+        for workers in (1, 4):
+            for snap in (None, snapshot):
+                for window in (None, 1):
+                    got = list(rubepl.fsindex.iter_exists(iter(paths), snap,
+                                                          workers, window))
+                    self.assertEqual(expected, got)
+
+    def test_get_tracks_cmd(self):
+        """Exercise get-tracks --check-missing"""
+
+        pls = os.path.join(self._tmp, 'pls.m3u8')
+        with open(pls, 'w', encoding='utf-8') as fh:
+            fh.write('#EXTM3U\n')
+            for path in self._present + self._missing + self._present:
+                fh.write('#EXTINF:1,x\n{0}\n'.format(path))
+
+        cache = os.path.join(self._tmp, 'snapshot')
+        for extra in ([], ['-j', '1'], ['--library-root', self._lib],
+                      ['--library-root', self._lib, '--snapshot', cache]):
+            args = ['get-tracks', '-m'] + extra + [pls]
+            with captured_output() as (out, err):
+                rubepl.main(args)
+            self.assertEqual(self._missing, out.getvalue().split('\n')[:-1])
+        assert os.path.exists(cache)
+
+if __name__ == '__main__':
+    unittest.main()
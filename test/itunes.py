@@ -7,6 +7,8 @@ import tempfile
 import unittest
 
 import rubepl.itunes
+import rubepl.manifest
+import rubepl.tags
 
 from test.utils import captured_output
 
@@ -137,6 +139,7 @@ class Fixture(unittest.TestCase):
 /Users/mgh/Music/iTunes/iTunes Media/Music/Mary Black/iist (Songs In Their Native Language)/10 Mo Ghille Mear.mp3
 #EXTINF:242,Dillon, Cara - Dillon, Cara - October Winds
 /Users/mgh/Music/iTunes/iTunes Media/Music/Dillon, Cara/After The Morning/05 Garden Valley.mp3
+#EXTINF:-1,Live - Live - Heaven
 /Users/mgh/Music/iTunes/iTunes Media/Music/Moby/Ambient/02 Heaven.mp3
 #EXTINF:273,The Soundtrack of Our Lives - The Soundtrack of Our Lives - Fly
 /Users/mgh/Music/iTunes/iTunes Media/Music/The Soundtrack of Our Lives/Communion/1-08 Fly.mp3
@@ -288,6 +291,14 @@ class Fixture(unittest.TestCase):
         m = rubepl.itunes.match_itunes_track(m3u00, D, 12)
         assert m is None
 
+        # Tags read from the file itself beat anything guessed from its name
+        m3u01 = rubepl.itunes.M3UTrack('/pub/mp3/07 Track 07.mp3', None,
+                                       rubepl.tags.Tags('Pogues, The',
+                                                        'The Body Of An American'))
+        m = rubepl.itunes.match_itunes_track(m3u01, D)
+        assert (None, '/Users/mgh/Music/iTunes/iTunes Media/Music/The Pogues/'
+                + 'The Very Best Of The Pogues/07 The Body Of An American.mp3') == m
+
     def test_m3u_to_itunes(self):
         """Exercise the m3u_to_itunes method."""
 
@@ -334,3 +345,41 @@ class Fixture(unittest.TestCase):
                     fh.write(text)
 
             assert text == self._JIN2
+
+    def test_library_playlists(self):
+        """Exercise itunes.iter_library_playlists & the get-itunes-playlists
+        sub-command"""
+
+        pls = dict(rubepl.itunes.iter_library_playlists(self._ml1))
+        assert 29 == len(pls)
+        # iTunes' own playlists are skipped, unless asked for
+        assert 'Library' not in pls and 'Music' not in pls
+        self.assertEqual(('/Users/mgh/Music/iTunes/iTunes Media/Music/'
+                          + 'Noel Brazil/The Loving Time/14 The Loving '
+                          + 'Time.mp3', (262, 'Mary Black - The Loving Time')),
+                         pls['fall-2013-import'][0])
+        pls = list(rubepl.itunes.iter_library_playlists(
+            self._ml1, only=['Music', 'fall-2013-import']))
+        self.assertEqual(['Music', 'fall-2013-import'],
+                         [title for title, tracks in pls])
+
+        out = os.path.join(self._tmp, 'out')
+        os.mkdir(out)
+        args = ['get-itunes-playlists', '-u', '-o', out, '-x',
+                'Recently Played', '-x', 'Top 25 Most Played', '-I', self._ml1]
+        with captured_output():
+            rubepl.main(args)
+        # ...plus the manifest
+        assert 28 == len(os.listdir(out))
+        fall = os.path.join(out, 'fall-2013-import.m3u8')
+        with open(fall, encoding='utf-8') as fh:
+            lines = fh.read().split('\n')
+        self.assertEqual(['#EXTM3U', '#EXTINF:262,Mary Black - The Loving Time',
+                          pls[1][1][0][0]], lines[:3])
+        assert 2 * len(pls[1][1]) + 2 == len(lines)
+
+        # Nothing's re-written the second time around
+        manifest = rubepl.manifest.Manifest(out)
+        rubepl.itunes.library_to_m3u(self._ml1, utf8=True, output=out,
+                                     exclude=args[5:8:2], manifest=manifest)
+        assert 27 == manifest.skipped and 0 == manifest.written
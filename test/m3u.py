@@ -1,6 +1,8 @@
 ﻿"""Unit tests for the rubepl.m3u module"""
 
 import os
+import random
+import re
 import shutil
 import sys
 import tempfile
@@ -270,6 +272,13 @@ M:\\Q-R\\Ruckus - Same In Any Language.mp3
         tracks = [x for x in rubepl.m3u.get_tracks_from_m3u(self._pls1B2B)]
         assert tracks == self._TRACKS
 
+    def test_iter_tracks(self):
+        """Test rubepl.m3u.iter_tracks_from_m3u"""
+
+        tracks = rubepl.m3u.iter_tracks_from_m3u(self._pls1B2B)
+        assert self._TRACKS[0] == next(tracks)
+        assert self._TRACKS[1:] == list(tracks)
+
     def test_get_tracks_cmd(self):
         """Exercise the get-tracks sub-command"""
 
@@ -281,5 +290,85 @@ M:\\Q-R\\Ruckus - Same In Any Language.mp3
         errors = err.getvalue().strip()
         assert '' == errors
 
+    def test_get_tracks_many(self):
+        """Exercise get-tracks on many playlists at once"""
+
+        playlists = []
+        expected = []
+        for i in range(12):
+            pls = os.path.join(self._tmp, 'pls{0:02d}.m3u8'.format(i))
+            with open(pls, 'w', encoding='utf-8') as fh:
+                fh.write('#EXTM3U\n')
+                # Each playlist shares half its tracks with the one before
+                for j in range(i * 50, i * 50 + 100):
+                    track = '/music/Björk/{0:04d}.mp3'.format(j)
+                    fh.write('#EXTINF:1,x\n{0}\n{0}\n'.format(track))
+                    if track not in expected:
+                        expected.append(track)
+            playlists.append(pls)
+
+        for extra in (['--processes', '1'], ['--processes', '3'],
+                      ['--processes', '3', '-k']):
+            with captured_output() as (out, err):
+                rubepl.main(['get-tracks'] + extra + playlists)
+            got = out.getvalue().split('\n')[:-1]
+            if '-k' in extra or '1' in extra:
+                self.assertEqual(expected, got)
+            else:
+                self.assertEqual(sorted(expected), sorted(got))
+
+        with captured_output() as (out, err):
+            rubepl.main(['get-tracks', '-0', '-k'] + playlists)
+        self.assertEqual(expected, out.getvalue().split('\0')[:-1])
+
+class ReplacementsFixture(unittest.TestCase):
+    """Fixture for exercising rubepl.m3u.Replacements."""
+
+    _RULES = ['\\\\\\\\=>/', 'M:/=>/pub/mp3/', 'C:/Users/x/Music=>/srv/music',
+              'D:/Music=>/srv/more', 'Numb=>Dumb', 'umb=>UMB', 'Anna=>Annie',
+              'Annie=>Ann', 'The - =>', '\\.mp3$=>.ogg', '(Counting) Crows=>\\1 Ravens',
+              'A{2}=>aa', 'x|y=>z', '[0-9]+=>N', 'Begins=>Ends', 'Ends=>Finishes']
+
+    _LINES = ['#EXTM3U', '#EXTINF:186,Gin Blossoms - Not Only Numb',
+              'M:\\G\\Gin Blossoms - Not Only Numb.mp3',
+              '#EXTINF:271,Counting Crows - Anna Begins',
+              'C:\\Users\\x\\Music\\C\\Counting Crows - Anna Begins.mp3',
+              'D:\\Music\\The - AAA xyz 123.mp3', '', 'Annie Annanna.mp3']
+
+    @staticmethod
+    def _naive(rules, lines):
+        regexes = rubepl.m3u.Replacements(rules)._regexes
+        out = []
+        for line in lines:
+            for regex, repl in regexes:
+                line = re.sub(regex, repl, line)
+            out.append(line)
+        return out
+
+    def test_process(self):
+        """Replacements.process should match applying each rule in turn"""
+
+        rules = rubepl.m3u.Replacements(self._RULES)
+        assert rules.process(self._LINES) == self._naive(self._RULES, self._LINES)
+
+        rng = random.Random(1)
+        for i in range(200):
+            rules = rng.sample(self._RULES, rng.randint(1, len(self._RULES)))
+            lines = [''.join(rng.choice(['M:\\', 'Anna', 'nn', 'umb', 'Numb', 'A',
+                                         '\\', 'D:/Music', 'x', '7', 'Ends',
+                                         'Begins', '.mp3', ' '])
+                             for j in range(rng.randint(0, 12)))
+                     for k in range(20)]
+            assert rubepl.m3u.Replacements(rules).process(lines) == \
+                self._naive(rules, lines), rules
+
+    def test_locations_only(self):
+        """Exercise Replacements with locations_only"""
+
+        rules = rubepl.m3u.Replacements(['Numb=>Dumb'], locations_only=True)
+        assert ['\ufeff#EXTM3U', '#EXTINF:186,Gin Blossoms - Not Only Numb',
+                'M:\\G\\Gin Blossoms - Not Only Dumb.mp3'] == \
+            rules.process(['\ufeff#EXTM3U', self._LINES[1], self._LINES[2]])
+
 if '__main__' == __name__:
     unittest.main()
@@ -0,0 +1,86 @@
+"""Unit tests for the rubepl.manifest module"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import rubepl.m3u
+import rubepl.manifest
+
+class Fixture(unittest.TestCase):
+
+    _SRC = """#EXTM3U
+#EXTINF:186,Gin Blossoms - Not Only Numb
+M:\\G\\Gin Blossoms - Not Only Numb.mp3
+#EXTINF:271,Counting Crows - Anna Begins
+M:\\C\\Counting Crows - Anna Begins.mp3
+"""
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._pls = os.path.join(self._tmp, 'in.m3u8')
+        with open(self._pls, 'wb') as fh:
+            fh.write(bytes(self._SRC, 'UTF-8'))
+        self._out = os.path.join(self._tmp, 'out')
+        os.mkdir(self._out)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def test_write(self):
+        """Exercise Manifest.write & Manifest.is_current"""
+
+        outf = os.path.join(self._out, 'x.m3u')
+        manifest = rubepl.manifest.Manifest(self._out)
+        assert not manifest.is_current(outf, 'a')
+        assert manifest.write(outf, 'a', b'123\n')
+        assert manifest.is_current(outf, 'a')
+        assert not manifest.is_current(outf, 'b')
+        manifest.save()
+
+        mtime = os.stat(outf).st_mtime_ns
+        manifest = rubepl.manifest.Manifest(self._out)
+        assert manifest.is_current(outf, 'a')
+        # Same bytes, different inputs: the file should be left alone...
+        assert not manifest.write(outf, 'b', b'123\n')
+        assert mtime == os.stat(outf).st_mtime_ns
+        # ...but the new key recorded.
+        assert manifest.is_current(outf, 'b')
+        assert manifest.write(outf, 'c', b'456\n')
+        with open(outf, 'rb') as fh:
+            assert b'456\n' == fh.read()
+
+    def test_normalize_incremental(self):
+        """Exercise normalize_m3u_playlist with a manifest"""
+
+        replacements = rubepl.m3u.Replacements(['\\\\\\\\=>/', 'M:/=>/pub/mp3/'])
+        outf = os.path.join(self._out, 'x.m3u8')
+
+        manifest = rubepl.manifest.Manifest(self._out)
+        rubepl.m3u.normalize_m3u_playlist('x', self._pls, None, replacements,
+                                          utf8=True, output=self._out,
+                                          manifest=manifest)
+        manifest.save()
+        assert 1 == manifest.written
+        with open(outf, 'rb') as fh:
+            first = fh.read()
+        assert b'/pub/mp3/G/Gin Blossoms - Not Only Numb.mp3' in first
+
+        # Nothing has changed: the playlist shouldn't even be rendered
+        manifest = rubepl.manifest.Manifest(self._out)
+        rubepl.m3u.normalize_m3u_playlist('x', self._pls, None, replacements,
+                                          utf8=True, output=self._out,
+                                          manifest=manifest)
+        assert 1 == manifest.skipped and 0 == manifest.rendered
+
+        # Different options: re-rendered & re-written
+        rubepl.m3u.normalize_m3u_playlist('x', self._pls, None, replacements,
+                                          utf8=True, use_bom=True,
+                                          output=self._out, manifest=manifest)
+        assert 1 == manifest.written
+        with open(outf, 'rb') as fh:
+            assert b'\xef\xbb\xbf' + first == fh.read()
+
+if __name__ == '__main__':
+    unittest.main()
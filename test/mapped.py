@@ -0,0 +1,100 @@
+"""Unit tests for the rubepl.mapped module"""
+
+import codecs
+import os
+import shutil
+import tempfile
+import unittest
+
+import rubepl.m3u
+import rubepl.mapped
+
+from rubepl.decode import iter_decoded_lines
+
+CASES = [
+    ('plain.m3u8', b'#EXTM3U\n/a/b.mp3\n/a/c.mp3\n'),
+    ('bom.m3u8', codecs.BOM_UTF8 + b'#EXTM3U\n/a/b.mp3\n'),
+    ('bom-only.m3u8', codecs.BOM_UTF8),
+    ('empty.m3u8', b''),
+    ('crlf.m3u8', b'#EXTM3U\r\n/a/b.mp3\r\n\r\n/a/c.mp3\r\n'),
+    ('cr.m3u8', b'#EXTM3U\r/a/b.mp3\r\r\n/a/c.mp3\r'),
+    ('unterminated.m3u8', b'#EXTM3U\n/a/b.mp3'),
+    ('cp1252.m3u', b'#EXTM3U\r\n/a/Bj\xf6rk.mp3  \r\n/a/\x93q\x94.mp3\r\n'),
+    ('utf16.m3u', '#EXTM3U\n/a/Bj\xf6rk.mp3\n'.encode('utf_16')),
+]
+
+class Fixture(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def _write(self, name, data):
+        path = os.path.join(self._tmp, name)
+        with open(path, 'wb') as fh:
+            fh.write(data)
+        return path
+
+    def test_lines(self):
+        """MappedPlaylist should break lines as text-mode I/O does"""
+
+        for name, data in CASES:
+            path = self._write(name, data)
+            expected = [line.rstrip('\n') for line in iter_decoded_lines(path)]
+            for block_size in (1, 5, 1 << 20):
+                with rubepl.mapped.MappedPlaylist(path) as pls:
+                    if pls.mappable:
+                        got = [pls.decode(raw) for raw in
+                               pls.raw_lines(block_size)]
+                        self.assertEqual(expected, got, name)
+                    self.assertEqual(expected, list(pls.lines()), name)
+            with rubepl.mapped.MappedPlaylist(path) as pls:
+                self.assertEqual('utf16' not in name, pls.mappable)
+
+    def test_read(self):
+        """MappedPlaylist.read should behave as a binary file's would"""
+
+        for name, data in CASES:
+            path = self._write(name, data)
+            with rubepl.mapped.MappedPlaylist(path) as pls:
+                assert data == pls.read()
+                assert b'' == pls.read(10)
+            with rubepl.mapped.MappedPlaylist(path) as pls:
+                assert data == b''.join(iter(lambda: pls.read(3), b''))
+
+    def test_iter_track_locations(self):
+        """iter_track_locations should agree with iter_tracks_from_m3u"""
+
+        text = ('#EXTM3U\n'
+                '#EXTINF:123,Artist - Title\n'
+                '/a/b.mp3\n'
+                ' # EXTINF : -1 , Spaced Out\n'
+                '/a/c.mp3\n'
+                '\xa0#EXTINF:7,Non-breaking space\n'
+                '/a/d.mp3\n'
+                '#EXTINF:8,Twice\n'
+                '#EXTINF:9,In a row\n'
+                '#EXTINF garbage\n'
+                '#EXTVLCOPT:foo\n'
+                '\n'
+                '/a/Bj\xf6rk.mp3  \n'
+                '#EXTINF:10,Last')
+        for name, data in (('x.m3u8', text.encode('utf_8')),
+                           ('x.m3u', text.encode('cp1252')),
+                           ('x.m3u', text.encode('utf_16'))):
+            path = self._write(name, data)
+            expected = [x[0] for x in rubepl.m3u.iter_tracks_from_m3u(path)]
+            self.assertEqual(expected,
+                             list(rubepl.m3u.iter_track_locations(path)))
+            # The non-breaking space is only whitespace once decoded
+            assert '/a/d.mp3' in expected
+            assert not [x for x in expected if 'Non-breaking' in x]
+
+        path = self._write('bad.m3u', b'/a/b.mp3\n')
+        self.assertRaises(Exception, list,
+                          rubepl.m3u.iter_track_locations(path))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+"""Unit tests for the rubepl.pipeline module"""
+
+import json
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import rubepl
+import rubepl.itunes
+import rubepl.m3u
+import rubepl.pipeline
+import rubepl.winamp
+
+from test.utils import captured_output
+
+class Fixture(unittest.TestCase):
+
+    _DB = 'test/resources/rhythmbox/rhythmdb.xml'
+    _PL = 'test/resources/rhythmbox/playlists.xml'
+    _ML1 = 'test/resources/iTunes/itunes-music-library-1.xml'
+    _WINAMP = 'test/resources/Winamp/Plugins/ml/playlists/playlists.xml'
+    _M3US = [os.path.join('test/resources/iTunes', name)
+             for name in ('Fall 2013.m3u', 'Spring 2010.m3u',
+                          'Summer 2007.m3u')]
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._expected = os.path.join(self._tmp, 'expected')
+        self._actual = os.path.join(self._tmp, 'actual')
+        os.mkdir(self._expected)
+        os.mkdir(self._actual)
+        logging.getLogger(rubepl.itunes.__name__).setLevel(logging.ERROR)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def _check(self, command, source, opts, inputs):
+        """Run 'command' & 'convert' from 'source' with the same options; check
+        that they wrote the same playlists."""
+
+        with captured_output():
+            rubepl.main([command, '-o', self._expected] + opts + inputs)
+            rubepl.main(['convert', '-f', source, '-o', self._actual] + opts +
+                        inputs)
+        names = sorted(os.listdir(self._expected))
+        assert names
+        self.assertEqual(names, sorted(os.listdir(self._actual)))
+        for name in names:
+            with open(os.path.join(self._expected, name), 'rb') as a, \
+                 open(os.path.join(self._actual, name), 'rb') as b:
+                self.assertEqual(a.read(), b.read(), name)
+
+    def test_rhythmbox(self):
+        """Convert Rhythmbox playlists as get-playlists-xml would"""
+
+        self._check('get-playlists-xml', 'rhythmbox',
+                    ['-u', '-b', '-r', 'l-', '-p', 'The =>Da ', '-P',
+                     '/mnt/Took-Hall/mp3=/pub/mp3'], [self._DB, self._PL])
+
+    def test_itunes(self):
+        """Convert iTunes playlists as get-itunes-playlists would"""
+
+        self._check('get-itunes-playlists', 'itunes', ['-u'], [self._ML1])
+
+    def test_m3u(self):
+        """Convert M3U playlists as normalize-m3u would"""
+
+        self._check('normalize-m3u', 'm3u', ['-u', '-p', '^/pub/mp3/=>M:/',
+                                             '-p', 'Black=>White'],
+                    self._M3US)
+
+    def test_ndjson(self):
+        """Convert a Winamp Music Library to NDJSON"""
+
+        output = os.path.join(self._tmp, 'winamp.ndjson')
+        with captured_output():
+            rubepl.main(['convert', '-f', 'winamp', '-t', 'ndjson', '-o',
+                         output, '-c', 'cp437', '-y', 'Lifting Mix #1',
+                         self._WINAMP])
+        with open(output) as fh:
+            records = [json.loads(line) for line in fh]
+
+        titles, filenames = zip(*rubepl.winamp.iter_playlists(
+            self._WINAMP, only=['Lifting Mix #1']))
+        locations = list(rubepl.m3u.iter_track_locations(filenames[0],
+                                                         'cp437'))
+        self.assertEqual(locations, [record['location'] for record in records])
+        assert all('Lifting Mix #1' == record['playlist']
+                   for record in records)
+        assert all(isinstance(record['duration'], int) for record in records)
+
+        with captured_output():
+            self.assertRaises(ValueError, rubepl.main,
+                              ['convert', '-f', 'rhythmbox', self._DB])
+
+    def test_extinf(self):
+        """Exercise the shared #EXTINF parser"""
+
+        self.assertEqual((218, 'Matthew Sweet - Where You Get Love'),
+                         rubepl.m3u.parse_extinf(
+                             '#EXTINF:218,Matthew Sweet - Where You Get Love'))
+        self.assertEqual((-1, 'Live - Heaven'),
+                         rubepl.m3u.parse_extinf(' # EXTINF : -1 ,Live - Heaven'))
+        self.assertEqual((None, 'x'), rubepl.m3u.parse_extinf('#EXTINF:,x'))
+        assert rubepl.m3u.parse_extinf('/pub/mp3/x.mp3') is None
+        self.assertEqual('#EXTINF:-1,x',
+                         rubepl.m3u.render_extinf((None, 'x')))
+        assert rubepl.m3u.render_extinf((None, None)) is None
+
+        # The iTunes matcher now agrees with the M3U parser
+        extinf = rubepl.itunes._make_extinf(
+            rubepl.m3u.parse_extinf('#EXTINF:-1,Live - Heaven'))
+        assert extinf.get_duration() is None
+        self.assertEqual('Live', extinf.get_artist())
+
+if __name__ == '__main__':
+    unittest.main()
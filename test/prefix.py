@@ -0,0 +1,87 @@
+"""Unit tests for the rubepl.prefix module"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import rubepl.m3u
+import rubepl.prefix
+
+from test.utils import captured_output
+
+class Fixture(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def test_parse_mapping(self):
+        """Exercise rubepl.prefix.parse_mapping"""
+
+        assert ('C:\\Music', '/srv/music') == \
+            rubepl.prefix.parse_mapping('C:\\Music=/srv/music')
+        assert ('a=b', 'c') == rubepl.prefix.parse_mapping('a=b=>c')
+        self.assertRaises(ValueError, rubepl.prefix.parse_mapping, 'abc')
+
+    def test_rewrite(self):
+        """Exercise rubepl.prefix.PrefixRewriter.rewrite"""
+
+        rw = rubepl.prefix.PrefixRewriter(['C:\\Users\\x\\Music=/srv/music',
+                                           'C:\\Users\\x\\Music\\Live=/srv/live/',
+                                           '/mnt/Took-Hall/mp3=>D:\\mp3',
+                                           'M:=/pub/mp3'])
+        assert 4 == len(rw)
+        assert '/srv/music/A/b.mp3' == rw.rewrite('C:\\Users\\x\\Music\\A\\b.mp3')
+        # Longest prefix wins
+        assert '/srv/live/A/b.mp3' == rw.rewrite('C:\\Users\\x\\Music\\Live\\A\\b.mp3')
+        # Mixed separators are normalized to those of the replacement
+        assert '/srv/music/A/b.mp3' == rw.rewrite('C:/Users/x/Music\\A/b.mp3')
+        assert 'D:\\mp3\\T\\Tom Waits - Never Let Go.mp3' == \
+            rw.rewrite('/mnt/Took-Hall/mp3/T/Tom Waits - Never Let Go.mp3')
+        assert '/pub/mp3/G/x.mp3' == rw.rewrite('M:\\G\\x.mp3')
+        # Whole components only
+        assert 'C:\\Users\\x\\Musical\\b.mp3' == rw.rewrite('C:\\Users\\x\\Musical\\b.mp3')
+        assert 'relative/b.mp3' == rw.rewrite('relative/b.mp3')
+
+    def test_many_mappings(self):
+        """PrefixRewriter should cope with large numbers of mappings"""
+
+        path = os.path.join(self._tmp, 'prefixes.txt')
+        with open(path, 'w', encoding='utf-8') as fh:
+            fh.write('# old => new\n\n')
+            for i in range(20000):
+                fh.write('C:\\Music\\{0}=/srv/music/{0}\n'.format(i))
+        rw = rubepl.prefix.PrefixRewriter()
+        assert 20000 == rw.load(path)
+        assert '/srv/music/12345/a.mp3' == rw.rewrite('C:\\Music\\12345\\a.mp3')
+
+    def test_replacements(self):
+        """Prefix rewrites should only touch locations, & precede regexes"""
+
+        rw = rubepl.prefix.PrefixRewriter(['M:=/pub/mp3'])
+        replacements = rubepl.m3u.Replacements(['mp3/G=>mp3/g'], prefixes=rw)
+        assert ['#EXTM3U', '#EXTINF:1,M:\\G', '/pub/mp3/g/x.mp3'] == \
+            replacements.process(['#EXTM3U', '#EXTINF:1,M:\\G', 'M:\\G\\x.mp3'])
+        assert replacements.signature() != \
+            rubepl.m3u.Replacements(['mp3/G=>mp3/g']).signature()
+
+    def test_normalize_cmd(self):
+        """Exercise normalize-m3u with --rewrite-prefix"""
+
+        src = os.path.join(self._tmp, 'X.m3u')
+        with open(src, 'w', encoding='cp1252') as fh:
+            fh.write('#EXTM3U\n#EXTINF:186,Gin Blossoms - Not Only Numb\n'
+                     + 'M:\\G\\Gin Blossoms - Not Only Numb.mp3\n')
+        args = ['normalize-m3u', '-o', self._tmp, '-r', 'l', '-u',
+                '-P', 'M:=/pub/mp3', src]
+        with captured_output() as (out, err):
+            rubepl.main(args)
+        with open(os.path.join(self._tmp, 'x.m3u8'), 'rb') as fh:
+            assert b'#EXTM3U\n#EXTINF:186,Gin Blossoms - Not Only Numb\n' \
+                + b'/pub/mp3/G/Gin Blossoms - Not Only Numb.mp3\n' == fh.read()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+"""Unit tests for the rubepl.profile module"""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import rubepl
+import rubepl.m3u
+import rubepl.manifest
+import rubepl.profile
+import rubepl.rhythmbox
+
+from test.utils import captured_output
+
+class Fixture(unittest.TestCase):
+
+    _DB = 'test/resources/rhythmbox/rhythmdb.xml'
+    _PL = 'test/resources/rhythmbox/playlists.xml'
+    _WINAMP = os.path.join(os.getcwd(), 'test/resources/Winamp/Plugins/ml/playlists/playlists.xml')
+    _M3US = [os.path.join(os.getcwd(), 'test/resources/iTunes', name)
+             for name in ('Fall 2013.m3u', 'Spring 2010.m3u')]
+
+    # Each is a profile, & the options which give the same output on their own
+    _PROFILES = [({'output': 'a'}, []),
+                 ({'output': 'b', 'utf8': True, 'use_bom': True},
+                  ['-u', '-b']),
+                 ({'output': 'c', 'utf8': True, 'rename': 'l-',
+                   'replace': ['mp3=>ogg'], 'locations_only': True},
+                  ['-u', '-r', 'l-', '-p', 'mp3=>ogg', '-L'])]
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._profiles = os.path.join(self._tmp, 'profiles.json')
+        for profile, opts in self._PROFILES:
+            os.makedirs(os.path.join(self._tmp, 'multi', profile['output']))
+        with open(self._profiles, 'w') as fh:
+            json.dump([dict(profile, output=os.path.join(self._tmp, 'multi',
+                                                         profile['output']))
+                       for profile, opts in self._PROFILES], fh)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def _contents(self, directory):
+        """Return a dictionary mapping the name of each playlist in
+        'directory' to its contents."""
+
+        contents = {}
+        for name in os.listdir(directory):
+            if rubepl.manifest.MANIFEST_NAME != name:
+                with open(os.path.join(directory, name), 'rb') as fh:
+                    contents[name] = fh.read()
+        return contents
+
+    def _check(self, command, inputs):
+        """Run 'command' once with all our profiles, & once per profile with
+        the equivalent options; check that the results are identical."""
+
+        with captured_output():
+            rubepl.main([command, '-I', '--profiles', self._profiles] + inputs)
+        for profile, opts in self._PROFILES:
+            single = os.path.join(self._tmp, 'single', profile['output'])
+            os.makedirs(single)
+            with captured_output():
+                rubepl.main([command, '-o', single] + opts + inputs)
+            expected = self._contents(single)
+            assert expected
+            self.assertEqual(expected, self._contents(
+                os.path.join(self._tmp, 'multi', profile['output'])))
+            # Each profile keeps its own manifest
+            assert os.path.exists(os.path.join(
+                self._tmp, 'multi', profile['output'],
+                rubepl.manifest.MANIFEST_NAME))
+
+    def test_rhythmbox(self):
+        """Exercise get-playlists-xml with several profiles"""
+
+        self._check('get-playlists-xml', [self._DB, self._PL])
+
+        # Nothing's changed, so nothing need be rendered again
+        profiles = []
+        for spec in rubepl.profile.load_profiles(self._profiles):
+            manifest = rubepl.manifest.Manifest(spec['output'])
+            profiles.append(rubepl.profile.Profile(
+                spec.get('rename'), rubepl.m3u.Replacements(
+                    spec.get('replace'), spec.get('locations_only', False)),
+                spec.get('utf8', False), spec.get('use_bom', False),
+                spec['output'], manifest))
+        rubepl.rhythmbox.playlists_xml_to_m3u(self._PL, self._DB,
+                                              profiles=profiles)
+        assert all(0 == profile.manifest.rendered for profile in profiles)
+        assert all(0 == profile.writer.files for profile in profiles)
+
+    def test_winamp(self):
+        """Exercise get-winamp-ml with several profiles"""
+
+        self._check('get-winamp-ml', ['-x', 'Lifting Mix #1', '-x',
+                                      'Lifting Mix #2', self._WINAMP])
+
+    def test_normalize(self):
+        """Exercise normalize-m3u with several profiles"""
+
+        self._check('normalize-m3u', self._M3US)
+
+    def test_errors(self):
+        """Check that bad profiles are refused"""
+
+        for profiles in ([], {'output': 'a'}, [{'output': 'a', 'bom': True}],
+                         [{'output': 'a'}, {'output': 'a', 'use_bom': True}]):
+            with open(self._profiles, 'w') as fh:
+                json.dump(profiles, fh)
+            with captured_output():
+                self.assertRaises(ValueError, rubepl.main,
+                                  ['normalize-m3u', '--profiles',
+                                   self._profiles] + self._M3US)
+
+if __name__ == '__main__':
+    unittest.main()
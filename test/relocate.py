@@ -0,0 +1,77 @@
+"""Unit tests for the rubepl.relocate module"""
+
+import codecs
+import os
+import shutil
+import tempfile
+import unittest
+
+import rubepl
+import rubepl.m3u
+import rubepl.relocate
+
+from test.utils import captured_output
+
+class Fixture(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._map = os.path.join(self._tmp, 'moves.tsv')
+        with open(self._map, 'w', encoding='utf-8') as fh:
+            fh.write('# old\tnew\n')
+            fh.write('M:\\Björk\\Army of Me.mp3\t/srv/B/Björk/Army of Me.mp3\n')
+            fh.write('\n')
+            fh.write('M:\\U2\\One.mp3\t/srv/U/U2/One.mp3\n')
+            fh.write('M:\\U2\\One.mp3\t/srv/0-9/U2/One.mp3\n')
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def test_move_map(self):
+        """Exercise rubepl.relocate.MoveMap"""
+
+        moves = rubepl.relocate.MoveMap()
+        moves.load(self._map)
+        assert 2 == len(moves)
+        self.assertEqual('/srv/0-9/U2/One.mp3', moves.relocate('M:\\U2\\One.mp3'))
+        self.assertEqual('M:\\U2\\Two.mp3', moves.relocate('M:\\U2\\Two.mp3'))
+        assert 1 == moves.relocated
+
+        # A map built in memory (e.g. from a content index) is identified by
+        # its contents
+        self.assertNotEqual(rubepl.relocate.MoveMap({'a': 'b'}).signature(),
+                            rubepl.relocate.MoveMap({'a': 'c'}).signature())
+
+        bad = os.path.join(self._tmp, 'bad.tsv')
+        with open(bad, 'w') as fh:
+            fh.write('no tab here\n')
+        self.assertRaises(ValueError, moves.load, bad)
+
+        replacements = rubepl.m3u.Replacements(None, moves=moves)
+        assert not replacements.is_empty()
+        self.assertEqual(['#EXTINF:1,M:\\U2\\One.mp3', '/srv/0-9/U2/One.mp3'],
+                         replacements.process(['#EXTINF:1,M:\\U2\\One.mp3',
+                                               'M:\\U2\\One.mp3']))
+
+    def test_relocate_cmd(self):
+        """Exercise the relocate sub-command"""
+
+        pls = os.path.join(self._tmp, 'in.m3u')
+        with open(pls, 'wb') as fh:
+            fh.write('#EXTM3U\r\n#EXTINF:1,Björk - Army of Me\r\n'
+                     'M:\\Björk\\Army of Me.mp3\r\n#EXTINF:2,U2 - One\r\n'
+                     'M:\\U2\\One.mp3  \r\nM:\\U2\\Two.mp3\r\n'.encode('cp1252'))
+        out = os.path.join(self._tmp, 'out')
+        os.mkdir(out)
+        with captured_output() as (stdout, stderr):
+            rubepl.main(['relocate', '-m', self._map, '-u', '-b', '-o', out, pls])
+        assert 'relocated 2 tracks.' in stdout.getvalue()
+        with open(os.path.join(out, 'in.m3u8'), 'rb') as fh:
+            data = fh.read()
+        self.assertEqual(codecs.BOM_UTF8 + '#EXTM3U\n#EXTINF:1,Björk - Army of Me\n'
+                         '/srv/B/Björk/Army of Me.mp3\n#EXTINF:2,U2 - One\n'
+                         '/srv/0-9/U2/One.mp3\nM:\\U2\\Two.mp3\n'.encode('utf-8'),
+                         data)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+"""Unit tests for the rubepl.repair module"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import rubepl
+import rubepl.repair
+
+from test.utils import captured_output
+
+class Fixture(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._lib = os.path.join(self._tmp, 'lib')
+        for artist in ('Abba', 'Blondie'):
+            for album in ('Gold', 'Live'):
+                d = os.path.join(self._lib, artist, album)
+                os.makedirs(d)
+                for track in ('01 Intro.mp3', '02 {0} {1}.mp3'.format(artist, album)):
+                    with open(os.path.join(d, track), 'w') as fh:
+                        fh.write(track)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def path(self, *parts):
+        return os.path.join(self._lib, *parts)
+
+    def test_repair(self):
+        """Exercise rubepl.repair.RepairIndex"""
+
+        index = rubepl.repair.RepairIndex([self._lib], 4)
+        assert 8 == len(index)
+
+        present = self.path('Abba', 'Gold', '01 Intro.mp3')
+        self.assertEqual(present, index.repair(present))
+
+        # Case
+        wrong = self.path('abba', 'GOLD', '02 abba gold.MP3')
+        self.assertEqual(self.path('Abba', 'Gold', '02 Abba Gold.mp3'),
+                         index.repair(wrong))
+        # Separators
+        wrong = self._lib + '\\Blondie\\Live\\02 Blondie Live.mp3'
+        self.assertEqual(self.path('Blondie', 'Live', '02 Blondie Live.mp3'),
+                         index.repair(wrong))
+        # Leading directories
+        wrong = 'M:\\Music\\Abba\\Live\\02 Abba Live.mp3'
+        self.assertEqual(self.path('Abba', 'Live', '02 Abba Live.mp3'),
+                         index.repair(wrong))
+        # Four files share this name, but only one is in 'Blondie\Gold'
+        wrong = 'M:\\Music\\blondie\\gold\\01 Intro.mp3'
+        self.assertEqual(self.path('Blondie', 'Gold', '01 Intro.mp3'),
+                         index.repair(wrong))
+        # ...& two are in a 'Live' directory
+        ambiguous = 'M:\\Music\\Live\\01 Intro.mp3'
+        self.assertEqual(ambiguous, index.repair(ambiguous))
+        unresolved = self.path('Abba', 'Gold', '03 Waterloo.mp3')
+        self.assertEqual(unresolved, index.repair(unresolved))
+
+        assert 1 == index.ok
+        assert 4 == index.fixed
+        self.assertEqual({ambiguous: sorted([self.path('Abba', 'Live', '01 Intro.mp3'),
+                                             self.path('Blondie', 'Live', '01 Intro.mp3')])},
+                         {k: sorted(v) for k, v in index.ambiguous.items()})
+        self.assertEqual({unresolved}, index.unresolved)
+        report = index.report()
+        self.assertEqual('1 tracks present, 4 repaired, 1 ambiguous, 1 unresolved.',
+                         report[0])
+        assert 3 == len(report)
+
+        # Relative locations are taken relative to the given base, not the
+        # working directory
+        relative = os.path.join('Gold', '01 Intro.mp3')
+        self.assertEqual(relative, index.repair(relative, self.path('Abba')))
+        self.assertEqual(self.path('Blondie', 'Live', '01 Intro.mp3'),
+                         index.repair('01 intro.mp3', self.path('Blondie', 'Live')))
+        assert 2 == index.ok
+        assert 5 == index.fixed
+
+        sig = index.signature()
+        os.remove(self.path('Abba', 'Gold', '01 Intro.mp3'))
+        assert sig != rubepl.repair.RepairIndex([self._lib]).signature()
+
+    def write_playlist(self, name, locations):
+        pls = os.path.join(self._tmp, name)
+        with open(pls, 'w', encoding='utf-8') as fh:
+            fh.write('#EXTM3U\n')
+            for location in locations:
+                fh.write('#EXTINF:1,M:\\Music\\x.mp3\n{0}\n'.format(location))
+        return pls
+
+    def test_normalize_cmd(self):
+        """Exercise normalize-m3u --repair-root"""
+
+        pls = self.write_playlist('pls.m3u8', [
+            'M:\\Music\\ABBA\\Gold\\02 Abba Gold.mp3',
+            'M:\\Music\\Nobody\\01 Nothing.mp3'])
+        out = os.path.join(self._tmp, 'out')
+        os.mkdir(out)
+        with captured_output() as (stdout, stderr):
+            rubepl.main(['normalize-m3u', '-u', '-o', out, '-R', self._lib, pls])
+        with open(os.path.join(out, 'pls.m3u8'), encoding='utf-8') as fh:
+            lines = fh.read().split('\n')
+        self.assertEqual(['#EXTM3U',
+                          '#EXTINF:1,M:\\Music\\x.mp3',
+                          self.path('Abba', 'Gold', '02 Abba Gold.mp3'),
+                          '#EXTINF:1,M:\\Music\\x.mp3',
+                          'M:\\Music\\Nobody\\01 Nothing.mp3', ''], lines)
+
+    def test_relative(self):
+        """Relative entries are repaired against their playlist's directory"""
+
+        relative = os.path.join('lib', 'Abba', 'Gold', '01 Intro.mp3')
+        pls = self.write_playlist('pls.m3u8', [
+            relative, os.path.join('lib', 'abba', 'live', '01 intro.mp3')])
+        out = os.path.join(self._tmp, 'out')
+        os.mkdir(out)
+        with captured_output() as (stdout, stderr):
+            rubepl.main(['normalize-m3u', '-u', '-o', out, '-R', self._lib, pls])
+        with open(os.path.join(out, 'pls.m3u8'), encoding='utf-8') as fh:
+            lines = fh.read().split('\n')
+        self.assertEqual([relative, self.path('Abba', 'Live', '01 Intro.mp3')],
+                         lines[2:5:2])
+
+        with captured_output() as (stdout, stderr):
+            rubepl.main(['get-tracks', '-R', self._lib, pls])
+        self.assertEqual([relative, self.path('Abba', 'Live', '01 Intro.mp3')],
+                         stdout.getvalue().split('\n')[:-1])
+        assert '1 tracks present, 1 repaired' in stderr.getvalue()
+
+    def test_get_tracks_cmd(self):
+        """Exercise get-tracks --repair-root"""
+
+        good = self.path('Blondie', 'Live', '02 Blondie Live.mp3')
+        pls = self.write_playlist('pls.m3u8', [
+            good, 'M:\\Music\\blondie\\live\\02 blondie live.mp3',
+            'M:\\Music\\Nobody\\01 Nothing.mp3'])
+        with captured_output() as (out, err):
+            rubepl.main(['get-tracks', '-R', self._lib, pls])
+        self.assertEqual([good, 'M:\\Music\\Nobody\\01 Nothing.mp3'],
+                         out.getvalue().split('\n')[:-1])
+        assert 'unresolved: M:\\Music\\Nobody\\01 Nothing.mp3' in err.getvalue()
+
+        with captured_output() as (out, err):
+            rubepl.main(['get-tracks', '-m', '-R', self._lib, pls])
+        self.assertEqual(['M:\\Music\\Nobody\\01 Nothing.mp3'],
+                         out.getvalue().split('\n')[:-1])
+
+if __name__ == '__main__':
+    unittest.main()
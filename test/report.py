@@ -0,0 +1,80 @@
+"""Unit tests for the rubepl.report module"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import rubepl
+import rubepl.report
+
+from test.utils import captured_output
+
+class Fixture(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def write_playlist(self, name, tracks):
+        pls = os.path.join(self._tmp, name)
+        with open(pls, 'w', encoding='utf-8') as fh:
+            fh.write('#EXTM3U\n')
+            for i in tracks:
+                fh.write('#EXTINF:1,Track {0}\n/m/{0}.mp3\n'.format(i))
+        return pls
+
+    def test_minhash(self):
+        """Exercise rubepl.report.minhash"""
+
+        assert rubepl.report.minhash([]) is None
+        # Few tracks leave most bins empty; the estimate should hold anyway
+        for n in (3, 30, 3000):
+            a = ['/m/{0}.mp3'.format(i) for i in range(n)]
+            b = a[n//4:] + ['/m/x{0}.mp3'.format(i) for i in range(n//4)]
+            sa = rubepl.report.minhash(a)
+            assert rubepl.report.NUM_HASHES == len(sa)
+            self.assertEqual(sa, rubepl.report.minhash(reversed(a)))
+            self.assertEqual(1.0, rubepl.report.similarity(sa, sa))
+            if n > 3:
+                # True similarity: 0.6
+                s = rubepl.report.similarity(sa, rubepl.report.minhash(b))
+                assert 0.4 < s < 0.8, s
+        self.assertEqual(0.0, rubepl.report.similarity(
+            rubepl.report.minhash(['/m/1.mp3']),
+            rubepl.report.minhash(['/m/2.mp3'])))
+
+    def test_report(self):
+        """Exercise rubepl.report.PlaylistReport"""
+
+        report = rubepl.report.PlaylistReport()
+        report.add('a', ['/m/{0}.mp3'.format(i) for i in range(100)])
+        report.add('b', ['/m/{0}.mp3'.format(i) for i in range(5, 100)] * 2)
+        report.add('c', ['/m/{0}.mp3'.format(i) for i in range(90, 200)])
+        report.add('d', [])
+        self.assertEqual([('/m/90.mp3', 3)], report.most_used(1))
+        pairs = report.similar_pairs()
+        self.assertEqual([('a', 'b')], [(a, b) for s, a, b in pairs])
+        assert 0.85 < pairs[0][0]
+        # (an empty playlist is like no other)
+        for s, a, b in report.similar_pairs(0.0):
+            assert 'd' != a and 'd' != b
+
+    def test_report_cmd(self):
+        """Exercise the report sub-command"""
+
+        a = self.write_playlist('a.m3u8', range(50))
+        b = self.write_playlist('b.m3u8', range(50))
+        c = self.write_playlist('c.m3u8', [0] + list(range(100, 150)))
+        with captured_output() as (out, err):
+            rubepl.main(['report', '--processes', '1', '-n', '1', a, b, c])
+        self.assertEqual(['# tracks in the most playlists',
+                          '3\t/m/0.mp3',
+                          '# most similar playlists',
+                          '1.00\t{0}\t{1}'.format(a, b)],
+                         out.getvalue().split('\n')[:-1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -5,6 +5,7 @@ import shutil
 import tempfile
 import unittest
 
+import rubepl.manifest
 import rubepl.rhythmbox
 
 from test.utils import captured_output
@@ -184,3 +185,71 @@ class Fixture(unittest.TestCase):
         with open(os.path.join(self._tmp, 'Athens 2002.m3u'), 'r') as fh:
             text = fh.read()
             assert text == self._ATHENS
+
+    def test_playlists_xml_to_m3u_incremental(self):
+        """Exercise rubepl.rhythmbox.playlists_xml_to_m3u with a manifest"""
+
+        manifest = rubepl.manifest.Manifest(self._tmp)
+        rubepl.rhythmbox.playlists_xml_to_m3u(self._pl, self._db,
+                                              output=self._tmp,
+                                              manifest=manifest)
+        manifest.save()
+        assert 2 == manifest.written
+
+        manifest = rubepl.manifest.Manifest(self._tmp)
+        rubepl.rhythmbox.playlists_xml_to_m3u(self._pl, self._db,
+                                              output=self._tmp,
+                                              manifest=manifest)
+        assert 2 == manifest.skipped and 0 == manifest.rendered
+        with open(os.path.join(self._tmp, 'Athens 2002.m3u'), 'r') as fh:
+            assert fh.read() == self._ATHENS
+
+    def test_update_playlists_xml(self):
+        """Exercise rubepl.rhythmbox.update_playlists_xml & the
+        put-playlists-xml sub-command"""
+
+        # Export both playlists & put them back: nothing should change
+        rubepl.rhythmbox.playlists_xml_to_m3u(self._pl, self._db, utf8=True,
+                                              output=self._tmp)
+        out = os.path.join(self._tmp, 'playlists.xml')
+        with captured_output():
+            rubepl.main(['put-playlists-xml', '-o', out, self._pl,
+                         os.path.join(self._tmp, 'Fall 2013.m3u8'),
+                         os.path.join(self._tmp, 'Athens 2002.m3u8')])
+        with open(self._pl, 'rb') as a, open(out, 'rb') as b:
+            self.assertEqual(a.read(), b.read())
+
+        tracks = ['/mnt/Took-Hall/mp3/B/Björk - Jóga.mp3',
+                  '/mnt/Took-Hall/mp3/S/Simon & Garfunkel - America.mp3']
+        replaced, added = rubepl.rhythmbox.update_playlists_xml(
+            out, [('Athens 2002', tracks[:1]), ('New & Improved', tracks)])
+        assert 1 == replaced and 1 == added
+        pls = rubepl.rhythmbox.get_playlists(out)
+        self.assertEqual([('Athens 2002', tracks[:1]),
+                          ('Fall 2013', rubepl.rhythmbox.get_playlists(
+                              self._pl)[1][1]),
+                          ('New & Improved', tracks)], pls)
+        with open(self._pl, 'rb') as fh:
+            before = fh.read()
+        with open(out, 'rb') as fh:
+            after = fh.read()
+        # Everything up to the replaced playlist is untouched, as are its
+        # attributes
+        start = before.index(b'  <playlist name="Athens 2002"')
+        assert before[:start] == after[:start]
+        assert after[start:].startswith(before[start:before.index(b'\n', start)])
+        assert b'type="queue"/>\n  <playlist name="New &amp; Improved"' in after
+
+        self.assertRaises(ValueError, rubepl.rhythmbox.update_playlists_xml,
+                          out, [('Recently Added', tracks)])
+
+        # Prefixes are rewritten before relative locations are resolved
+        pls = os.path.join(self._tmp, 'Windows.m3u')
+        with open(pls, 'w') as fh:
+            fh.write('#EXTM3U\nM:\\Music\\A\\b.mp3\nA/c.mp3\n')
+        with captured_output():
+            rubepl.main(['put-playlists-xml', '-P', 'M:\\Music=/srv/music',
+                         out, pls])
+        self.assertEqual(['/srv/music/A/b.mp3',
+                          os.path.join(self._tmp, 'A', 'c.mp3')],
+                         dict(rubepl.rhythmbox.get_playlists(out))['Windows'])
@@ -0,0 +1,129 @@
+"""Unit tests for the rubepl.sync module"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import rubepl
+import rubepl.sync
+
+from test.utils import captured_output
+
+class Fixture(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._src = os.path.join(self._tmp, 'music')
+        self._dest = os.path.join(self._tmp, 'player')
+        self._tracks = []
+        for i, name in enumerate(['A/Army of Me.mp3', 'B/Björk/Hyper.mp3',
+                                  'B/Björk/Joga.flac']):
+            path = os.path.join(self._src, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as fh:
+                fh.write(bytes([i]) * (1000 + i))
+            self._tracks.append(path)
+        self._pls = os.path.join(self._tmp, 'mix.m3u8')
+        with open(self._pls, 'w', encoding='utf-8') as fh:
+            fh.write('#EXTM3U\n')
+            for track in self._tracks[:2] + ['/nowhere/x.mp3',
+                                             self._tracks[0]]:
+                fh.write('#EXTINF:1,x\n{0}\n'.format(track))
+        self._pls2 = os.path.join(self._tmp, 'other.m3u8')
+        with open(self._pls2, 'w', encoding='utf-8') as fh:
+            # Relative to the playlist, not the working directory
+            fh.write('#EXTM3U\n{0}\n'.format(os.path.relpath(self._tracks[2],
+                                                            self._tmp)))
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def dest(self, i):
+        return os.path.join(self._dest, os.path.relpath(self._tracks[i],
+                                                        self._src))
+
+    def sync(self, *args):
+        with captured_output() as (out, err):
+            rubepl.main(['sync', '-u', '--processes', '1'] + list(args) +
+                        [self._dest, self._pls, self._pls2])
+        return out.getvalue()
+
+    def test_plan(self):
+        """Exercise rubepl.sync.plan_sync"""
+
+        plan = rubepl.sync.plan_sync(self._tracks + ['/nowhere/x.mp3'],
+                                     self._src, self._dest)
+        self.assertEqual([self.dest(i) for i in range(3)],
+                         [xfer.dst for xfer in plan.transfers])
+        self.assertEqual(['/nowhere/x.mp3'], plan.missing)
+        assert 0 == plan.current
+
+        counts = rubepl.sync.run_plan(plan)
+        assert 3 == counts['copied'] and 3003 == counts['bytes']
+        for i in range(3):
+            with open(self._tracks[i], 'rb') as a, open(self.dest(i), 'rb') as b:
+                self.assertEqual(a.read(), b.read())
+            self.assertEqual(os.stat(self._tracks[i]).st_mtime_ns,
+                             os.stat(self.dest(i)).st_mtime_ns)
+
+        plan = rubepl.sync.plan_sync(self._tracks, self._src, self._dest)
+        assert 3 == plan.current and not plan.transfers
+        plan = rubepl.sync.plan_sync(self._tracks, os.path.join(self._src, 'B'),
+                                     self._dest)
+        self.assertEqual([self._tracks[0]], plan.outside)
+
+    def test_relative_dest(self):
+        """A relative destination should be found up-to-date on a second run"""
+
+        dest = os.path.relpath(self._dest)
+        plan = rubepl.sync.plan_sync(self._tracks, self._src, dest)
+        assert 3 == len(plan.transfers)
+        rubepl.sync.run_plan(plan)
+        plan = rubepl.sync.plan_sync(self._tracks, self._src, dest)
+        assert not plan.transfers and 3 == plan.current
+
+    def test_sync_cmd(self):
+        """Exercise the sync sub-command"""
+
+        out = self.sync('-n')
+        self.assertEqual(['{0}\t{1}'.format(self._tracks[i], self.dest(i))
+                          for i in range(3)],
+                         sorted(line for line in out.split('\n') if '\t' in line))
+        assert not os.path.exists(self._dest)
+
+        self.sync()
+        for i in range(3):
+            assert os.path.isfile(self.dest(i))
+        with open(os.path.join(self._dest, 'mix.m3u8'), encoding='utf-8') as fh:
+            self.assertEqual(['#EXTM3U', '#EXTINF:1,x', self.dest(0),
+                              '#EXTINF:1,x', self.dest(1)],
+                             fh.read().split('\n')[:5])
+
+        # Simulate an interrupted run: a half-copied track, & a track that
+        # was never copied; both are put right, & nothing else is copied
+        partial = os.path.join(os.path.dirname(self.dest(1)),
+                               '.Hyper.mp3' + rubepl.sync.PARTIAL_SUFFIX)
+        with open(partial, 'wb') as fh:
+            fh.write(b'\1' * 10)
+        os.remove(self.dest(1))
+        with open(self.dest(2), 'wb') as fh:
+            fh.write(b'\2' * 10)
+        out = self.sync()
+        assert '2 copied' in out and '1 up-to-date' in out, out
+        assert not os.path.exists(partial)
+        self.assertEqual(1002, os.path.getsize(self.dest(2)))
+
+        # Hard links
+        shutil.rmtree(self._dest)
+        out = self.sync('--link', '-L', '/sdcard/Music')
+        assert '3 linked' in out, out
+        self.assertEqual(os.stat(self._tracks[0]).st_ino,
+                         os.stat(self.dest(0)).st_ino)
+        with open(os.path.join(self._dest, 'other.m3u8'),
+                  encoding='utf-8') as fh:
+            self.assertEqual('#EXTM3U\n/sdcard/Music/B/Björk/Joga.flac\n',
+                             fh.read())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+"""Unit tests for the rubepl.tags module"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import rubepl.tags
+
+from rubepl.tags import Tags
+
+def _syncsafe(n):
+    return bytes([(n >> 21) & 0x7f, (n >> 14) & 0x7f, (n >> 7) & 0x7f,
+                  n & 0x7f])
+
+def _id3v2(major, frames, padding=0):
+    """Return an ID3v2 tag of version 2.'major' holding 'frames', a list of
+    (id, body) pairs."""
+
+    body = b''
+    for fid, data in frames:
+        if 2 == major:
+            body += fid + len(data).to_bytes(3, 'big') + data
+        elif 3 == major:
+            body += fid + len(data).to_bytes(4, 'big') + b'\0\0' + data
+        else:
+            body += fid + _syncsafe(len(data)) + b'\0\0' + data
+    body += b'\0' * padding
+    return b'ID3' + bytes([major, 0, 0]) + _syncsafe(len(body)) + body
+
+def _id3v1(title, artist):
+    return b'TAG' + title.encode('latin-1').ljust(30, b'\0') + \
+        artist.encode('latin-1').ljust(30, b'\0') + b'\0' * 65
+
+def _vorbis(comments):
+    data = (6).to_bytes(4, 'little') + b'vendor' + \
+        len(comments).to_bytes(4, 'little')
+    for comment in comments:
+        comment = comment.encode('utf-8')
+        data += len(comment).to_bytes(4, 'little') + comment
+    return data
+
+class Fixture(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def write(self, name, data):
+        path = os.path.join(self._tmp, name)
+        with open(path, 'wb') as fh:
+            fh.write(data)
+        return path
+
+    def test_read_tags(self):
+        """Exercise rubepl.tags.read_tags"""
+
+        audio = b'\xff\xfb' + b'\0' * 4000
+        # Cover art first, to be skipped over
+        apic = b'\0image/jpeg\0\x03\0' + b'\x89' * 100000
+        path = self.write('v3.mp3', _id3v2(3, [
+            (b'APIC', apic), (b'TPE1', b'\0Pogues, The'),
+            (b'TIT2', b'\x01' + 'Lorca\'s Novena'.encode('utf-16'))],
+                                           512) + audio)
+        self.assertEqual(Tags('Pogues, The', 'Lorca\'s Novena'),
+                         rubepl.tags.read_tags(path))
+
+        path = self.write('v4.mp3', _id3v2(4, [
+            (b'TIT2', b'\x03Army of Me\0'),
+            (b'TPE1', b'\x03' + 'Björk'.encode('utf-8'))]) + audio)
+        self.assertEqual(Tags('Björk', 'Army of Me'),
+                         rubepl.tags.read_tags(path))
+
+        # v2.2, missing the artist, which ID3v1 supplies
+        path = self.write('v2.mp3', _id3v2(2, [(b'TT2', b'\0One')]) + audio +
+                          _id3v1('Won', 'U2'))
+        self.assertEqual(Tags('U2', 'One'), rubepl.tags.read_tags(path))
+
+        path = self.write('v1.mp3', audio + _id3v1('One', 'U2'))
+        self.assertEqual(Tags('U2', 'One'), rubepl.tags.read_tags(path))
+
+        picture = b'\x06' + (100000).to_bytes(3, 'big') + b'\0' * 100000
+        comment = _vorbis(['title=Glentrasna', 'ARTIST=Lunasa'])
+        path = self.write('a.flac', b'fLaC' + b'\0' + (34).to_bytes(3, 'big') +
+                          b'\0' * 34 + picture + b'\x84' +
+                          len(comment).to_bytes(3, 'big') + comment + audio)
+        self.assertEqual(Tags('Lunasa', 'Glentrasna'),
+                         rubepl.tags.read_tags(path))
+
+        path = self.write('none.mp3', audio)
+        self.assertEqual(Tags(None, None), rubepl.tags.read_tags(path))
+        self.assertEqual(Tags(None, None), rubepl.tags.read_tags(
+            self.write('empty.mp3', b'')))
+
+    def test_cache(self):
+        """Exercise rubepl.tags.TagCache"""
+
+        db = os.path.join(self._tmp, 'tags.db')
+        a = self.write('a.mp3', _id3v2(3, [(b'TPE1', b'\0U2'),
+                                           (b'TIT2', b'\0One')]))
+        b = self.write('b.mp3', _id3v1('Wild Horses', 'Rolling Stones, The'))
+        missing = os.path.join(self._tmp, 'missing.mp3')
+
+        with rubepl.tags.TagCache(db) as cache:
+            self.assertEqual([(a, Tags('U2', 'One')), (missing, None),
+                              (b, Tags('Rolling Stones, The', 'Wild Horses')),
+                              (a, Tags('U2', 'One'))],
+                             cache.read([a, missing, b, a]))
+            assert 2 == cache.examined and 0 == cache.cached
+
+        os.utime(b, ns=(0, 0))
+        with rubepl.tags.TagCache(db) as cache:
+            self.assertEqual([(a, Tags('U2', 'One')),
+                              (b, Tags('Rolling Stones, The', 'Wild Horses'))],
+                             cache.read([a, b]))
+            assert 1 == cache.examined and 1 == cache.cached
+
+if __name__ == '__main__':
+    unittest.main()
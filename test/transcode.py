@@ -0,0 +1,111 @@
+"""Unit tests for the rubepl.transcode module"""
+
+import codecs
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+import rubepl.m3u
+import rubepl.transcode
+
+from rubepl.decode import choose_codec, iter_decoded_lines
+from rubepl.encode import encode_line
+from rubepl.writer import PlaylistWriter
+
+# (name, contents) pairs covering the corner cases of M3U normalization
+CASES = [
+    ('plain.m3u8', b'#EXTM3U\n/a/b.mp3\n/a/c.mp3\n'),
+    ('bom.m3u8', codecs.BOM_UTF8 + b'#EXTM3U\n/a/b.mp3\n'),
+    ('bom-only.m3u8', codecs.BOM_UTF8),
+    ('empty.m3u8', b''),
+    ('crlf.m3u8', b'#EXTM3U\r\n/a/b.mp3\r\n\r\n/a/c.mp3\r\n'),
+    ('cr.m3u8', b'#EXTM3U\r/a/b.mp3\r/a/c.mp3'),
+    ('trailing.m3u8', b'#EXTM3U \t\n/a/b.mp3  \n\t/a/c.mp3\t'),
+    ('unterminated.m3u8', b'#EXTM3U\n/a/b.mp3'),
+    ('utf8.m3u8', '/a/Björk/Jóga.mp3\n'.encode('utf-8')),
+    ('fallback.m3u8', b'/a/Bj\xf6rk.mp3\n/a/\xe2\x80\x94.mp3\n'),
+    ('cp1252.m3u', b'#EXTM3U\r\n/a/Bj\xf6rk.mp3  \r\n/a/\x93q\x94.mp3\r\n'),
+    ('cp1252-bom.m3u', codecs.BOM_UTF8 + b'/a/b.mp3\n'),
+]
+
+class Fixture(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def _expected(self, filename, outcp, use_bom, linesep):
+        """Normalize 'filename' the slow way, a line at a time"""
+
+        lines = [encode_line(line)
+                 for line in iter_decoded_lines(filename, None)]
+        if use_bom and lines and not lines[0].startswith('\ufeff'):
+            lines[0] = '\ufeff' + lines[0]
+        return PlaylistWriter(outcp, linesep).encode(lines)
+
+    def _check(self, name, data, outcp, use_bom, linesep, block_size):
+        filename = os.path.join(self._tmp, name)
+        with open(filename, 'wb') as fh:
+            fh.write(data)
+        incp, errs = choose_codec(filename, None)
+        with open(filename, 'rb') as fh:
+            got = b''.join(rubepl.transcode.iter_normalized(
+                fh, incp, errs, outcp, use_bom, linesep, block_size))
+        self.assertEqual(self._expected(filename, outcp, use_bom, linesep),
+                         got, '{0} ({1}, {2}, {3!r}, {4})'.format(
+                             name, outcp, use_bom, linesep, block_size))
+
+    def test_equivalence(self):
+        """Check iter_normalized against line-at-a-time normalization"""
+
+        for name, data in CASES:
+            for outcp, use_bom in (('utf_8', False), ('utf_8', True),
+                                   ('cp1252', False)):
+                if 'cp1252' == outcp and \
+                   ('utf8' in name or 'fallback' in name):
+                    continue # not representable in cp1252
+                for linesep in ('\n', '\r\n'):
+                    for block_size in (3, 7, 1 << 20):
+                        self._check(name, data, outcp, use_bom, linesep,
+                                    block_size)
+
+    def test_is_ascii_compatible(self):
+        """Exercise rubepl.transcode.is_ascii_compatible"""
+
+        assert rubepl.transcode.is_ascii_compatible('utf_8')
+        assert rubepl.transcode.is_ascii_compatible('UTF8')
+        assert rubepl.transcode.is_ascii_compatible('cp1252')
+        assert not rubepl.transcode.is_ascii_compatible('utf_16')
+        assert not rubepl.transcode.is_ascii_compatible('cp037')
+
+    def test_pass_through(self):
+        """Input already in normal form should be passed through as-is"""
+
+        data = b'#EXTM3U\n/a/b.mp3\n'
+        blocks = list(rubepl.transcode.iter_normalized(
+            io.BytesIO(data), 'utf_8', 'strict', 'utf_8', False, '\n'))
+        assert 1 == len(blocks)
+        assert isinstance(blocks[0], memoryview)
+        assert data == bytes(blocks[0])
+
+    def test_normalize_m3u_playlist(self):
+        """normalize_m3u_playlist should take the byte path when it can"""
+
+        inf = os.path.join(self._tmp, 'in.m3u')
+        with open(inf, 'wb') as fh:
+            fh.write(b'#EXTM3U  \r\n/a/Bj\xf6rk.mp3\r\n')
+        outf = os.path.join(self._tmp, 'out.m3u8')
+        rubepl.m3u.normalize_m3u_playlist('out', inf, '',
+                                          rubepl.m3u.Replacements(None),
+                                          utf8=True, use_bom=True,
+                                          output=self._tmp)
+        with open(outf, 'rb') as fh:
+            assert (codecs.BOM_UTF8 + '#EXTM3U{0}/a/Björk.mp3{0}'.
+                    format(os.linesep).encode('utf-8')) == fh.read()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+"""Unit tests for the rubepl.usage module"""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import rubepl
+import rubepl.rhythmbox
+import rubepl.usage
+
+from test.utils import captured_output
+
+class Fixture(unittest.TestCase):
+
+    _WINAMP = 'test/resources/Winamp/Plugins/ml/playlists/playlists.xml'
+    _RHYTHMBOX = 'test/resources/rhythmbox/playlists.xml'
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+        self._db = os.path.join(self._tmp, 'usage.db')
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def write_playlist(self, name, locations):
+        pls = os.path.join(self._tmp, name)
+        with open(pls, 'w', encoding='utf-8') as fh:
+            fh.write('#EXTM3U\n')
+            for location in locations:
+                fh.write('#EXTINF:1,x\n{0}\n'.format(location))
+        return pls
+
+    def test_index(self):
+        """Exercise rubepl.usage.UsageIndex"""
+
+        a = self.write_playlist('a.m3u8', ['/m/1.mp3', '/m/2.mp3', '/m/1.mp3'])
+        b = self.write_playlist('b.m3u8', ['/m/2.mp3', '/m/Björk.mp3'])
+
+        with rubepl.usage.UsageIndex(self._db) as index:
+            index.update([a, b])
+            assert 2 == index.read
+            assert 2 == len(index)
+            got = dict(index.where_used(['/m/1.mp3', '/m/2.mp3',
+                                         '/m/Björk.mp3', '/m/3.mp3']))
+        self.assertEqual([('a', 1, a), ('a', 3, a)], got['/m/1.mp3'])
+        self.assertEqual([('a', 2, a), ('b', 1, b)], got['/m/2.mp3'])
+        self.assertEqual([('b', 2, b)], got['/m/Björk.mp3'])
+        self.assertEqual([], got['/m/3.mp3'])
+
+        # Unchanged playlists aren't re-read...
+        with rubepl.usage.UsageIndex(self._db) as index:
+            index.update([a, b])
+            assert 0 == index.read and 2 == index.skipped
+        # ...but changed ones are, & deleted ones are dropped
+        self.write_playlist('a.m3u8', ['/m/3.mp3'])
+        os.utime(a, ns=(0, 0))
+        os.remove(b)
+        with rubepl.usage.UsageIndex(self._db) as index:
+            index.update([a])
+            assert 1 == index.read
+            assert 1 == len(index)
+            got = dict(index.where_used(['/m/1.mp3', '/m/2.mp3', '/m/3.mp3']))
+        self.assertEqual({'/m/1.mp3': [], '/m/2.mp3': [],
+                          '/m/3.mp3': [('a', 1, a)]}, got)
+
+    def test_winamp_rhythmbox(self):
+        """Index Winamp & Rhythmbox playlists"""
+
+        with rubepl.usage.UsageIndex(self._db) as index:
+            index.update(winamp=[self._WINAMP], rhythmbox=[self._RHYTHMBOX])
+            assert 0 < index.read
+            playlists = rubepl.rhythmbox.get_playlists(self._RHYTHMBOX)
+            title, tracks = playlists[0]
+            got = dict(index.where_used(tracks))
+        for position, location in enumerate(tracks, 1):
+            assert (title, position, os.path.abspath(self._RHYTHMBOX)) in \
+                got[location]
+
+    def test_commands(self):
+        """Exercise the index & where-used sub-commands"""
+
+        a = self.write_playlist('a.m3u8', ['/m/1.mp3', '/m/2.mp3'])
+        b = self.write_playlist('b.m3u8', ['/m/2.mp3'])
+        with captured_output() as (out, err):
+            rubepl.main(['index', '-D', self._db, a, b])
+
+        with captured_output() as (out, err):
+            rubepl.main(['where-used', '-D', self._db, '/m/2.mp3', '/m/3.mp3'])
+        self.assertEqual(['/m/2.mp3\t2\ta\t' + a, '/m/2.mp3\t1\tb\t' + b],
+                         out.getvalue().split('\n')[:-1])
+
+        query = os.path.join(self._tmp, 'query')
+        with open(query, 'w') as fh:
+            fh.write('/m/1.mp3\n/m/3.mp3\n/m/4.mp3\n')
+        with captured_output() as (out, err):
+            rubepl.main(['where-used', '-D', self._db, '-u', '-f', query])
+        self.assertEqual(['/m/3.mp3', '/m/4.mp3'],
+                         out.getvalue().split('\n')[:-1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+"""Unit tests for the rubepl.writer module"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+import rubepl.writer
+
+class Fixture(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def test_atomic_write(self):
+        """Exercise rubepl.writer.atomic_write"""
+
+        path = os.path.join(self._tmp, 'x.m3u')
+        stats = rubepl.writer.atomic_write(path, b'123\n', fsync=True)
+        assert 4 == stats.bytes
+        assert 0 <= stats.latency
+        os.chmod(path, 0o640)
+        rubepl.writer.atomic_write(path, b'4567\n')
+        with open(path, 'rb') as fh:
+            assert b'4567\n' == fh.read()
+        # Permissions are preserved & no temporaries are left behind
+        assert 0o640 == os.stat(path).st_mode & 0o777
+        assert ['x.m3u'] == os.listdir(self._tmp)
+
+        # New files get the permissions open() would have given them
+        umask = os.umask(0o027)
+        try:
+            rubepl.writer.atomic_write(os.path.join(self._tmp, 'y.m3u'), b'')
+        finally:
+            os.umask(umask)
+        assert 0o640 == os.stat(os.path.join(self._tmp, 'y.m3u')).st_mode & 0o777
+
+    def test_atomic_write_failure(self):
+        """atomic_write should leave the destination untouched on failure"""
+
+        path = os.path.join(self._tmp, 'x.m3u')
+        rubepl.writer.atomic_write(path, b'123\n')
+        self.assertRaises(TypeError, rubepl.writer.atomic_write, path, 'text')
+        with open(path, 'rb') as fh:
+            assert b'123\n' == fh.read()
+        assert ['x.m3u'] == os.listdir(self._tmp)
+
+    def test_playlist_writer(self):
+        """Exercise rubepl.writer.PlaylistWriter"""
+
+        writer = rubepl.writer.PlaylistWriter('cp1252', '\r\n')
+        assert b'' == writer.encode([])
+        assert b'#EXTM3U\r\nD\xfcsseldorf.mp3\r\n' == \
+            writer.encode(['#EXTM3U', 'Düsseldorf.mp3'])
+
+        writer.write(os.path.join(self._tmp, 'a.m3u'), ['#EXTM3U', 'a.mp3'])
+        writer.write(os.path.join(self._tmp, 'b.m3u'), ['#EXTM3U', 'b.mp3'])
+        assert 2 == writer.files
+        assert 32 == writer.bytes
+
+    def test_iter_encode(self):
+        """PlaylistWriter should encode large playlists in bounded buffers"""
+
+        writer = rubepl.writer.PlaylistWriter('utf_8', '\n', buffer_size=64)
+        lines = ('track-{0:04}.mp3'.format(i) for i in range(100))
+        chunks = list(writer.iter_encode(lines))
+        assert 1 < len(chunks)
+        assert all(len(chunk) < 128 for chunk in chunks)
+        assert b''.join(chunks) == writer.encode(['track-{0:04}.mp3'.format(i)
+                                                   for i in range(100)])
+
+        path = os.path.join(self._tmp, 'x.m3u')
+        stats = writer.write(path, ('track-{0:04}.mp3'.format(i) for i in range(100)))
+        assert 1500 == stats.bytes == os.path.getsize(path)
+
+    def test_keep(self):
+        """atomic_write should discard the new file if asked"""
+
+        path = os.path.join(self._tmp, 'x.m3u')
+        rubepl.writer.atomic_write(path, b'123\n')
+        digests = []
+        def keep(hexdigest):
+            digests.append(hexdigest)
+            return False
+        stats = rubepl.writer.atomic_write(path, [b'4', b'56\n'], keep=keep)
+        assert 0 == stats.bytes
+        assert hashlib.sha1(b'456\n').hexdigest() == digests[0]
+        with open(path, 'rb') as fh:
+            assert b'123\n' == fh.read()
+        assert ['x.m3u'] == os.listdir(self._tmp)
+
+if __name__ == '__main__':
+    unittest.main()